@@ -7,6 +7,19 @@
 #define RELAY_CRYSTALBALL_7 11  // Crystal ball (confirmed)
 #define COMMS_PIN A2            // Input from Uno
 
+// === Host identity query (fortune-teller/device_discovery.py) ===
+const char ROLE_QUERY[] = "?ROLE";
+uint8_t roleMatch = 0;
+
+// === Host cue commands (fortune-teller/show_timeline.py) ===
+// One per line, e.g. "CUE candle1 ON"; answered with "OK candle1 ON"
+#define CUE_LINE_MAX 32
+char cueLine[CUE_LINE_MAX];
+uint8_t cueLength = 0;
+
+#define TRIGGER_POLL_MS 200
+unsigned long lastTriggerPoll = 0;
+
 // === Setup ===
 void setup() {
   Serial.begin(9600);
@@ -32,13 +45,77 @@ void setup() {
 // === Main Loop ===
 void loop() {
 
+  // Identity query from the host's device discovery. Matched byte by
+  // byte, since the query follows binary frame bytes meant for the printer
+  while (Serial.available() > 0) {
+    char c = Serial.read();
+    roleMatch = (c == ROLE_QUERY[roleMatch]) ? roleMatch + 1 : (c == ROLE_QUERY[0] ? 1 : 0);
+    if (roleMatch == sizeof(ROLE_QUERY) - 1) {
+      Serial.println("ROLE candles");
+      roleMatch = 0;
+    }
+
+    if (c == '\n') {
+      cueLine[cueLength] = '\0';
+      if (strncmp(cueLine, "CUE ", 4) == 0) {
+        runCue(cueLine + 4);
+      }
+      cueLength = 0;
+    } else if (c != '\r' && cueLength < CUE_LINE_MAX - 1) {
+      cueLine[cueLength++] = c;
+    }
+  }
+
   // If Uno sends LOW, run the show
-  if (digitalRead(COMMS_PIN) == LOW) {
-    Serial.println("Trigger detected.");
-    runCandleSequence();
+  if (millis() - lastTriggerPoll >= TRIGGER_POLL_MS) {
+    lastTriggerPoll = millis();
+    if (digitalRead(COMMS_PIN) == LOW) {
+      Serial.println("Trigger detected.");
+      runCandleSequence();
+    }
+  }
+}
+
+
+// === Host Cues ===
+// "<output> ON|OFF", or "all OFF"
+void runCue(char* cue) {
+  char* space = strchr(cue, ' ');
+  if (space == NULL) {
+    Serial.print("ERR ");
+    Serial.println(cue);
+    return;
   }
+  *space = '\0';
+  const char* name = cue;
+  const char* state = (strcmp(space + 1, "ON") == 0) ? "on" : "off";
+
+  if (strcmp(name, "all") == 0) {
+    allOff();
+  } else {
+    int pin = relayForName(name);
+    if (pin < 0) {
+      Serial.print("ERR ");
+      Serial.println(name);
+      return;
+    }
+    switchRelay(pin, state);
+  }
+
+  Serial.print("OK ");
+  Serial.print(name);
+  Serial.print(" ");
+  Serial.println(space + 1);
+}
 
-  delay(200); 
+int relayForName(const char* name) {
+  if (strcmp(name, "candle1") == 0) return RELAY_CANDLE_1;
+  if (strcmp(name, "candle2") == 0) return RELAY_CANDLE_2;
+  if (strcmp(name, "candle3") == 0) return RELAY_CANDLE_3;
+  if (strcmp(name, "fairy") == 0) return RELAY_FAIRYLIGHTS_4;
+  if (strcmp(name, "diffusers") == 0) return RELAY_DIFFUSERS_8;
+  if (strcmp(name, "crystal") == 0) return RELAY_CRYSTALBALL_7;
+  return -1;
 }
 
 
@@ -1563,6 +1563,69 @@ const int printerTxPin = 3; // Connect this pin to the RX pin of the printer
  
 SoftwareSerial printerSerial(printerRxPin, printerTxPin);
 
+// === Host link framing (matches fortune-teller/serial_protocol.py) ===
+// Frame: 0xAA | type | seq | len lo | len hi | payload | crc lo | crc hi
+// CRC16-CCITT (poly 0x1021, init 0xFFFF) over type..payload
+#define FRAME_START 0xAA
+#define FRAME_OPEN  0x01
+#define FRAME_CLOSE 0x02
+#define FRAME_PRINT 0x03
+#define FRAME_PING  0x04   // payload echoed back in DONE
+#define FRAME_BAUD  0x05   // payload: new link rate, uint32 little-endian
+#define FRAME_IDENT 0x06   // DONE payload is this board's role
+#define FRAME_PRINT_NOW 0x07  // print the payload without the candle ritual
+#define FRAME_CANDLES   0x08  // pulse CANDLE_COMMS to start the candle show
+#define FRAME_STAGE     0x09  // payload "<token>\n<fortune>": hold it, print the graphic
+#define FRAME_COMMIT    0x0A  // payload "<token>": print the held fortune
+#define FRAME_CANCEL    0x0B  // payload "<token>": drop the held fortune
+#define FRAME_RETRY 0x40   // set by the host on retransmissions
+#define FRAME_ACK   0x80   // frame received intact
+#define FRAME_NAK   0x81   // frame failed its CRC, host retransmits
+#define FRAME_DONE  0x82   // command finished, payload is status text
+#define MAX_PAYLOAD 400
+#define FRAME_BYTE_TIMEOUT 200  // ms to wait for the next byte of a frame
+#define CANDLE_PULSE 300        // ms CANDLE_COMMS is held LOW; the candle board polls every 200 ms
+
+// === Link rate negotiation ===
+// The sketch always boots at BASE_BAUD. After a FRAME_BAUD request it
+// switches rate and must see a valid frame within BAUD_CONFIRM_TIMEOUT,
+// otherwise it reverts. At a negotiated rate, MAX_LINK_ERRORS bad frames
+// or stray bytes in a row also send it back to BASE_BAUD.
+#define BASE_BAUD 9600
+#define BAUD_CONFIRM_TIMEOUT 1000
+#define MAX_LINK_ERRORS 8
+
+uint32_t linkRate = BASE_BAUD;
+bool baudPending = false;
+unsigned long baudDeadline = 0;
+uint8_t linkErrors = 0;
+
+enum RxState { RX_START, RX_TYPE, RX_SEQ, RX_LEN_LO, RX_LEN_HI, RX_PAYLOAD, RX_CRC_LO, RX_CRC_HI };
+
+RxState rxState = RX_START;
+uint8_t rxType = 0;
+uint8_t rxSeq = 0;
+uint16_t rxLen = 0;
+uint16_t rxIndex = 0;
+uint16_t rxCrc = 0;
+uint16_t rxCalc = 0;
+unsigned long rxLastByte = 0;
+char rxPayload[MAX_PAYLOAD + 1];
+
+// Last command executed, so a retransmission whose ACK was lost is not run twice
+int lastSeq = -1;
+uint8_t lastType = 0;
+const char *lastStatus = "";
+
+// Fortune staged by the host while the visitor is still answering. The
+// cookie graphic is the same on every slip, so it is printed at staging
+// time; the slip then waits in the printer for its text. A cancelled
+// visit leaves the graphic for the next fortune.
+#define STAGE_TOKEN_MAX 12
+char stagedToken[STAGE_TOKEN_MAX + 1] = "";
+char stagedText[MAX_PAYLOAD + 1];
+bool headPrinted = false;
+
 // Function to initialize the printer
 void initializePrinter() {
   printerSerial.write(27); // ESC
@@ -1655,7 +1718,17 @@ void printStarGraphic() {
 }
 
 // Function to print the fortune
-void printFortune(String fortuneText) {
+void printFortune(const char *fortuneText) {
+  printFortuneHead();
+  printFortuneBody(fortuneText);
+}
+
+// Everything above the text; skipped if a staged slip already has it
+void printFortuneHead() {
+  if (headPrinted) {
+    return;
+  }
+
   // Initialize printer
   initializePrinter();
   
@@ -1667,9 +1740,13 @@ void printFortune(String fortuneText) {
   
   // Print blank line between star and text
   // printerSerial.write("\n\n");
-  
+  headPrinted = true;
+}
+
+void printFortuneBody(const char *fortuneText) {
   // Print the fortune message
   printerSerial.print(fortuneText);
+  headPrinted = false;
   // delay(3000);
   
   // Feed paper to cut line
@@ -1680,8 +1757,270 @@ void printFortune(String fortuneText) {
   Serial.println("Fortune printed successfully!");
 }
  
+uint16_t crc16Update(uint16_t crc, uint8_t b) {
+  crc ^= (uint16_t)b << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, uint8_t seq, const char *payload) {
+  uint16_t len = strlen(payload);
+  uint8_t header[4] = { type, seq, (uint8_t)(len & 0xFF), (uint8_t)(len >> 8) };
+  uint16_t crc = 0xFFFF;
+
+  Serial.write(FRAME_START);
+  for (uint8_t i = 0; i < 4; i++) {
+    Serial.write(header[i]);
+    crc = crc16Update(crc, header[i]);
+  }
+  for (uint16_t i = 0; i < len; i++) {
+    Serial.write((uint8_t)payload[i]);
+    crc = crc16Update(crc, (uint8_t)payload[i]);
+  }
+  Serial.write((uint8_t)(crc & 0xFF));
+  Serial.write((uint8_t)(crc >> 8));
+}
+
+bool isSupportedRate(uint32_t rate) {
+  return rate == 9600 || rate == 19200 || rate == 38400 || rate == 57600 || rate == 115200;
+}
+
+void switchLinkRate(uint32_t rate) {
+  Serial.flush();  // finish sending at the old rate
+  Serial.end();
+  Serial.begin(rate);
+  linkRate = rate;
+  linkErrors = 0;
+  rxState = RX_START;
+}
+
+// Called for every corrupt frame or stray byte. Harmless at BASE_BAUD,
+// but at a negotiated rate a run of them means the host has fallen back.
+void noteLinkError() {
+  if (linkRate != BASE_BAUD && ++linkErrors >= MAX_LINK_ERRORS) {
+    switchLinkRate(BASE_BAUD);
+    baudPending = false;
+    Serial.println("Link errors, back to 9600 baud");
+  }
+}
+
+// Feed bytes from the host through the frame parser.
+// Returns true when a complete frame with a valid CRC is in rx*.
+// A corrupt frame is NAKed and the parser goes back to hunting for
+// the next start byte, so one lost byte costs one retransmission
+// instead of a merged or truncated message.
+bool readFrame() {
+  if (rxState != RX_START && millis() - rxLastByte > FRAME_BYTE_TIMEOUT) {
+    rxState = RX_START;  // rest of the frame never arrived
+  }
+
+  while (Serial.available() > 0) {
+    uint8_t b = Serial.read();
+    rxLastByte = millis();
+
+    switch (rxState) {
+      case RX_START:
+        if (b == FRAME_START) {
+          rxCalc = 0xFFFF;
+          rxState = RX_TYPE;
+        } else {
+          noteLinkError();  // the host never sends bytes outside a frame
+        }
+        break;
+      case RX_TYPE:
+        rxType = b;
+        rxCalc = crc16Update(rxCalc, b);
+        rxState = RX_SEQ;
+        break;
+      case RX_SEQ:
+        rxSeq = b;
+        rxCalc = crc16Update(rxCalc, b);
+        rxState = RX_LEN_LO;
+        break;
+      case RX_LEN_LO:
+        rxLen = b;
+        rxCalc = crc16Update(rxCalc, b);
+        rxState = RX_LEN_HI;
+        break;
+      case RX_LEN_HI:
+        rxLen |= (uint16_t)b << 8;
+        rxCalc = crc16Update(rxCalc, b);
+        rxIndex = 0;
+        if (rxLen > MAX_PAYLOAD) {
+          sendFrame(FRAME_NAK, rxSeq, "");
+          noteLinkError();
+          rxState = RX_START;
+        } else {
+          rxState = (rxLen > 0) ? RX_PAYLOAD : RX_CRC_LO;
+        }
+        break;
+      case RX_PAYLOAD:
+        rxPayload[rxIndex++] = (char)b;
+        rxCalc = crc16Update(rxCalc, b);
+        if (rxIndex >= rxLen) {
+          rxState = RX_CRC_LO;
+        }
+        break;
+      case RX_CRC_LO:
+        rxCrc = b;
+        rxState = RX_CRC_HI;
+        break;
+      case RX_CRC_HI:
+        rxCrc |= (uint16_t)b << 8;
+        rxState = RX_START;
+        if (rxCrc != rxCalc) {
+          sendFrame(FRAME_NAK, rxSeq, "");
+          noteLinkError();
+          break;
+        }
+        rxPayload[rxLen] = '\0';
+        return true;
+    }
+  }
+  return false;
+}
+
+void handleFrame() {
+  uint8_t type = rxType & ~FRAME_RETRY;
+
+  // Confirm receipt straight away so the host stops its retransmit timer
+  sendFrame(FRAME_ACK, rxSeq, "");
+
+  if (type == FRAME_PING) {
+    sendFrame(FRAME_DONE, rxSeq, rxPayload);
+    return;
+  }
+
+  if (type == FRAME_IDENT) {
+    // Device discovery on the host tells the boards apart by this
+    sendFrame(FRAME_DONE, rxSeq, "printer");
+    return;
+  }
+
+  if (type == FRAME_BAUD) {
+    uint32_t rate = 0;
+    if (rxLen == 4) {
+      rate = (uint32_t)(uint8_t)rxPayload[0]
+           | ((uint32_t)(uint8_t)rxPayload[1] << 8)
+           | ((uint32_t)(uint8_t)rxPayload[2] << 16)
+           | ((uint32_t)(uint8_t)rxPayload[3] << 24);
+    }
+    if (!isSupportedRate(rate)) {
+      sendFrame(FRAME_DONE, rxSeq, "NOBAUD");
+      return;
+    }
+    sendFrame(FRAME_DONE, rxSeq, "BAUD");
+    switchLinkRate(rate);
+    // Keep the new rate only if the host's test frame arrives intact
+    baudPending = true;
+    baudDeadline = millis() + BAUD_CONFIRM_TIMEOUT;
+    return;
+  }
+
+  if ((rxType & FRAME_RETRY) && rxSeq == lastSeq && type == lastType) {
+    // Our ACK was lost and the host resent a command we already ran
+    sendFrame(FRAME_DONE, rxSeq, lastStatus);
+    return;
+  }
+
+  if (type == FRAME_OPEN) {
+    Serial.println("Opening curtains...");
+    moveServoSmooth(currentPos, openPos);
+    currentPos = openPos;
+    lastStatus = "Open";
+  }
+
+  else if (type == FRAME_CLOSE) {
+    Serial.println("Closing curtains...");
+    moveServoSmooth(currentPos, closePos);
+    currentPos = closePos;
+    lastStatus = "Closed";
+  }
+
+  else if (type == FRAME_PRINT) {
+    Serial.print("Candle action start...");
+    digitalWrite(CANDLE_COMMS, LOW);
+    delay(2000); // delay for the ritual to take place
+    digitalWrite(CANDLE_COMMS, HIGH);
+    delay(3000);
+    Serial.print("Received fortune: ");
+    Serial.println(rxPayload);
+
+    // Print the fortune to thermal printer
+    printFortune(rxPayload);
+    lastStatus = "OK";
+  }
+
+  // The host's show timeline (show_timeline.py) times the candles itself
+  // and sends these instead of FRAME_PRINT
+  else if (type == FRAME_PRINT_NOW) {
+    Serial.print("Received fortune: ");
+    Serial.println(rxPayload);
+    printFortune(rxPayload);
+    lastStatus = "OK";
+  }
+
+  else if (type == FRAME_STAGE) {
+    char *text = strchr(rxPayload, '\n');
+    if (text == NULL || text - rxPayload > STAGE_TOKEN_MAX) {
+      lastStatus = "NOSTAGE";
+    } else {
+      *text = '\0';
+      strcpy(stagedToken, rxPayload);
+      strcpy(stagedText, text + 1);
+      Serial.print("Staged fortune ");
+      Serial.println(stagedToken);
+      printFortuneHead();
+      lastStatus = "Staged";
+    }
+  }
+
+  else if (type == FRAME_COMMIT) {
+    if (stagedToken[0] == '\0' || strcmp(stagedToken, rxPayload) != 0) {
+      // Lost to a reset or replaced by a newer visit; the host sends it in full
+      lastStatus = "NOSTAGE";
+    } else {
+      Serial.print("Received fortune: ");
+      Serial.println(stagedText);
+      printFortuneBody(stagedText);
+      stagedToken[0] = '\0';
+      lastStatus = "OK";
+    }
+  }
+
+  else if (type == FRAME_CANCEL) {
+    if (strcmp(stagedToken, rxPayload) == 0) {
+      stagedToken[0] = '\0';
+      stagedText[0] = '\0';
+    }
+    lastStatus = "Cancelled";
+  }
+
+  else if (type == FRAME_CANDLES) {
+    Serial.println("Candle trigger");
+    digitalWrite(CANDLE_COMMS, LOW);
+    delay(CANDLE_PULSE);
+    digitalWrite(CANDLE_COMMS, HIGH);
+    lastStatus = "Candles";
+  }
+
+  else {
+    Serial.print("Unknown frame type: ");
+    Serial.println(type);
+    lastStatus = "Unknown";
+  }
+
+  lastSeq = rxSeq;
+  lastType = type;
+
+  // Tell the Raspberry Pi this command has finished
+  sendFrame(FRAME_DONE, rxSeq, lastStatus);
+}
+
 void setup() {
-  Serial.begin(9600);  // USB serial to communicate with Raspberry Pi
+  Serial.begin(BASE_BAUD);  // USB serial to communicate with Raspberry Pi
   printerSerial.begin(9600);  // Printer serial
   delay(500); // Allow time for the printer to initialize
   
@@ -1704,47 +2043,18 @@ void setup() {
 
 void loop() {
 
-  // Check if data is available from Raspberry Pi via USB Serial
-  if (Serial.available() > 0) {
-    Serial.println("new message");
-    // Read the incoming fortune message (terminated by tilde ~)
-    // Using ~ instead of \n because fortunes contain newlines
-    String fortuneMessage = Serial.readStringUntil('~');
-    
-    if (fortuneMessage == "open") {
-      Serial.println("Opening curtains...");
-      moveServoSmooth(currentPos, openPos);
-      currentPos = openPos;
-      Serial.println("Open");
-    }
-
-    else if (fortuneMessage == "close") {
-      Serial.println("Closing curtains...");
-      moveServoSmooth(currentPos, closePos);
-      currentPos = closePos;
-      Serial.println("Closed");
-    }
+  // No valid frame arrived at the newly negotiated rate: go back
+  if (baudPending && (long)(millis() - baudDeadline) > 0) {
+    switchLinkRate(BASE_BAUD);
+    baudPending = false;
+    Serial.println("Rate change not confirmed, back to 9600 baud");
+  }
 
-    else {
-      // Trim whitespace
-      fortuneMessage.trim();
-      
-      if (fortuneMessage.length() > 0) {
-        Serial.print("Candle action start...");
-        digitalWrite(CANDLE_COMMS, LOW);
-        delay(2000); // delay for the ritual to take place
-        digitalWrite(CANDLE_COMMS, HIGH);
-        delay(3000);
-        Serial.print("Received fortune: ");
-        Serial.println(fortuneMessage);
-        
-        // Print the fortune to thermal printer
-        printFortune(fortuneMessage);
-        
-        // Send acknowledgment back to Raspberry Pi
-        Serial.println("OK");
-      }
-    }
+  // Check for a complete frame from the Raspberry Pi via USB Serial
+  if (readFrame()) {
+    baudPending = false;
+    linkErrors = 0;
+    handleFrame();
   }
 }
 
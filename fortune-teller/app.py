@@ -1,6 +1,8 @@
+import os
+import uuid
 from flask import Flask, render_template, request, session, redirect, url_for, jsonify
 from fortunes import generate_fortune
-from content import get_content
+from content_registry import init_content_registry, get_content
 from arduino_data import (
     format_for_arduino_json, 
     format_for_arduino_simple, 
@@ -8,41 +10,94 @@ from arduino_data import (
     print_data_summary,
     get_user_data
 )
-from arduino_serial import init_arduino, get_arduino
+from device_broker import (
+    BROKER_SOCKET, init_devices, init_device_client, get_device_client,
+    get_arduino, get_supervisor, get_spool,
+)
+from session_store import init_session_store
+from build_audio import init_audio_assets
+from build_sprites import init_sprites
+from build_precache import init_precache
+from response_cache import init_response_cache, render_cached
 from fortune_generator import get_fortune_for_arduino
+from kiosk_log import init_kiosk_log, get_kiosk_log, LEVELS
+from metrics import init_metrics
 
 app = Flask(__name__)
 app.secret_key = 'fortune-teller-secret-key-change-in-production'
 
-# Initialize Arduino connection on startup
-# Set port=None for auto-detection, or specify like port='/dev/ttyUSB0'
-arduino_connection = init_arduino(port=None, baudrate=9600)
+# Log records are written by a background thread, so a slow journald
+# never holds up a request or a serial reader; KIOSK_LOG_LEVEL=debug
+# traces every request and serial frame
+init_kiosk_log(app)
+
+# Request latency per route, serial link and print job figures at /metrics;
+# with a device broker, the serial and print figures come from it
+init_metrics(app, remote=(lambda: get_device_client().call('metrics')) if BROKER_SOCKET else None)
+
+# Keep visit data on the server; the cookie only carries a session id.
+# SESSION_BACKEND=sqlite shares sessions between worker processes
+init_session_store(app)
+
+# Resolve audio cues to the hashed, compressed files from build_audio.py
+init_audio_assets(app)
+
+# Play UI animations from the sprite sheets built by build_sprites.py
+init_sprites(app)
+
+# Service worker that keeps the pages' assets in the browser cache
+init_precache(app)
+
+# Page text and fortune templates reload when content.py or
+# fortune_generator.py is saved, without a restart
+init_content_registry(app)
+
+# Pages that only depend on the page text are rendered once and served as
+# bytes with an ETag
+init_response_cache(app)
+
+# The Arduinos and the print spool belong to one process. With
+# DEVICE_BROKER_SOCKET set, device_broker.py owns them and this app, in as
+# many worker processes as the server runs, only talks to it; otherwise
+# they are opened here, for the single-process server
+if BROKER_SOCKET:
+    init_device_client(BROKER_SOCKET)
+else:
+    init_devices()
 
 @app.get("/")
 def index():
+    # A visitor back at the start will not confirm a fortune staged for them
+    if session.get('flow_id'):
+        get_spool().cancel(session['flow_id'])
     # Clear session and show start page
     session.clear()
     content = get_content("start")
-    return render_template("start.html", content=content)
+    return render_cached("start.html", content=content)
 
 @app.get("/step1")
 def step1():
+    if session.get('flow_id'):
+        get_spool().cancel(session['flow_id'])
     # Clear session and start the fortune telling flow
     session.clear()
+    # Identifies this visit's print job, so a resubmitted form never
+    # prints the fortune twice
+    session['flow_id'] = uuid.uuid4().hex
     
     # Trigger the physical cabinet/Arduino to open when the experience begins
     arduino = get_arduino()
-    if arduino and arduino.is_connected:
+    if arduino and arduino.is_available:
         arduino.send_data("open")
     
     content = get_content("step1")
-    return render_template("step1.html", content=content)
+    return render_cached("step1.html", content=content)
 
 @app.post("/step2")
 def step2():
     session['name'] = request.form.get("name", "")
     content = get_content("step2")
-    return render_template("step2.html", content=content)
+    return render_cached("step2.html", content=content)
 
 @app.post("/step3")
 def step3():
@@ -61,24 +116,38 @@ def step3():
     if surprise_q:
         session['surprise_question'] = surprise_q
     
+    # Everything the fortune depends on is known now. Stage it, so the
+    # Arduino has the text and prints the cookie graphic while the visitor
+    # is still on this page; the fingerprint step then only commits it.
+    # The template is picked at random, so a resubmission with the same
+    # answers keeps the fortune already staged
+    flow_id = session.setdefault('flow_id', uuid.uuid4().hex)
+    answers = sorted([key, value] for key, value in session.items() if key not in ('flow_id', 'staged_answers'))
+    if session.get('staged_answers') != answers:
+        get_spool().stage(get_fortune_for_arduino(session), key=flow_id)
+        session['staged_answers'] = answers
+    
     content = get_content("step3")
-    return render_template("step3.html", content=content)
+    return render_cached("step3.html", content=content)
 
 @app.post("/fingerprint-animation")
 def fingerprint_animation():
-    # Generate fortune message
+    spool = get_spool()
+    flow_id = session.setdefault('flow_id', uuid.uuid4().hex)
+    
+    # Print the fortune staged at /step3. A refresh, double tap or
+    # back-navigation resubmits this form; committing again is a no-op
+    if spool.commit(flow_id) is not None:
+        return render_template("fingerprint_animation.html")
+    
+    # Nothing staged (e.g. the visit started before a restart)
     fortune_message = get_fortune_for_arduino(session)
     
-    # Send fortune message to Arduino
-    arduino = get_arduino()
-    if arduino and arduino.is_connected:
-        # Send the fortune message as a string
-        arduino.send_data(fortune_message)
-        
-        # Optional: Wait for and log Arduino response
-        response = arduino.read_response()
-        if response:
-            print(f"Arduino acknowledged: {response}")
+    # Spool the fortune message; the dispatcher thread sends it to the
+    # Arduino (after a reconnect, if the link is down) and records the
+    # "OK" once the printer has finished. Through a device broker that
+    # cannot be reached, this logs an error and returns None
+    spool.append(fortune_message, key=flow_id)
     
     return render_template("fingerprint_animation.html")
 
@@ -86,7 +155,7 @@ def fingerprint_animation():
 def show_fortune():
     # Close cabinet once the fortune is ready
     arduino = get_arduino()
-    if arduino and arduino.is_connected:
+    if arduino and arduino.is_available:
         arduino.send_data("close")
     
     content = get_content("result")
@@ -108,6 +177,55 @@ def get_arduino_data():
     else:  # json
         return format_for_arduino_json(session), 200, {'Content-Type': 'application/json'}
 
+@app.get("/api/arduino-status")
+def get_arduino_status():
+    """
+    API endpoint reporting the Arduino connection for monitoring,
+    including the negotiated link rate, reconnects and heartbeat times.
+    """
+    supervisor = get_supervisor()
+    if supervisor:
+        return jsonify(supervisor.status())
+    arduino = get_arduino()
+    if not arduino:
+        return jsonify({'connected': False})
+    return jsonify(arduino.status())
+
+@app.get("/api/print-spool")
+def get_print_spool():
+    """
+    API endpoint reporting the print spool: queue depth, job counts per
+    state, average timings and the most recent jobs.
+    """
+    spool = get_spool()
+    return jsonify({**spool.stats(), 'recent': spool.recent(limit=request.args.get('limit', 20, type=int))})
+
+@app.get("/api/print-status")
+def get_print_status():
+    """
+    API endpoint reporting the print job of the current visit.
+    """
+    flow_id = session.get('flow_id')
+    job = get_spool().job_for_key(flow_id) if flow_id else None
+    if not job:
+        return jsonify({'state': None})
+    if 'unavailable' in job:
+        # The device broker could not be asked
+        return jsonify(job)
+    return jsonify({key: job[key] for key in ('id', 'state', 'attempts', 'last_error', 'wait_s', 'total_s')})
+
+@app.get("/api/log")
+def get_log_tail():
+    """
+    API endpoint with the most recent log records, oldest first.
+    Query parameters: 'limit' (default 100), 'level' (debug, info,
+    warning or error) and 'event' (event name prefix, e.g. serial.).
+    """
+    log = get_kiosk_log()
+    level = LEVELS.get(request.args.get('level', 'debug').lower(), 0)
+    records = log.tail(limit=request.args.get('limit', 100, type=int), level=level, event=request.args.get('event'))
+    return jsonify({**log.stats(), 'records': records})
+
 @app.post("/api/exit-kiosk")
 def exit_kiosk():
     """
@@ -164,7 +282,7 @@ def fortune():
     
     # Ensure the cabinet is closed when showing the fortune directly
     arduino = get_arduino()
-    if arduino and arduino.is_connected:
+    if arduino and arduino.is_available:
         arduino.send_data("close")
     
     name = session.get('name', 'Mystery Seeker').strip()
@@ -193,7 +311,7 @@ def show_animation(category):
 @app.route("/loveStep1")
 def loveStep1():
     content = get_content("loveStep1")
-    return render_template("loveStep1.html", content=content)
+    return render_cached("loveStep1.html", content=content)
 
 @app.post("/loveStep2")
 def loveStep2():
@@ -205,14 +323,17 @@ def loveStep2():
     content_all = get_content("loveStep2")
     content = content_all.get(love_answer, content_all.get("has_feelings", {}))
     
-    # Pass the answer to template for conditional audio
-    return render_template("loveStep2.html", content=content, love_answer=love_answer)
+    # Pass the answer to template for conditional audio; one cached page
+    # per known answer
+    if love_answer not in content_all:
+        return render_template("loveStep2.html", content=content, love_answer=love_answer)
+    return render_cached("loveStep2.html", variant=love_answer, content=content, love_answer=love_answer)
 
 # Guidance path
 @app.route("/guidanceStep1")
 def guidanceStep1():
     content = get_content("guidanceStep1")
-    return render_template("guidanceStep1.html", content=content)
+    return render_cached("guidanceStep1.html", content=content)
 
 @app.post("/guidanceStep2")
 def guidanceStep2():
@@ -224,14 +345,17 @@ def guidanceStep2():
     content_all = get_content("guidanceStep2")
     content = content_all.get(guidance_answer, content_all.get("student", {}))
     
-    # Pass the answer to template for conditional audio
-    return render_template("guidanceStep2.html", content=content, guidance_answer=guidance_answer)
+    # Pass the answer to template for conditional audio; one cached page
+    # per known answer
+    if guidance_answer not in content_all:
+        return render_template("guidanceStep2.html", content=content, guidance_answer=guidance_answer)
+    return render_cached("guidanceStep2.html", variant=guidance_answer, content=content, guidance_answer=guidance_answer)
 
 # Fortune path
 @app.route("/fortuneStep1")
 def fortuneStep1():
     content = get_content("fortuneStep1")
-    return render_template("fortuneStep1.html", content=content)
+    return render_cached("fortuneStep1.html", content=content)
 
 @app.post("/fortuneStep2")
 def fortuneStep2():
@@ -243,14 +367,17 @@ def fortuneStep2():
     content_all = get_content("fortuneStep2")
     content = content_all.get(fortune_answer, content_all.get("lucky", {}))
     
-    # Pass the answer to template for conditional audio
-    return render_template("fortuneStep2.html", content=content, fortune_answer=fortune_answer)
+    # Pass the answer to template for conditional audio; one cached page
+    # per known answer
+    if fortune_answer not in content_all:
+        return render_template("fortuneStep2.html", content=content, fortune_answer=fortune_answer)
+    return render_cached("fortuneStep2.html", variant=fortune_answer, content=content, fortune_answer=fortune_answer)
 
 # Surprise path
 @app.route("/surpriseStep1")
 def surpriseStep1():
     content = get_content("surpriseStep1")
-    return render_template("surpriseStep1.html", content=content)
+    return render_cached("surpriseStep1.html", content=content)
 
 @app.post("/surpriseStep2")
 def surpriseStep2():
@@ -262,12 +389,18 @@ def surpriseStep2():
     content_all = get_content("surpriseStep2")
     content = content_all.get(surprise_answer, content_all.get("has_pet", {}))
     
-    # Pass the answer to template for conditional audio
-    return render_template("surpriseStep2.html", content=content, surprise_answer=surprise_answer)
+    # Pass the answer to template for conditional audio; one cached page
+    # per known answer
+    if surprise_answer not in content_all:
+        return render_template("surpriseStep2.html", content=content, surprise_answer=surprise_answer)
+    return render_cached("surpriseStep2.html", variant=surprise_answer, content=content, surprise_answer=surprise_answer)
 
 if __name__ == "__main__":
     # Set debug=False for production/kiosk mode
     # Set debug=True for development
     import os
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
-    app.run(host="0.0.0.0", port=5001, debug=debug_mode)
+    # The content registry reloads these itself; restarting for them
+    # would reconnect the Arduino
+    app.run(host="0.0.0.0", port=5001, debug=debug_mode,
+            exclude_patterns=["*/content.py", "*/fortune_generator.py"])
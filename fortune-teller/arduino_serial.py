@@ -1,77 +1,481 @@
 """
 Arduino serial communication module.
-Handles sending data to Arduino via USB/UART.
+Handles sending data to Arduino via USB/UART using the framed protocol
+in serial_protocol.py.
 """
 import serial
 import serial.tools.list_ports
 import json
 import time
+import queue
+import struct
+import itertools
 import threading
+import collections
+import concurrent.futures
 from arduino_data import format_for_arduino_json
+from kiosk_log import debug, info, warning, error
+from serial_capture import SerialCapture, SerialTap, SERIAL_CAPTURE_DIR
+from metrics import (
+    SERIAL_WRITE_SECONDS, SERIAL_BYTES_SENT, SERIAL_FRAMES_SENT, SERIAL_RETRANSMITS,
+    SERIAL_ACK_SECONDS, SERIAL_ACK_TIMEOUTS, SERIAL_CONNECTED, SERIAL_QUEUE_DEPTH,
+)
+from device_discovery import discover_devices, load_cached_port, remember_port, ROLE_PRINTER
+from serial_protocol import (
+    FrameDecoder,
+    encode_frame,
+    frame_type_for,
+    FRAME_ACK,
+    FRAME_NAK,
+    FRAME_DONE,
+    FRAME_RETRY,
+    FRAME_PING,
+    FRAME_BAUD,
+    BAUD_CONFIRM_TIMEOUT,
+    LINK_TEST_PATTERN,
+)
+
+
+# Status the printer sketch reports in its DONE frame for each command
+ACK_OPEN = "Open"
+ACK_CLOSED = "Closed"
+ACK_PRINTED = "OK"
+ACK_CANDLES = "Candles"
+ACK_STAGED = "Staged"
+ACK_NOSTAGE = "NOSTAGE"       # commit for a fortune the sketch no longer holds
+ACK_CANCELLED = "Cancelled"
+
+# Seconds to wait for each acknowledgement after the message is written.
+# A curtain sweep is 180 steps at 20 ms; a fortune includes the 5 s ritual
+# plus the cookie bitmap and text at 9600 baud on the printer side, and
+# staging prints the bitmap (about 13 s).
+ACK_TIMEOUTS = {
+    ACK_OPEN: 10,
+    ACK_CLOSED: 10,
+    ACK_PRINTED: 60,
+    ACK_CANDLES: 5,
+    ACK_STAGED: 40,
+    ACK_CANCELLED: 5,
+}
+
+# Extra seconds, on top of the frame's time on the wire, to wait for the
+# sketch to confirm receipt before retransmitting
+RECEIPT_GRACE = 0.5
+
+# Transmissions per frame (first try plus retransmissions) before giving up
+MAX_ATTEMPTS = 3
+
+# Faster rates to try after connecting, best first. 115200 is within the
+# Uno's UART error budget at 16 MHz; the sketch rejects anything it does
+# not list in isSupportedRate().
+DEFAULT_LINK_RATES = (115200, 57600)
+
+# Seconds to wait for the sketch to answer a negotiation frame
+NEGOTIATION_TIMEOUT = 0.5
+
+# Banner the printer sketch prints at the end of its boot
+READY_BANNER = "Arduino Fortune Printer Ready"
+
+# Longest time to wait for the sketch after opening the port. Covers an
+# auto-reset: bootloader, then setup() with its printer and servo delays.
+READY_TIMEOUT = 5.0
+
+# Seconds between readiness pings while waiting for the sketch
+READY_PING_INTERVAL = 0.25
+
+# Commands queued while the link was down are dropped instead of replayed
+# once they are this many seconds old, so a curtain does not open long
+# after the visitor has gone
+REPLAY_MAX_AGE = 60.0
+
+def expected_ack(data_string):
+    """
+    Work out which line the printer sketch answers a message with.
+    
+    Args:
+        data_string (str): Message as passed to send_data()
+        
+    Returns:
+        str: "Open" for "open", "Closed" for "close", otherwise "OK"
+    """
+    if data_string == "open":
+        return ACK_OPEN
+    if data_string == "close":
+        return ACK_CLOSED
+    return ACK_PRINTED
+
+
+class SerialRequest:
+    """
+    Handle for a message queued on the serial writer thread.
+    
+    Attributes:
+        seq (int): Sequence id assigned by ArduinoSerial
+        payload (str): Message text as passed to send_data()
+        expect (str): Acknowledgement line that completes this request
+        ack_timeout (float): Seconds to wait for the acknowledgement once written
+        written (Future): Resolves to True once the bytes have been written
+                          and flushed, or False if the write failed or the
+                          message was dropped
+        ack (Future): Resolves to the acknowledgement line, or None if the
+                      message was never written or no ack arrived in time
+        queued_at (float): time.monotonic() when the message was queued
+        sent_at (float): time.monotonic() when the write completed, or None
+        acked_at (float): time.monotonic() when the ack arrived, or None
+        attempts (int): Number of times the frame was transmitted
+        frame_type (int): Frame type the message is sent as
+        offline (bool): Queued (or put back) while the link was down
+    """
+    
+    def __init__(self, payload, seq=0, expect=None, ack_timeout=None, frame_type=None):
+        self.seq = seq
+        self.payload = payload
+        self.frame_type = frame_type if frame_type is not None else frame_type_for(payload)
+        self.expect = expect or expected_ack(payload)
+        self.ack_timeout = ack_timeout or ACK_TIMEOUTS.get(self.expect, 10)
+        self.written = concurrent.futures.Future()
+        self.ack = concurrent.futures.Future()
+        self.queued_at = time.monotonic()
+        self.sent_at = None
+        self.acked_at = None
+        self.attempts = 0
+        self.received = threading.Event()
+        self.rejected = False
+        self.offline = False
+    
+    @property
+    def round_trip(self):
+        """Seconds from the end of the write to the acknowledgement, or None."""
+        if self.sent_at is None or self.acked_at is None:
+            return None
+        # A fast reply can be handled before the writer stamps sent_at
+        return max(0.0, self.acked_at - self.sent_at)
+    
+    @property
+    def deadline(self):
+        """time.monotonic() after which the ack is considered lost, or None."""
+        if self.sent_at is None:
+            return None
+        return self.sent_at + self.ack_timeout
+    
+    def wait(self, timeout=None):
+        """
+        Block until the message has been written to the serial port.
+        
+        Args:
+            timeout (float): Seconds to wait, or None to wait forever
+            
+        Returns:
+            bool: True if written, False if it failed, was dropped or timed out
+        """
+        try:
+            return self.written.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+    
+    def wait_ack(self, timeout=None):
+        """
+        Block until the Arduino acknowledges this message.
+        
+        Args:
+            timeout (float): Seconds to wait, or None to wait until the
+                             request's own ack_timeout expires
+            
+        Returns:
+            str: Acknowledgement line, or None if it never arrived
+        """
+        try:
+            return self.ack.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+    
+    def _finish(self, ok):
+        if ok:
+            self.sent_at = time.monotonic()
+        if not self.written.done():
+            self.written.set_result(ok)
+        if not ok:
+            self._acknowledge(None)
+    
+    def _acknowledge(self, line):
+        if line is not None:
+            self.acked_at = time.monotonic()
+        if not self.ack.done():
+            self.ack.set_result(line)
 
 
 class ArduinoSerial:
     """Manages serial connection to Arduino."""
     
-    def __init__(self, port=None, baudrate=9600, timeout=1):
+    def __init__(self, port=None, baudrate=9600, timeout=1, queue_size=32,
+                 link_rates=DEFAULT_LINK_RATES, role=ROLE_PRINTER, capture=None):
         """
         Initialize Arduino serial connection.
         
         Args:
             port (str): Serial port path (e.g., '/dev/ttyUSB0' or 'COM3')
                        If None, will attempt to auto-detect Arduino
-            baudrate (int): Baud rate (must match Arduino sketch)
+            baudrate (int): Rate the sketch boots at (must match BASE_BAUD
+                            in the Arduino sketch)
             timeout (int): Read timeout in seconds
+            queue_size (int): Maximum number of messages waiting for the
+                              writer thread before send_data() drops new ones
+            link_rates (tuple): Faster rates to negotiate after connecting,
+                                best first; empty to stay at `baudrate`
+            role (str): Board to auto-detect (see device_discovery)
+            capture (SerialCapture): Record all traffic on the port (see
+                                     serial_capture.py), or None
         """
         self.port = port
+        self.capture = capture
+        self.role = role
+        self.configured_port = port
         self.baudrate = baudrate
+        self.link_rates = tuple(link_rates)
+        self.link_baudrate = baudrate
         self.timeout = timeout
         self.serial_connection = None
         self.is_connected = False
         self._reader_thread = None
         self._stop_reader = threading.Event()
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._writer_thread = None
+        self._stop_writer = threading.Event()
+        self._seq = itertools.count(1)
+        self._pending = collections.OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._last_request = None
+        self._in_flight = None
+        self._replay = collections.deque()
+        self._connect_lock = threading.RLock()
+        self._link_lock = threading.Lock()
+        self.queue_while_offline = False
+        self.last_error = None
         
+    @property
+    def is_available(self):
+        """True if send_data() will accept commands: connected, or
+        supervised and holding commands until the link comes back."""
+        return self.is_connected or self.queue_while_offline
+    
+    @property
+    def is_busy(self):
+        """True while a command is on the wire or waiting to be sent."""
+        return self._in_flight is not None or bool(self._replay) or not self._write_queue.empty()
+    
     def connect(self):
-        """Establish connection to Arduino."""
-        try:
-            if not self.port:
-                print("\n" + "="*70)
-                print("🔍 AUTO-DETECTING ARDUINO...")
-                print("="*70)
-                self.port = self.find_arduino_port()
-                if not self.port:
-                    print("⚠️  No Arduino found. Data will be printed to console only.")
-                    print("="*70 + "\n")
-                    return False
+        """
+        Establish connection to Arduino.
+        
+        Tries the configured port, or else the port remembered from the
+        last successful connection and then a full scan. The port counts
+        as connected once the sketch answers the readiness handshake.
+        
+        Returns:
+            bool: True if connected
+        """
+        with self._connect_lock:
+            if self.is_connected:
+                return True
+            
+            for port in self._candidate_ports():
+                if self._connect_to(port):
+                    return True
+            
+            self.is_connected = False
+            return False
+    
+    def reconnect(self):
+        """
+        Tear down a dead link and connect again, keeping queued commands.
+        
+        The threads of the old link are joined and its port closed, then
+        connect() runs as on startup; an auto-detected port is detected
+        again, since the device may come back under a different path.
+        The writer thread replays the interrupted command and the queue
+        once the new link is up.
+        
+        Returns:
+            bool: True if connected
+        """
+        with self._connect_lock:
+            if self.is_connected:
+                return True
+            
+            self._stop_writer.set()
+            self._stop_reader.set()
+            for thread in (self._writer_thread, self._reader_thread):
+                if thread and thread.is_alive() and thread is not threading.current_thread():
+                    thread.join(timeout=2)
+            if self.serial_connection:
+                try:
+                    self.serial_connection.close()
+                except Exception:
+                    pass
+            
+            self.port = self.configured_port
+            self.link_baudrate = self.baudrate
+            return self.connect()
+    
+    def mark_link_down(self, reason):
+        """
+        Record that the link is dead and stop using it.
+        
+        Safe to call from any thread and more than once. The port is left
+        for reconnect() to close; queued commands stay queued. A command
+        the sketch had already received cannot be replayed safely (it may
+        have run), so its ack resolves to None.
+        
+        Args:
+            reason (str): What gave the link away, for status() and the log
+        """
+        with self._link_lock:
+            if not self.is_connected:
+                return
+            self.is_connected = False
+        
+        self.last_error = reason
+        error('serial.link_lost', "❌ Arduino link lost: {reason}", reason=reason, port=self.port)
+        self._stop_writer.set()
+        self._stop_reader.set()
+        
+        with self._pending_lock:
+            received = [request for request in self._pending.values() if request.received.is_set()]
+            for request in received:
+                del self._pending[request.seq]
+        for request in received:
+            request._acknowledge(None)
+    
+    def _candidate_ports(self):
+        """Yield ports to try, cheapest first; probing only runs if needed."""
+        if self.port:
+            yield self.port
+            return
+        
+        cached = load_cached_port(self.role)
+        if cached:
+            print(f"\n💾 Trying last known {self.role} port: {cached}")
+            yield cached
+        
+        print("\n" + "="*70)
+        print(f"🔍 AUTO-DETECTING ARDUINO ({self.role})...")
+        print("="*70)
+        found = self.find_arduino_port(self.role)
+        if not found:
+            print(f"⚠️  No {self.role} Arduino found. Data will be printed to console only.")
+            print("="*70 + "\n")
+            return
+        if found != cached:
+            yield found
+    
+    def _connect_to(self, port):
+        """
+        Open a port and wait for the sketch's readiness handshake.
+        
+        Args:
+            port (str): Serial port path
             
-            print(f"\n🔌 Attempting to connect to: {self.port}")
+        Returns:
+            bool: True if connected
+        """
+        try:
+            print(f"\n🔌 Attempting to connect to: {port}")
             print(f"   Baud rate: {self.baudrate}")
             
-            self.serial_connection = serial.Serial(
-                port=self.port,
-                baudrate=self.baudrate,
-                timeout=self.timeout
-            )
+            self.serial_connection = serial.Serial()
+            self.serial_connection.port = port
+            self.serial_connection.baudrate = self.baudrate
+            self.serial_connection.timeout = self.timeout
+            # Leave DTR deasserted where the adapter allows it, so opening
+            # the port does not auto-reset the Uno; if it does reset anyway,
+            # the handshake below simply waits out the boot
+            self.serial_connection.dtr = False
+            # Keeps device discovery from probing a port that is in use
+            self.serial_connection.exclusive = True
+            self.serial_connection.open()
+            if self.capture is not None:
+                self.serial_connection = SerialTap(self.serial_connection, self.capture)
+            
+            print("   Waiting for Arduino to report ready...")
+            if not self.wait_until_ready():
+                print(f"❌ Arduino on {port} did not answer within {READY_TIMEOUT:.0f}s")
+                print("="*70 + "\n")
+                self.serial_connection.close()
+                return False
             
-            # Wait for Arduino to reset after serial connection
-            print("   Waiting for Arduino to initialize...")
-            time.sleep(2)
+            self.port = port
+            remember_port(port, self.role)
+            self.negotiate_baudrate()
             
             self.is_connected = True
             self._start_reader_thread()
+            self._start_writer_thread()
             print(f"✅ CONNECTED to Arduino on {self.port}")
             print("="*70 + "\n")
             return True
             
         except serial.SerialException as e:
-            print(f"❌ Failed to connect to Arduino on {self.port}: {e}")
+            print(f"❌ Failed to connect to Arduino on {port}: {e}")
             print("="*70 + "\n")
-            self.is_connected = False
+            if self.serial_connection and self.serial_connection.is_open:
+                self.serial_connection.close()
             return False
     
+    def wait_until_ready(self, timeout=READY_TIMEOUT):
+        """
+        Ping the sketch until it answers, instead of sleeping through a
+        worst-case boot. A board that was not reset answers the first ping
+        within milliseconds; one that was reset answers once setup() has
+        finished and loop() starts reading frames.
+        
+        Must run before the reader and writer threads are started.
+        
+        Args:
+            timeout (float): Seconds to wait for an answer
+            
+        Returns:
+            bool: True if the sketch answered in time
+        """
+        original_timeout = self.serial_connection.timeout
+        self.serial_connection.timeout = 0.02
+        
+        decoder = FrameDecoder()
+        ping_seqs = set()
+        start = time.monotonic()
+        next_ping = start
+        
+        try:
+            while time.monotonic() < start + timeout:
+                now = time.monotonic()
+                if now >= next_ping:
+                    seq = next(self._seq)
+                    ping_seqs.add(seq & 0xFF)
+                    self.serial_connection.write(encode_frame(FRAME_PING, seq, b"ready?"))
+                    self.serial_connection.flush()
+                    next_ping = now + READY_PING_INTERVAL
+                
+                data = self.serial_connection.read(self.serial_connection.in_waiting or 1)
+                for kind, value in decoder.feed(data):
+                    if kind == "line":
+                        info('arduino.line', "📥 [Arduino] {line}", line=value)
+                        if value == READY_BANNER:
+                            print(f"   Arduino rebooted, up after {time.monotonic() - start:.2f}s")
+                    elif kind == "frame" and value.type == FRAME_DONE and value.seq in ping_seqs:
+                        print(f"   Arduino ready after {time.monotonic() - start:.3f}s")
+                        return True
+            return False
+        finally:
+            self.serial_connection.timeout = original_timeout
+    
     def disconnect(self):
         """Close serial connection."""
         if self.serial_connection and self.serial_connection.is_open:
+            self._stop_writer.set()
+            # Wakes a writer that is waiting for the current command to finish
+            self._expire_pending(force=True)
+            if self._writer_thread and self._writer_thread.is_alive():
+                self._writer_thread.join(timeout=2)
+            self._drop_queued_messages()
             self._stop_reader.set()
             if self._reader_thread and self._reader_thread.is_alive():
                 self._reader_thread.join(timeout=2)
@@ -79,6 +483,108 @@ class ArduinoSerial:
             self.is_connected = False
             print("🔌 Disconnected from Arduino")
     
+    def negotiate_baudrate(self):
+        """
+        Agree with the sketch on the fastest link rate that passes a test
+        pattern. For each candidate the sketch is asked to switch (at the
+        current rate), both sides change rate, and the test pattern is
+        echoed at the new rate. If the echo fails the host reverts and
+        waits for the sketch to time out and revert too.
+        
+        Must run before the reader and writer threads are started.
+        
+        Returns:
+            int: The link rate in use
+        """
+        self.link_baudrate = self.baudrate
+        original_timeout = self.serial_connection.timeout
+        self.serial_connection.timeout = 0.05
+        
+        try:
+            for rate in self.link_rates:
+                if rate <= self.baudrate:
+                    continue
+                
+                reply = self._exchange(FRAME_BAUD, struct.pack('<I', rate))
+                if reply is None:
+                    print(f"   Arduino did not answer rate negotiation, staying at {self.baudrate} baud")
+                    break
+                if reply != b"BAUD":
+                    print(f"   Arduino declined {rate} baud")
+                    continue
+                
+                self.serial_connection.baudrate = rate
+                if self._exchange(FRAME_PING, LINK_TEST_PATTERN) == LINK_TEST_PATTERN:
+                    self.link_baudrate = rate
+                    break
+                
+                print(f"   Test pattern failed at {rate} baud, falling back")
+                self.serial_connection.baudrate = self.baudrate
+                # Let the sketch give up on the new rate and revert too
+                time.sleep(BAUD_CONFIRM_TIMEOUT + 0.1)
+                self.serial_connection.reset_input_buffer()
+        finally:
+            self.serial_connection.timeout = original_timeout
+        
+        print(f"   Link rate: {self.link_baudrate} baud")
+        return self.link_baudrate
+    
+    def _exchange(self, frame_type, payload=b"", timeout=NEGOTIATION_TIMEOUT):
+        """
+        Send one frame and wait for its DONE reply on the calling thread.
+        Only used while connecting, before the reader thread owns the port.
+        
+        Args:
+            frame_type (int): One of the FRAME_* constants
+            payload (bytes): Frame payload
+            timeout (float): Seconds to wait for the reply
+            
+        Returns:
+            bytes: Payload of the DONE frame, or None if none arrived
+        """
+        seq = next(self._seq)
+        self.serial_connection.write(encode_frame(frame_type, seq, payload))
+        self.serial_connection.flush()
+        
+        decoder = FrameDecoder()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = self.serial_connection.read(self.serial_connection.in_waiting or 1)
+            for kind, value in decoder.feed(data):
+                if kind == "frame" and value.type == FRAME_DONE and value.seq == seq & 0xFF:
+                    return value.payload
+                if kind == "line":
+                    info('arduino.line', "📥 [Arduino] {line}", line=value)
+        return None
+    
+    def _fall_back_to_base_rate(self):
+        """
+        Drop the host side of the link back to the boot rate after errors
+        at a negotiated rate. The sketch reverts on its own once it sees
+        a run of bytes it cannot frame.
+        """
+        warning('serial.rate_fallback', "⚠️  Link errors at {rate} baud, falling back to {base_rate}",
+                rate=self.link_baudrate, base_rate=self.baudrate)
+        self.serial_connection.baudrate = self.baudrate
+        self.link_baudrate = self.baudrate
+    
+    def status(self):
+        """
+        Summarize the connection for monitoring.
+        
+        Returns:
+            dict: Connection state, port and link rate
+        """
+        return {
+            'connected': self.is_connected,
+            'port': self.port,
+            'base_baudrate': self.baudrate,
+            'link_baudrate': self.link_baudrate,
+            'queue_depth': self._write_queue.qsize() + len(self._replay),
+            'reader_alive': bool(self._reader_thread and self._reader_thread.is_alive()),
+            'last_error': self.last_error,
+        }
+    
     def send_json(self, data_dict):
         """
         Send JSON data to Arduino.
@@ -87,7 +593,8 @@ class ArduinoSerial:
             data_dict (dict): Data to send
             
         Returns:
-            bool: True if sent successfully
+            SerialRequest: Handle for the queued message, or False if the
+                           data could not be serialized
         """
         try:
             json_string = json.dumps(data_dict, separators=(',', ':'))
@@ -96,39 +603,80 @@ class ArduinoSerial:
             print(f"❌ Error preparing JSON: {e}")
             return False
     
-    def send_data(self, data_string):
+    def send_data(self, data_string, expect=None, ack_timeout=None, frame_type=None):
         """
-        Send string data to Arduino.
-        Adds tilde (~) terminator for Arduino's Serial.readStringUntil().
-        Using ~ instead of newline since fortunes may contain \n characters.
+        Queue string data for the Arduino and return immediately.
+        "open" and "close" move the curtains; anything else is printed.
+        
+        The message is sent as a CRC-checked frame on the
+        ArduinoSerialWriter thread, so request handlers never wait on the
+        UART and concurrent callers cannot interleave bytes on the wire.
+        Each message gets a sequence id that the sketch echoes in its
+        DONE frame ("Open", "Closed" or "OK") when it has finished.
         
         Args:
             data_string (str): String to send
+            expect (str): Acknowledgement line to wait for (default: derived
+                          from the message by expected_ack())
+            ack_timeout (float): Seconds to wait for the acknowledgement once
+                                 written (default: ACK_TIMEOUTS for `expect`)
+            frame_type (int): Frame type to send as (default: derived from
+                              the message by frame_type_for())
             
         Returns:
-            bool: True if sent successfully
+            SerialRequest: Handle whose `written` future resolves once the
+                           message is on the wire and whose `ack` future
+                           resolves to the acknowledgement line (or None)
+        """
+        request = SerialRequest(data_string, seq=next(self._seq), expect=expect,
+                                ack_timeout=ack_timeout, frame_type=frame_type)
+        self._last_request = request
+        return self._enqueue(request)
+    
+    def ping(self, payload="ping", timeout=2):
         """
+        Queue a PING frame; the sketch echoes the payload in its DONE frame.
+        Used as a heartbeat, so it is not logged.
+        
+        Args:
+            payload (str): Text to be echoed back
+            timeout (float): Seconds to wait for the echo once written
+            
+        Returns:
+            SerialRequest: Handle whose ack resolves to the echoed payload
+        """
+        request = SerialRequest(payload, seq=next(self._seq), expect=payload,
+                                ack_timeout=timeout, frame_type=FRAME_PING)
+        return self._enqueue(request)
+    
+    def _enqueue(self, request):
+        """Hand a request to the writer thread, or fail it if it cannot be sent."""
         if not self.is_connected:
-            print("⚠️  Not connected to Arduino. Data:")
-            print(f"   {data_string}")
-            return False
+            # A heartbeat is only meaningful on the link it was sent for
+            if not self.queue_while_offline or request.frame_type == FRAME_PING:
+                warning('serial.offline', "⚠️  Not connected to Arduino. Data:\n   {payload}",
+                        seq=request.seq, payload=request.payload)
+                request._finish(False)
+                return request
+            request.offline = True
         
         try:
-            # Add tilde terminator for Arduino parsing (~ won't appear in fortunes)
-            message = data_string + '~'
-            self.serial_connection.write(message.encode('utf-8'))
-            self.serial_connection.flush()
-            
-            print(f"📤 Sent to Arduino: {data_string}")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error sending to Arduino: {e}")
-            return False
+            self._write_queue.put_nowait(request)
+        except queue.Full:
+            warning('serial.queue_full', "⚠️  Arduino write queue full, dropping: {payload}",
+                    seq=request.seq, payload=request.payload)
+            request._finish(False)
+            return request
+        
+        if request.offline and request.frame_type != FRAME_PING:
+            info('serial.held', "⏸️  Arduino offline, holding #{seq} until it reconnects", seq=request.seq)
+        return request
     
     def read_response(self, timeout=2):
         """
-        Read response from Arduino.
+        Wait for the acknowledgement of the most recently sent message.
+        Prefer keeping the SerialRequest from send_data() and calling
+        wait_ack() on it, which cannot pick up another caller's message.
         
         Args:
             timeout (int): How long to wait for response
@@ -136,17 +684,104 @@ class ArduinoSerial:
         Returns:
             str: Response from Arduino, or None if timeout
         """
-        if not self.is_connected:
+        if not self.is_connected or self._last_request is None:
             return None
+        return self._last_request.wait_ack(timeout)
+    
+    def _register_pending(self, request):
+        """Track a request so the reader thread can match its ack."""
+        with self._pending_lock:
+            self._pending[request.seq] = request
+    
+    def _forget_pending(self, request):
+        with self._pending_lock:
+            self._pending.pop(request.seq, None)
+    
+    def _find_pending(self, wire_seq):
+        """Find the pending request whose sequence id matches a frame's seq byte."""
+        with self._pending_lock:
+            for seq, request in self._pending.items():
+                if seq & 0xFF == wire_seq:
+                    return request
+        return None
+    
+    def _handle_frame(self, frame):
+        """
+        Act on a frame received from the Arduino.
         
-        try:
-            if self.serial_connection.in_waiting > 0:
-                response = self.serial_connection.readline().decode('utf-8').strip()
-                print(f"📥 Arduino response: {response}")
-                return response
-        except Exception as e:
-            print(f"❌ Error reading from Arduino: {e}")
-            return None
+        Args:
+            frame (Frame): Decoded frame
+        """
+        if frame.type == FRAME_ACK:
+            request = self._find_pending(frame.seq)
+            if request:
+                request.received.set()
+        
+        elif frame.type == FRAME_NAK:
+            # The seq byte of a corrupted frame cannot be trusted; with one
+            # frame in flight at a time the rejected one is always that one
+            request = self._in_flight
+            if request:
+                request.rejected = True
+                request.received.set()
+        
+        elif frame.type == FRAME_DONE:
+            self._match_ack(frame.seq, frame.payload.decode('utf-8', errors='replace'))
+    
+    def _match_ack(self, wire_seq, status):
+        """
+        Complete the pending request a DONE frame refers to.
+        
+        Args:
+            wire_seq (int): Sequence byte echoed by the sketch
+            status (str): Status text from the frame ("Open", "Closed", "OK")
+            
+        Returns:
+            SerialRequest: The request that was completed, or None
+        """
+        with self._pending_lock:
+            for seq, request in self._pending.items():
+                if seq & 0xFF == wire_seq:
+                    del self._pending[seq]
+                    break
+            else:
+                return None
+        
+        # A DONE also proves receipt, even if the ACK frame was lost
+        request.received.set()
+        request._acknowledge(status)
+        if status != request.expect:
+            warning('serial.unexpected_ack', "⚠️  Arduino answered #{seq} with '{status}', expected '{expect}'",
+                    seq=request.seq, status=status, expect=request.expect)
+        round_trip = request.round_trip
+        if round_trip is not None and request.frame_type != FRAME_PING:
+            SERIAL_ACK_SECONDS.observe(round_trip)
+            debug('serial.ack', "📥 Arduino acknowledged #{seq} ({status}) in {round_trip:.3f}s",
+                  seq=request.seq, status=status, round_trip=round_trip, attempts=request.attempts)
+        return request
+    
+    def _expire_pending(self, force=False):
+        """
+        Give up on requests whose acknowledgement deadline has passed.
+        
+        Args:
+            force (bool): Expire every pending request regardless of deadline
+        """
+        now = time.monotonic()
+        expired = []
+        with self._pending_lock:
+            for seq, request in list(self._pending.items()):
+                deadline = request.deadline
+                if force or (deadline is not None and now > deadline):
+                    del self._pending[seq]
+                    expired.append(request)
+        
+        for request in expired:
+            if not force:
+                SERIAL_ACK_TIMEOUTS.inc()
+                warning('serial.ack_timeout', "⏱️  No acknowledgement for #{seq} (expected '{expect}')",
+                        seq=request.seq, expect=request.expect)
+            request._acknowledge(None)
     
     def _start_reader_thread(self):
         """Continuously read and print all Arduino output."""
@@ -156,69 +791,166 @@ class ArduinoSerial:
         self._stop_reader.clear()
         
         def _reader():
-            print("👂 Listening for Arduino output...")
+            info('serial.reader_started', "👂 Listening for Arduino output...", port=self.port)
+            decoder = FrameDecoder()
             while not self._stop_reader.is_set() and self.serial_connection and self.serial_connection.is_open:
                 try:
-                    line = self.serial_connection.readline()
-                    if line:
-                        decoded = line.decode('utf-8', errors='replace').strip()
-                        if decoded:
-                            print(f"📥 [Arduino] {decoded}")
+                    # Blocks for up to `timeout` seconds when nothing arrives
+                    data = self.serial_connection.read(self.serial_connection.in_waiting or 1)
+                    for kind, value in decoder.feed(data):
+                        if kind == "frame":
+                            self._handle_frame(value)
+                        elif kind == "line":
+                            info('arduino.line', "📥 [Arduino] {line}", line=value)
+                        else:
+                            warning('serial.corrupt_frame', "⚠️  Dropped corrupt frame from Arduino")
+                    self._expire_pending()
                 except serial.SerialException as e:
                     if not self._stop_reader.is_set():
-                        print(f"❌ Serial read error: {e}")
+                        error('serial.read_failed', "❌ Serial read error: {error}", error=str(e))
+                        self.mark_link_down(f"read error: {e}")
                     break
                 except Exception as e:
-                    print(f"❌ Unexpected reader error: {e}")
+                    error('serial.reader_failed', "❌ Unexpected reader error: {error}", error=str(e))
+                    self.mark_link_down(f"reader error: {e}")
                     break
-                finally:
-                    time.sleep(0.01)
-            print("🛑 Stopped listening for Arduino output.")
+            info('serial.reader_stopped', "🛑 Stopped listening for Arduino output.", port=self.port)
         
         self._reader_thread = threading.Thread(target=_reader, name="ArduinoSerialReader", daemon=True)
         self._reader_thread.start()
     
-    @staticmethod
-    def find_arduino_port():
+    def _transmit(self, request):
         """
-        Auto-detect Arduino port.
+        Write a request's frame and wait for the sketch to confirm receipt,
+        retransmitting when it answers NAK or stays silent.
         
+        Args:
+            request (SerialRequest): Request to send
+            
         Returns:
-            str: Port path if found, None otherwise
+            bool: True once the sketch has confirmed receipt
         """
-        ports = serial.tools.list_ports.comports()
-        
-        if not ports:
-            print("   ❌ No serial devices found")
-            return None
+        try:
+            payload = request.payload.encode('utf-8')
+            frame_type = request.frame_type
+            frame = encode_frame(frame_type, request.seq, payload)
+        except ValueError as e:
+            error('serial.encode_failed', "❌ Cannot send #{seq} to Arduino: {error}", seq=request.seq, error=str(e))
+            return False
         
-        print(f"\n   Found {len(ports)} serial device(s):")
+        # Time on the wire at 10 bits per byte, plus processing slack
+        receipt_timeout = len(frame) * 10 / self.link_baudrate + RECEIPT_GRACE
         
-        for i, port in enumerate(ports, 1):
-            print(f"\n   [{i}] {port.device}")
-            print(f"       Description: {port.description}")
-            print(f"       Hardware ID: {port.hwid}")
-            if port.manufacturer:
-                print(f"       Manufacturer: {port.manufacturer}")
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if self._stop_writer.is_set():
+                return False
+            if attempt > 1:
+                frame = encode_frame(frame_type | FRAME_RETRY, request.seq, payload)
+                SERIAL_RETRANSMITS.inc()
+                info('serial.retransmit', "🔁 Retransmitting #{seq} (attempt {attempt})", seq=request.seq, attempt=attempt)
             
-            # Common Arduino identifiers
-            arduino_keywords = [
-                'Arduino', 'CH340', 'CH341', 'CP2102', 'CP210x', 'FTDI', 'FT232',
-                'USB Serial', 'ttyUSB', 'ttyACM', 'cu.usb', 'usbserial', 'usbmodem'
-            ]
+            request.received.clear()
+            request.rejected = False
+            request.attempts = attempt
+            try:
+                write_started = time.perf_counter()
+                self.serial_connection.write(frame)
+                self.serial_connection.flush()
+                SERIAL_WRITE_SECONDS.observe(time.perf_counter() - write_started)
+                SERIAL_FRAMES_SENT.inc()
+                SERIAL_BYTES_SENT.inc(len(frame))
+            except Exception as e:
+                error('serial.write_failed', "❌ Error sending to Arduino: {error}", seq=request.seq, error=str(e))
+                self.mark_link_down(f"write error: {e}")
+                return False
             
-            # Check if port description matches Arduino patterns
-            for keyword in arduino_keywords:
-                if keyword.lower() in port.description.lower() or \
-                   keyword.lower() in port.device.lower() or \
-                   (port.manufacturer and keyword.lower() in port.manufacturer.lower()):
-                    print(f"       ✅ ARDUINO DETECTED!")
-                    print(f"\n   🎯 Selected Arduino port: {port.device}")
-                    return port.device
-        
-        print("\n   ❌ No Arduino detected automatically")
-        print("   💡 If your Arduino is listed above, specify it manually in app.py")
-        return None
+            request._finish(True)
+            if attempt == 1 and frame_type != FRAME_PING:
+                debug('serial.sent', "📤 Sent to Arduino #{seq}: {payload}",
+                      seq=request.seq, payload=request.payload, bytes=len(frame))
+            
+            if request.received.wait(receipt_timeout) and not request.rejected:
+                return True
+        
+        error('serial.unconfirmed', "❌ Arduino never confirmed #{seq} after {attempts} attempts",
+              seq=request.seq, attempts=MAX_ATTEMPTS)
+        return False
+    
+    def _start_writer_thread(self):
+        """Write queued messages to the Arduino one at a time, in order."""
+        if self._writer_thread and self._writer_thread.is_alive():
+            return
+        
+        self._stop_writer.clear()
+        
+        def _writer():
+            while not self._stop_writer.is_set():
+                try:
+                    # A command interrupted by a lost link goes first
+                    request = self._replay.popleft()
+                except IndexError:
+                    try:
+                        request = self._write_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                
+                if request.offline and time.monotonic() - request.queued_at > REPLAY_MAX_AGE:
+                    warning('serial.expired', "🗑️  Dropping #{seq}, held too long while offline: {payload}",
+                            seq=request.seq, payload=request.payload)
+                    request._finish(False)
+                    continue
+                
+                # Register before writing so a fast ack cannot be missed
+                self._register_pending(request)
+                self._in_flight = request
+                sent = self._transmit(request)
+                if not sent and not self._stop_writer.is_set() and self.link_baudrate != self.baudrate:
+                    self._fall_back_to_base_rate()
+                    sent = self._transmit(request)
+                if (not sent and self._stop_writer.is_set() and not request.received.is_set()
+                        and request.frame_type != FRAME_PING):
+                    # The link died before the sketch saw this command;
+                    # keep it for the writer of the next link
+                    self._forget_pending(request)
+                    request.offline = True
+                    self._replay.appendleft(request)
+                elif not sent:
+                    self._forget_pending(request)
+                    request._finish(False)
+                else:
+                    # Stop-and-wait: the sketch cannot read while it runs a
+                    # command and its 64-byte receive buffer would overflow,
+                    # so hold the next frame until this one has finished
+                    request.wait_ack(request.ack_timeout + RECEIPT_GRACE)
+                self._in_flight = None
+        
+        self._writer_thread = threading.Thread(target=_writer, name="ArduinoSerialWriter", daemon=True)
+        self._writer_thread.start()
+    
+    def _drop_queued_messages(self):
+        """Fail every message still waiting for the writer thread."""
+        while self._replay:
+            self._replay.popleft()._finish(False)
+        while True:
+            try:
+                request = self._write_queue.get_nowait()
+            except queue.Empty:
+                return
+            request._finish(False)
+    
+    @staticmethod
+    def find_arduino_port(role=ROLE_PRINTER):
+        """
+        Auto-detect the port of a board by asking every USB serial port
+        what it is (see device_discovery).
+        
+        Args:
+            role (str): ROLE_PRINTER or ROLE_CANDLES
+            
+        Returns:
+            str: Port path if found, None otherwise
+        """
+        return discover_devices(use_cache=False).get(role)
     
     @staticmethod
     def list_available_ports():
@@ -246,20 +978,35 @@ class ArduinoSerial:
 arduino = None
 
 
-def init_arduino(port=None, baudrate=9600):
+def init_arduino(port=None, baudrate=9600, link_rates=DEFAULT_LINK_RATES, background=False,
+                 capture_dir=SERIAL_CAPTURE_DIR):
     """
     Initialize global Arduino connection.
     
     Args:
         port (str): Serial port path (None for auto-detect)
-        baudrate (int): Baud rate (must match Arduino sketch)
+        baudrate (int): Rate the sketch boots at (must match Arduino sketch)
+        link_rates (tuple): Faster rates to negotiate once connected
+        background (bool): Connect on a background thread and return at
+                           once; is_connected turns True when the sketch
+                           has answered the readiness handshake
+        capture_dir (str): Record the serial traffic to capture files in
+                           this directory (SERIAL_CAPTURE_DIR); empty for none
     
     Returns:
         ArduinoSerial: Arduino connection object
     """
     global arduino
-    arduino = ArduinoSerial(port=port, baudrate=baudrate)
-    arduino.connect()
+    capture = SerialCapture(capture_dir) if capture_dir else None
+    if capture is not None:
+        print(f"📼 Capturing Arduino serial traffic to {capture_dir}")
+    arduino = ArduinoSerial(port=port, baudrate=baudrate, link_rates=link_rates, capture=capture)
+    SERIAL_CONNECTED.set_function(lambda: int(arduino.is_connected))
+    SERIAL_QUEUE_DEPTH.set_function(lambda: arduino._write_queue.qsize() + len(arduino._replay))
+    if background:
+        threading.Thread(target=arduino.connect, name="ArduinoConnect", daemon=True).start()
+    else:
+        arduino.connect()
     return arduino
 
 
@@ -0,0 +1,193 @@
+"""
+Connection supervisor for the Arduino link.
+Watches an ArduinoSerial for a dead link (write errors, the reader thread
+exiting, or heartbeats going unanswered) and reconnects in the
+background with exponential backoff, so request threads never wait on
+recovery and the kiosk service does not need restarting after a USB
+cable is bumped.
+"""
+import time
+import threading
+import collections
+from metrics import SERIAL_RECONNECTS
+from kiosk_log import info, warning, error
+
+
+# Seconds between heartbeats while the link is idle
+HEARTBEAT_INTERVAL = 5.0
+
+# Seconds to wait for the sketch to echo a heartbeat
+HEARTBEAT_TIMEOUT = 2.0
+
+# Consecutive unanswered heartbeats before the link is declared dead
+MAX_MISSED_HEARTBEATS = 2
+
+# Reconnect backoff: first delay, doubling up to the maximum
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 30.0
+
+# Number of heartbeat round-trip times kept for status()
+RTT_HISTORY = 50
+
+
+class ArduinoSupervisor:
+    """Keeps an ArduinoSerial connected and measures its heartbeat."""
+
+    def __init__(self, arduino, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT, max_missed=MAX_MISSED_HEARTBEATS,
+                 backoff_initial=BACKOFF_INITIAL, backoff_max=BACKOFF_MAX):
+        """
+        Initialize the supervisor.
+
+        Args:
+            arduino (ArduinoSerial): Connection to supervise
+            heartbeat_interval (float): Seconds between heartbeats while idle
+            heartbeat_timeout (float): Seconds to wait for a heartbeat echo
+            max_missed (int): Unanswered heartbeats in a row that mark the
+                              link as dead
+            backoff_initial (float): First delay between reconnect attempts
+            backoff_max (float): Longest delay between reconnect attempts
+        """
+        self.arduino = arduino
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_missed = max_missed
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.reconnects = 0
+        self.missed_heartbeats = 0
+        self.heartbeat_rtts = collections.deque(maxlen=RTT_HISTORY)
+        self.last_heartbeat_at = None
+        self._heartbeats = 0
+        self._was_connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start supervising on a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        # Hold commands sent during an outage and replay them afterwards
+        self.arduino.queue_while_offline = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ArduinoSupervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop supervising. Commands are no longer held while offline."""
+        self._stop.set()
+        self.arduino.queue_while_offline = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.heartbeat_timeout + 1)
+
+    def status(self):
+        """
+        Connection status plus supervisor statistics, for monitoring.
+
+        Returns:
+            dict: ArduinoSerial.status() with reconnect and heartbeat fields
+        """
+        status = self.arduino.status()
+        rtts = list(self.heartbeat_rtts)
+        status.update({
+            'reconnects': self.reconnects,
+            'missed_heartbeats': self.missed_heartbeats,
+            'heartbeat_rtt_last': rtts[-1] if rtts else None,
+            'heartbeat_rtt_avg': sum(rtts) / len(rtts) if rtts else None,
+            'heartbeat_rtt_max': max(rtts) if rtts else None,
+            'last_heartbeat_age': (time.monotonic() - self.last_heartbeat_at
+                                   if self.last_heartbeat_at is not None else None),
+        })
+        return status
+
+    def _run(self):
+        delay = self.backoff_initial
+        while not self._stop.is_set():
+            if not self.arduino.is_connected:
+                if self._reconnect():
+                    delay = self.backoff_initial
+                else:
+                    warning('supervisor.reconnect_failed', "🔁 Arduino reconnect failed, retrying in {delay_s:.1f}s",
+                            delay_s=delay, error=self.arduino.last_error)
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, self.backoff_max)
+                continue
+
+            self._was_connected = True
+            if self._stop.wait(self.heartbeat_interval):
+                break
+            self._check_link()
+
+    def _reconnect(self):
+        """Bring the link back; returns True once connected."""
+        if self._was_connected:
+            info('supervisor.reconnecting', "🔁 Reconnecting to Arduino...")
+        if not self.arduino.reconnect():
+            return False
+
+        if self._was_connected:
+            self.reconnects += 1
+            SERIAL_RECONNECTS.inc()
+            info('supervisor.reconnected', "✅ Arduino link restored (reconnect #{reconnects})", reconnects=self.reconnects)
+        self.missed_heartbeats = 0
+        return True
+
+    def _check_link(self):
+        """Look for a dead reader thread, then send a heartbeat if idle."""
+        if not self.arduino.is_connected:
+            return
+
+        if not self.arduino.status()['reader_alive']:
+            self.arduino.mark_link_down("reader thread exited")
+            return
+
+        # The sketch cannot answer while it runs a command, and a queued
+        # command's own ack already proves the link, so only ping when idle
+        if self.arduino.is_busy:
+            self.missed_heartbeats = 0
+            return
+
+        self._heartbeats += 1
+        payload = f"hb{self._heartbeats}"
+        request = self.arduino.ping(payload, timeout=self.heartbeat_timeout)
+        reply = request.wait_ack(self.heartbeat_timeout + 1)
+
+        if reply == payload and request.round_trip is not None:
+            self.heartbeat_rtts.append(request.round_trip)
+            self.last_heartbeat_at = time.monotonic()
+            self.missed_heartbeats = 0
+            return
+
+        self.missed_heartbeats += 1
+        error('supervisor.heartbeat_missed', "💔 Arduino missed heartbeat ({missed}/{max_missed})",
+              missed=self.missed_heartbeats, max_missed=self.max_missed, payload=payload, reply=reply)
+        if self.missed_heartbeats >= self.max_missed:
+            self.arduino.mark_link_down(f"{self.missed_heartbeats} missed heartbeats")
+
+
+# Global supervisor instance
+supervisor = None
+
+
+def init_supervisor(arduino, **kwargs):
+    """
+    Start supervising the global Arduino connection.
+
+    Args:
+        arduino (ArduinoSerial): Connection to supervise
+        **kwargs: Passed to ArduinoSupervisor
+
+    Returns:
+        ArduinoSupervisor: Running supervisor
+    """
+    global supervisor
+    supervisor = ArduinoSupervisor(arduino, **kwargs)
+    supervisor.start()
+    return supervisor
+
+
+def get_supervisor():
+    """Get the global supervisor instance."""
+    global supervisor
+    return supervisor
@@ -0,0 +1,262 @@
+"""
+End-to-end kiosk session benchmark.
+Drives the Flask app through complete customer sessions, one per
+category and answer branch, against the virtual Arduino, and reports
+per-route latency percentiles, server-side time per session, the time
+from the fingerprint step to the printed slip and the bytes sent to the
+device, as JSON.
+
+Usage:
+    python bench_session.py --rounds 5 --output bench.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+
+# Text typed at /step3 for each category
+SAMPLE_FEATURES = {
+    "love": "kind heart",
+    "guidance": "books",
+    "fortune": "lucky socks",
+    "surprise": "biscuit",
+}
+
+
+def session_steps(category, answer, name="Alex"):
+    """
+    The requests a visitor makes for one branch, in order.
+
+    Args:
+        category (str): love, guidance, fortune or surprise
+        answer (str): Multiple-choice answer for the category's Step1
+        name (str): Name typed at Step1
+
+    Returns:
+        list: (method, path, form data) tuples
+    """
+    return [
+        ("GET", "/", None),
+        ("GET", "/step1", None),
+        ("POST", "/step2", {"name": name}),
+        ("POST", f"/animation/{category}", None),
+        ("GET", f"/{category}Step1", None),
+        ("POST", f"/{category}Step2", {f"{category}_answer": answer}),
+        ("POST", "/step3", {f"{category}_question": SAMPLE_FEATURES[category]}),
+        ("POST", "/fingerprint-animation", None),
+        ("GET", "/show-fortune", None),
+    ]
+
+
+def percentile(values, pct):
+    """
+    Linearly interpolated percentile.
+
+    Args:
+        values (list): Samples
+        pct (float): Percentile, 0-100
+
+    Returns:
+        float: Percentile value, or None for no samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    ms = [s * 1000 for s in samples]
+    return {
+        "count": len(ms),
+        "mean_ms": sum(ms) / len(ms) if ms else None,
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": max(ms) if ms else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_until_idle(arduino, spool, timeout):
+    """Wait for the device to finish the session's commands."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if arduino.is_connected and not arduino.is_busy and spool.depth() == 0:
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def run(rounds, time_scale, wire_time, settle_timeout, think_time=0.0):
+    """
+    Start a virtual Arduino, import the app against it and walk every
+    branch `rounds` times, pausing `think_time` seconds (scaled like the
+    device) on each page as a visitor reading it would.
+
+    Returns:
+        dict: Benchmark report
+    """
+    from virtual_arduino import VirtualArduino
+
+    device = VirtualArduino(time_scale=time_scale, wire_time=wire_time)
+    os.environ["ARDUINO_PORT"] = device.start()
+    # Keep the real kiosk's remembered port and print spool untouched
+    scratch = tempfile.mkdtemp()
+    os.environ["ARDUINO_PORT_CACHE"] = os.path.join(scratch, "arduino-port.json")
+    os.environ["PRINT_SPOOL_PATH"] = os.path.join(scratch, "print-spool.db")
+    os.environ.pop("SHOW_TIMELINE_PATH", None)
+
+    import app as kiosk
+    from arduino_serial import get_arduino
+    from print_spool import get_spool
+    from show_timeline import get_show
+    from fortune_generator import FORTUNE_TEMPLATES
+
+    arduino = get_arduino()
+    get_show().time_scale = time_scale
+    connect_start = time.monotonic()
+    while not arduino.is_connected and time.monotonic() - connect_start < 10:
+        time.sleep(0.01)
+    if not arduino.is_connected:
+        raise RuntimeError("App did not connect to the virtual Arduino")
+    connect_time = time.monotonic() - connect_start
+
+    client = kiosk.app.test_client()
+    route_times = {}
+    session_times = []
+    device_times = []
+    session_bytes = []
+    paper_times = []
+    branches = {}
+    errors = 0
+
+    for _ in range(rounds):
+        for category, answers in FORTUNE_TEMPLATES.items():
+            for answer in answers:
+                bytes_before = device.bytes_received
+                session_start = time.monotonic()
+                server_time = 0.0
+
+                fingerprint_at = None
+                for method, path, form in session_steps(category, answer):
+                    if think_time and path != "/":
+                        time.sleep(think_time * time_scale)
+                    if path == "/fingerprint-animation":
+                        fingerprint_at = time.monotonic()
+                    start = time.perf_counter()
+                    response = client.open(path, method=method, data=form)
+                    elapsed = time.perf_counter() - start
+                    if response.status_code >= 400:
+                        errors += 1
+                    server_time += elapsed
+                    route_times.setdefault(path, []).append(elapsed)
+
+                wait_until_idle(arduino, get_spool(), settle_timeout)
+                device_times.append(time.monotonic() - session_start)
+                printed_at = [at for at, event, _ in device.events if event == "print_done" and at >= fingerprint_at]
+                if printed_at:
+                    paper_times.append(printed_at[0] - fingerprint_at)
+                session_times.append(server_time)
+                session_bytes.append(device.bytes_received - bytes_before)
+                branches.setdefault(f"{category}/{answer}", []).append(server_time)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "rounds": rounds,
+            "time_scale": time_scale,
+            "wire_time": wire_time,
+            "think_time": think_time,
+            "connect_wait_s": connect_time,
+            "link_baudrate": arduino.link_baudrate,
+        },
+        "routes": {path: summarize(times) for path, times in route_times.items()},
+        "sessions": {
+            "server": summarize(session_times),
+            "until_device_idle": summarize(device_times),
+            "fingerprint_to_paper": summarize(paper_times),
+            "branches": {branch: summarize(times) for branch, times in branches.items()},
+            "errors": errors,
+        },
+        "device": {
+            "bytes_to_device": device.bytes_received,
+            "bytes_from_device": device.bytes_sent,
+            "bytes_to_device_per_session": summarize_bytes(session_bytes),
+            "frames_received": device.frames_received,
+            "naks_sent": device.naks_sent,
+            "fortunes_printed": len(device.printed),
+        },
+    }
+
+    device.stop()
+    return report
+
+
+def summarize_bytes(values):
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "min": min(values) if values else None,
+        "max": max(values) if values else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark complete kiosk sessions against the virtual Arduino.")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="times to walk every category/answer branch (default: 3)")
+    parser.add_argument("--time-scale", type=float, default=0.01,
+                        help="virtual Arduino delay multiplier (default: 0.01)")
+    parser.add_argument("--no-wire-time", action="store_true",
+                        help="deliver serial bytes instantly instead of at the link rate")
+    parser.add_argument("--settle-timeout", type=float, default=30.0,
+                        help="seconds to wait for the device after each session (default: 30)")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="seconds a visitor spends on each page, scaled by --time-scale (default: 0)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="show the app's console output")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    log = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        report = run(args.rounds, args.time_scale, not args.no_wire_time, args.settle_timeout, args.think_time)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        server = report["sessions"]["server"]
+        print(f"📊 {server['count']} sessions, server time p50 {server['p50_ms']:.1f} ms, "
+              f"p99 {server['p99_ms']:.1f} ms -> {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Audio asset build.
+The cues in static/audio are uncompressed WAV (about 31 MB). This build
+transcodes each one to Opus with ffmpeg and copies the WAV next to it as
+a fallback, both under content-hashed names in static/build/audio, and
+writes a manifest. Templates ask for a cue by its original path:
+
+    new Audio(pickAudio({{ audio_sources('step3/cook_07.wav') | tojson }}))
+
+and the app serves everything under static/build with immutable cache
+headers, since a changed cue gets a new name. Without ffmpeg only the
+hashed WAVs are built; without a build the original files are used.
+
+Usage:
+    python build_audio.py            # incremental
+    python build_audio.py --clean    # also delete outputs no cue uses
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import subprocess
+from flask import request, url_for
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIO_DIR = os.path.join(BASE_DIR, 'static', 'audio')
+BUILD_DIR = os.path.join(BASE_DIR, 'static', 'build')
+AUDIO_BUILD_DIR = os.path.join(BUILD_DIR, 'audio')
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'audio-manifest.json')
+
+# Compact encoding, tried first by the browser. Opus at 64 kbit/s is
+# transparent for the voice-over cues and about 1/20 of the WAV size.
+COMPACT_EXTENSION = '.opus'
+COMPACT_MIME = 'audio/ogg; codecs=opus'
+COMPACT_ARGS = ['-c:a', 'libopus', '-b:a', '64k', '-vbr', 'on', '-map_metadata', '-1']
+
+FALLBACK_MIME = 'audio/wav'
+
+# Hex digits of the content hash in output names
+HASH_LENGTH = 10
+
+# Served for everything under static/build (names change with content)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_hash(path):
+    """
+    Hash a file's contents for its output name.
+
+    Args:
+        path (str): File to hash
+
+    Returns:
+        str: First HASH_LENGTH hex digits of its SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def find_cues(audio_dir=AUDIO_DIR):
+    """
+    List the WAV cues, as paths relative to audio_dir with '/' separators.
+
+    Returns:
+        list: e.g. ['fingerprint/cook_08.wav', ...], sorted
+    """
+    cues = []
+    for root, _, files in os.walk(audio_dir):
+        for name in files:
+            if name.lower().endswith('.wav'):
+                relative = os.path.relpath(os.path.join(root, name), audio_dir)
+                cues.append(relative.replace(os.sep, '/'))
+    return sorted(cues)
+
+
+def transcode(source, target):
+    """
+    Encode a cue with ffmpeg into a temporary file, then move it into place.
+
+    Returns:
+        bool: True if the compact file was written
+    """
+    tmp_path = target + '.tmp'
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', source, *COMPACT_ARGS, '-f', 'ogg', tmp_path],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(f"❌ ffmpeg failed on {source}: {result.stderr.strip()}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, target)
+    return True
+
+
+def build(audio_dir=AUDIO_DIR, build_dir=AUDIO_BUILD_DIR, manifest_path=MANIFEST_PATH, clean=False):
+    """
+    Build hashed cues and the manifest. Outputs that already exist for a
+    cue's current content are kept, so a rebuild only encodes what changed.
+
+    Args:
+        audio_dir (str): Source WAVs
+        build_dir (str): Output directory
+        manifest_path (str): Manifest to write
+        clean (bool): Delete outputs that no cue refers to any more
+
+    Returns:
+        dict: The manifest
+    """
+    have_ffmpeg = shutil.which('ffmpeg') is not None
+    if not have_ffmpeg:
+        print("⚠️  ffmpeg not found; building WAV cues only (install it with: sudo apt-get install ffmpeg)")
+
+    build_prefix = os.path.relpath(build_dir, os.path.join(BASE_DIR, 'static')).replace(os.sep, '/')
+    manifest = {}
+    written = set()
+    source_bytes = compact_bytes = encoded = 0
+
+    for cue in find_cues(audio_dir):
+        source = os.path.join(audio_dir, *cue.split('/'))
+        digest = content_hash(source)
+        stem, _ = os.path.splitext(cue)
+        out_dir = os.path.join(build_dir, os.path.dirname(stem))
+        os.makedirs(out_dir, exist_ok=True)
+        base = f"{os.path.basename(stem)}.{digest}"
+        url_dir = '/'.join(filter(None, [build_prefix, os.path.dirname(stem)]))
+
+        sources = []
+        compact_path = os.path.join(out_dir, base + COMPACT_EXTENSION)
+        if not os.path.exists(compact_path) and have_ffmpeg:
+            if transcode(source, compact_path):
+                encoded += 1
+        if os.path.exists(compact_path):
+            sources.append({'file': f"{url_dir}/{base}{COMPACT_EXTENSION}", 'type': COMPACT_MIME})
+            written.add(compact_path)
+            compact_bytes += os.path.getsize(compact_path)
+
+        fallback_path = os.path.join(out_dir, base + '.wav')
+        if not os.path.exists(fallback_path):
+            shutil.copyfile(source, fallback_path)
+        sources.append({'file': f"{url_dir}/{base}.wav", 'type': FALLBACK_MIME})
+        written.add(fallback_path)
+        source_bytes += os.path.getsize(source)
+
+        manifest[cue] = {'hash': digest, 'sources': sources}
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    if clean:
+        for root, _, files in os.walk(build_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in written:
+                    os.remove(path)
+
+    print(f"🎵 {len(manifest)} cue(s), {encoded} encoded: "
+          f"{source_bytes / 1e6:.1f} MB WAV, {compact_bytes / 1e6:.1f} MB compact -> {manifest_path}")
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Read the manifest written by build().
+
+    Returns:
+        dict: Cue path -> {'hash', 'sources'}, or {} if there is no build
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_audio_assets(app, manifest_path=MANIFEST_PATH):
+    """
+    Let templates resolve cues through the manifest and serve built
+    assets with immutable cache headers.
+
+    Adds the Jinja globals audio_sources(cue), a list of {'url', 'type'}
+    best first for pickAudio() in base.html, and audio_url(cue), the
+    preferred URL alone.
+
+    Args:
+        app (Flask): Application
+        manifest_path (str): Manifest written by build()
+
+    Returns:
+        dict: The loaded manifest
+    """
+    manifest = load_manifest(manifest_path)
+    if not manifest:
+        print("ℹ️  No audio build found; serving the original WAV cues (run: python build_audio.py)")
+
+    def audio_sources(cue):
+        entry = manifest.get(cue)
+        if entry is None:
+            return [{'url': url_for('static', filename=f"audio/{cue}"), 'type': FALLBACK_MIME}]
+        return [{'url': url_for('static', filename=source['file']), 'type': source['type']}
+                for source in entry['sources']]
+
+    def audio_url(cue):
+        return audio_sources(cue)[0]['url']
+
+    app.jinja_env.globals.update(audio_sources=audio_sources, audio_url=audio_url)
+
+    @app.after_request
+    def cache_built_assets(response):
+        if request.endpoint == 'static' and request.view_args.get('filename', '').startswith('build/') \
+                and response.status_code == 200:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode the audio cues and write the manifest.")
+    parser.add_argument("--clean", action="store_true", help="delete built files no cue uses any more")
+    args = parser.parse_args()
+    build(clean=args.clean)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Precache manifest build.
+Every step of the flow is a full page load, and each one asks the server
+for the stylesheet, font, images and its audio cue again. This build
+finds every static asset the pages use and writes a manifest listing
+them with a version hash over their contents. The app serves a service
+worker at /sw.js built from the manifest. base.html registers it, and
+it loads every asset into the browser cache when the kiosk boots. From
+then on it serves /static/ cache-first. A new manifest version (any
+asset changed) installs a new cache and drops the old one.
+
+Assets are found in:
+    - url_for('static', filename='...') in the templates
+    - audio_sources('...') in the templates (the preferred built file, see build_audio.py)
+    - sprite('...') in the templates (the sheet, or its frames, see build_sprites.py)
+    - url('/static/...') in style.css
+
+Run it after build_audio.py and build_sprites.py, whose outputs it lists.
+
+Usage:
+    python build_precache.py
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import urllib.parse
+from flask import make_response, render_template
+import build_audio
+import build_sprites
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+MANIFEST_PATH = os.path.join(STATIC_DIR, 'build', 'precache-manifest.json')
+
+STATIC_URL_PREFIX = '/static/'
+
+# Template and stylesheet references to static files
+STATIC_REF = re.compile(r"url_for\(\s*'static'\s*,\s*filename\s*=\s*'([^']+)'\s*\)")
+AUDIO_REF = re.compile(r"audio_sources\(\s*'([^']+)'\s*\)")
+SPRITE_REF = re.compile(r"sprite\(\s*'([^']+)'\s*\)")
+CSS_REF = re.compile(r"url\(\s*['\"]?" + re.escape(STATIC_URL_PREFIX) + r"([^'\")]+)['\"]?\s*\)")
+
+# Hex digits of the manifest version
+HASH_LENGTH = 12
+
+
+def static_url(path):
+    """URL of a file under static/, quoted the way url_for() quotes it."""
+    return STATIC_URL_PREFIX + urllib.parse.quote(path)
+
+
+def find_assets(templates_dir=TEMPLATES_DIR, static_dir=STATIC_DIR):
+    """
+    Collect the static files the pages use.
+
+    Returns:
+        list: Paths relative to static/, sorted
+    """
+    audio = build_audio.load_manifest()
+    sprites = build_sprites.load_manifest()
+    sequences = None
+    assets = set()
+
+    sources = []
+    for name in sorted(os.listdir(templates_dir)):
+        if name.endswith('.html'):
+            with open(os.path.join(templates_dir, name)) as f:
+                sources.append(f.read())
+
+    for text in sources:
+        assets.update(STATIC_REF.findall(text))
+
+        for cue in AUDIO_REF.findall(text):
+            entry = audio.get(cue)
+            assets.add(entry['sources'][0]['file'] if entry else f"audio/{cue}")
+
+        for name in SPRITE_REF.findall(text):
+            if name in sprites:
+                assets.add(sprites[name]['sheet'])
+                continue
+            if sequences is None:
+                sequences = build_sprites.find_sequences()
+            for path in sequences.get(name, []):
+                assets.add(os.path.relpath(path, static_dir).replace(os.sep, '/'))
+
+    for path in list(assets):
+        if path.endswith('.css'):
+            with open(os.path.join(static_dir, *path.split('/'))) as f:
+                assets.update(urllib.parse.unquote(ref) for ref in CSS_REF.findall(f.read()))
+
+    missing = sorted(path for path in assets if not os.path.isfile(os.path.join(static_dir, *path.split('/'))))
+    for path in missing:
+        print(f"⚠️  Referenced but not found, not precached: static/{path}")
+    return sorted(assets - set(missing))
+
+
+def build(manifest_path=MANIFEST_PATH, static_dir=STATIC_DIR):
+    """
+    Write the precache manifest.
+
+    Args:
+        manifest_path (str): Manifest to write
+        static_dir (str): Static file root
+
+    Returns:
+        dict: {'version': str, 'assets': [url, ...]}
+    """
+    version = hashlib.sha256()
+    total_bytes = 0
+    assets = find_assets(static_dir=static_dir)
+    for path in assets:
+        full_path = os.path.join(static_dir, *path.split('/'))
+        version.update(f"{path}\n{build_audio.content_hash(full_path)}\n".encode())
+        total_bytes += os.path.getsize(full_path)
+
+    manifest = {
+        'version': version.hexdigest()[:HASH_LENGTH],
+        'assets': [static_url(path) for path in assets],
+    }
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"📦 {len(assets)} asset(s), {total_bytes / 1e6:.1f} MB, version {manifest['version']} -> {manifest_path}")
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Read the manifest written by build().
+
+    Returns:
+        dict: {'version', 'assets'}, or None if there is no build
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_precache(app, manifest_path=MANIFEST_PATH):
+    """
+    Serve the service worker at /sw.js (endpoint "service_worker").
+
+    Without a manifest the worker caches nothing and deletes the caches
+    of any earlier version, so a kiosk without a build always loads
+    assets from the server.
+
+    Args:
+        app (Flask): Application
+        manifest_path (str): Manifest written by build()
+
+    Returns:
+        dict: The manifest, or None
+    """
+    manifest = load_manifest(manifest_path)
+    if manifest is None:
+        print("ℹ️  No precache manifest found; the service worker caches nothing (run: python build_precache.py)")
+
+    def service_worker():
+        version, assets = (manifest['version'], manifest['assets']) if manifest else ('none', [])
+        response = make_response(render_template('sw.js', version=version, assets=assets))
+        response.headers['Content-Type'] = 'application/javascript'
+        # The browser compares the worker on every navigation; that check
+        # is what picks up a new version
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    app.add_url_rule('/sw.js', 'service_worker', service_worker)
+    return manifest
+
+
+def main():
+    build()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Animation sprite build.
+The UI animations are folders of numbered PNG frames
+("static/images/UI Elements/.../<name>_00000.png"). Swapping an <img> to
+each frame in turn makes the browser fetch and decode on every tick, so
+this build packs each sequence into one sprite sheet in
+static/build/sprites and writes a manifest with its frame count, frame
+size, grid and fps. Templates play a sequence by name:
+
+    playSprite(element, {{ sprite('StartTheRitual') | tojson }});
+
+playSprite() (base.html) moves the background of one decoded sheet.
+Without a build the frames are found on disk at startup and preloaded
+instead, so frame counts are never written by hand either way.
+
+Usage:
+    python build_sprites.py            # incremental
+    python build_sprites.py --clean    # also delete sheets no sequence uses
+"""
+import os
+import re
+import sys
+import json
+import math
+import struct
+import hashlib
+import argparse
+from flask import url_for
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+FRAMES_DIR = os.path.join(STATIC_DIR, 'images', 'UI Elements')
+SPRITE_BUILD_DIR = os.path.join(STATIC_DIR, 'build', 'sprites')
+MANIFEST_PATH = os.path.join(STATIC_DIR, 'build', 'sprite-manifest.json')
+
+# A frame file: "<sequence name>_<frame number>.png"
+FRAME_PATTERN = re.compile(r'^(?P<name>.+)_(?P<index>\d+)\.png$', re.IGNORECASE)
+
+# Frames per second for every sequence, unless listed in SPRITE_FPS
+DEFAULT_FPS = 6
+SPRITE_FPS = {}
+
+# Widest sheet to build; frames wrap onto more rows beyond this. Stays
+# within the texture size every GPU the kiosk could have supports.
+MAX_SHEET_WIDTH = 4096
+
+# Hex digits of the content hash in sheet names
+HASH_LENGTH = 10
+
+
+def find_sequences(frames_dir=FRAMES_DIR):
+    """
+    Find the frame sequences on disk.
+
+    Args:
+        frames_dir (str): Directory to scan (recursively)
+
+    Returns:
+        dict: Sequence name -> list of frame paths in frame order. Only
+              names with more than one frame are sequences.
+    """
+    found = {}
+    for root, _, files in os.walk(frames_dir):
+        for name in files:
+            match = FRAME_PATTERN.match(name)
+            if match:
+                found.setdefault(match.group('name'), []).append(
+                    (int(match.group('index')), os.path.join(root, name))
+                )
+    return {name: [path for _, path in sorted(frames)]
+            for name, frames in sorted(found.items()) if len(frames) > 1}
+
+
+def sheet_layout(frame_count, frame_width):
+    """
+    Choose the grid for a sheet.
+
+    Returns:
+        tuple: (columns, rows)
+    """
+    columns = max(1, min(frame_count, MAX_SHEET_WIDTH // frame_width))
+    return columns, math.ceil(frame_count / columns)
+
+
+def build(frames_dir=FRAMES_DIR, build_dir=SPRITE_BUILD_DIR, manifest_path=MANIFEST_PATH, clean=False):
+    """
+    Build a sprite sheet per sequence and the manifest. A sheet whose
+    frames have not changed is kept as it is.
+
+    Args:
+        frames_dir (str): Frame directory to scan
+        build_dir (str): Output directory for the sheets
+        manifest_path (str): Manifest to write
+        clean (bool): Delete sheets that no sequence uses any more
+
+    Returns:
+        dict: The manifest
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        print("❌ Pillow is not installed; run: pip install -r requirements.txt")
+        raise
+
+    os.makedirs(build_dir, exist_ok=True)
+    sheet_prefix = os.path.relpath(build_dir, STATIC_DIR).replace(os.sep, '/')
+    manifest = {}
+    written = set()
+    packed = 0
+
+    for name, paths in find_sequences(frames_dir).items():
+        frames = [Image.open(path) for path in paths]
+        width = max(frame.width for frame in frames)
+        height = max(frame.height for frame in frames)
+        if any(frame.size != (width, height) for frame in frames):
+            print(f"⚠️  {name}: frames differ in size; packing each at the top left of a {width}x{height} cell")
+        columns, rows = sheet_layout(len(frames), width)
+
+        digest = hashlib.sha256(f"{columns}x{rows}".encode())
+        for path in paths:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        sheet_name = f"{name.replace(' ', '_')}.{digest.hexdigest()[:HASH_LENGTH]}.png"
+        sheet_path = os.path.join(build_dir, sheet_name)
+
+        if not os.path.exists(sheet_path):
+            sheet = Image.new('RGBA', (columns * width, rows * height))
+            for index, frame in enumerate(frames):
+                sheet.paste(frame.convert('RGBA'), ((index % columns) * width, (index // columns) * height))
+            tmp_path = sheet_path + '.tmp'
+            sheet.save(tmp_path, format='PNG', optimize=True)
+            os.replace(tmp_path, sheet_path)
+            packed += 1
+        for frame in frames:
+            frame.close()
+        written.add(sheet_path)
+
+        manifest[name] = {
+            'sheet': f"{sheet_prefix}/{sheet_name}",
+            'frames': len(paths),
+            'width': width,
+            'height': height,
+            'columns': columns,
+            'rows': rows,
+            'fps': SPRITE_FPS.get(name, DEFAULT_FPS),
+        }
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    if clean:
+        for entry in os.listdir(build_dir):
+            path = os.path.join(build_dir, entry)
+            if path not in written:
+                os.remove(path)
+
+    print(f"🎞️  {len(manifest)} sequence(s), {packed} sheet(s) packed -> {manifest_path}")
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Read the manifest written by build().
+
+    Returns:
+        dict: Sequence name -> sheet entry, or {} if there is no build
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def png_size(path):
+    """
+    Read a PNG's size from its header, without decoding it.
+
+    Returns:
+        tuple: (width, height)
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    return struct.unpack('>II', header[16:24])
+
+
+def scan_frames(frames_dir=FRAMES_DIR):
+    """
+    Describe the sequences on disk for playing frame by frame, for when
+    there is no build.
+
+    Returns:
+        dict: Sequence name -> entry like the manifest's, with a 'files'
+              list (paths under static/) instead of a 'sheet'
+    """
+    sequences = {}
+    for name, paths in find_sequences(frames_dir).items():
+        width, height = png_size(paths[0])
+        sequences[name] = {
+            'files': [os.path.relpath(path, STATIC_DIR).replace(os.sep, '/') for path in paths],
+            'frames': len(paths),
+            'width': width,
+            'height': height,
+            'fps': SPRITE_FPS.get(name, DEFAULT_FPS),
+        }
+    return sequences
+
+
+def init_sprites(app, manifest_path=MANIFEST_PATH, frames_dir=FRAMES_DIR):
+    """
+    Add the template global sprite(name), which describes a sequence for
+    playSprite() in base.html: a sheet URL and grid from the build, or,
+    without a build, the URLs of the individual frames on disk. Built
+    sheets get immutable cache headers from init_audio_assets().
+
+    Args:
+        app (Flask): Application
+        manifest_path (str): Manifest written by build()
+        frames_dir (str): Frame directory, scanned when there is no build
+
+    Returns:
+        dict: The sequences, by name
+    """
+    sequences = load_manifest(manifest_path)
+    if not sequences:
+        print("ℹ️  No sprite build found; animating the individual frames (run: python build_sprites.py)")
+        sequences = scan_frames(frames_dir)
+
+    def sprite(name):
+        if name not in sequences:
+            raise KeyError(f"No animation frames named {name!r} in {frames_dir}")
+        entry = dict(sequences[name])
+        if 'sheet' in entry:
+            entry['sheet'] = url_for('static', filename=entry['sheet'])
+        else:
+            entry['frame_urls'] = [url_for('static', filename=path) for path in entry.pop('files')]
+        return entry
+
+    app.jinja_env.globals.update(sprite=sprite)
+    return sequences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the UI animation frames into sprite sheets.")
+    parser.add_argument("--clean", action="store_true", help="delete sheets no sequence uses any more")
+    args = parser.parse_args()
+    build(clean=args.clean)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Candle controller serial link.
+The candle Arduino (arduino-candles.ino) switches the candles, fairy
+lights, crystal ball and diffusers. Besides the trigger line from the
+printer Uno it takes one cue per text line over USB, e.g.
+"CUE candle1 ON", and answers "OK candle1 ON" once the relay is set.
+This lets show_timeline.py time each effect from the host.
+"""
+import time
+import threading
+import collections
+import concurrent.futures
+import serial
+from device_discovery import discover_devices, load_cached_port, remember_port, ROLE_CANDLES
+from serial_protocol import ROLE_QUERY, BASE_BAUD
+from kiosk_log import info, warning, error
+
+
+# Outputs the sketch knows by name (relayForName() in the sketch);
+# "all" only takes "off"
+CANDLE_OUTPUTS = ("candle1", "candle2", "candle3", "fairy", "diffusers", "crystal", "all")
+
+# Seconds the sketch may take to answer a cue. Setting a relay is
+# immediate, but the sketch does not read while its own candle sequence
+# (started by the trigger line) is running.
+CUE_TIMEOUT = 2.0
+
+# Seconds a timed-out cue still waits for its late answer, so the answer
+# is not taken for a later cue's. The sketch's candle sequence blocks it
+# for over 10 s.
+LATE_REPLY_TIMEOUT = 30.0
+
+# Seconds to wait for the sketch to answer the identity query after
+# opening the port (covers an auto-reset and the 1 s delay in setup())
+READY_TIMEOUT = 5.0
+
+
+class CandleCue:
+    """
+    Handle for a cue sent to the candle controller.
+
+    Attributes:
+        command (str): Cue as passed to CandleSerial.send(), e.g. "candle1 on"
+        output (str): Output it switches, e.g. "candle1"
+        state (str): "ON" or "OFF", as the sketch echoes it
+        ack (Future): Resolves to "OK", or None if the sketch rejected the
+                      cue, did not answer in time or is not connected
+        sent_at (float): time.monotonic() when the line was written
+        acked_at (float): time.monotonic() when the answer arrived, or None
+    """
+
+    def __init__(self, command):
+        self.command = command
+        parts = command.split()
+        self.output = parts[0] if parts else ""
+        self.state = parts[1].upper() if len(parts) > 1 else ""
+        self.ack = concurrent.futures.Future()
+        self.sent_at = time.monotonic()
+        self.acked_at = None
+
+    def _finish(self, status):
+        if not self.ack.done():
+            self.acked_at = time.monotonic()
+            self.ack.set_result(status)
+
+
+def cue_line(command):
+    """
+    Build the line the sketch expects for a cue.
+
+    Args:
+        command (str): "<output> on" or "<output> off", e.g. "candle2 on"
+
+    Returns:
+        bytes: Line to write, e.g. b"CUE candle2 ON\\n"
+
+    Raises:
+        ValueError: Unknown output or state, or "all on" (the sketch
+                    turns everything off for any "all" cue)
+    """
+    parts = command.split()
+    if len(parts) != 2 or parts[0] not in CANDLE_OUTPUTS or parts[1].lower() not in ("on", "off"):
+        raise ValueError(f"Not a candle cue: {command!r}")
+    if parts[0] == "all" and parts[1].lower() != "off":
+        raise ValueError(f"Not a candle cue: {command!r} (\"all\" only takes \"off\")")
+    return f"CUE {parts[0]} {parts[1].upper()}\n".encode('ascii')
+
+
+class CandleSerial:
+    """Line-based link to the candle controller Arduino."""
+
+    def __init__(self, port=None, baudrate=BASE_BAUD, timeout=0.1):
+        """
+        Initialize the candle link.
+
+        Args:
+            port (str): Serial port (None finds the candle board by role)
+            baudrate (int): Must match Serial.begin() in the candle sketch
+            timeout (float): Serial read timeout in seconds
+        """
+        self.port = port
+        self.configured_port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.serial_connection = None
+        self.is_connected = False
+        self._pending = collections.deque()
+        self._write_lock = threading.RLock()
+        self._ready = threading.Event()
+        self._reader_thread = None
+
+    def connect(self):
+        """
+        Open the candle board's port and wait for it to answer.
+
+        Returns:
+            bool: True if connected
+        """
+        port = (self.configured_port or load_cached_port(ROLE_CANDLES)
+                or discover_devices(roles=(ROLE_CANDLES,)).get(ROLE_CANDLES))
+        if not port:
+            print("⚠️  No candle Arduino found; the show timeline will use the trigger line")
+            return False
+
+        try:
+            connection = serial.Serial()
+            connection.port = port
+            connection.baudrate = self.baudrate
+            connection.timeout = self.timeout
+            connection.dtr = False
+            connection.exclusive = True
+            connection.open()
+        except (serial.SerialException, OSError) as e:
+            print(f"❌ Could not open candle Arduino on {port}: {e}")
+            return False
+
+        self.port = port
+        self.serial_connection = connection
+        self.is_connected = True
+        self._ready.clear()
+        self._start_reader_thread()
+
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not self._ready.is_set() and time.monotonic() < deadline:
+            self._write(ROLE_QUERY)
+            self._ready.wait(0.25)
+        if not self._ready.is_set():
+            print(f"❌ No answer from the candle Arduino on {port}")
+            self.disconnect()
+            return False
+
+        remember_port(port, ROLE_CANDLES)
+        print(f"✅ Connected to candle Arduino on {port}")
+        return True
+
+    def disconnect(self):
+        """Close the port and fail any cue still waiting for an answer."""
+        self.is_connected = False
+        if self.serial_connection:
+            try:
+                self.serial_connection.close()
+            except (serial.SerialException, OSError):
+                pass
+        if self._reader_thread and self._reader_thread is not threading.current_thread():
+            self._reader_thread.join(timeout=1)
+        while self._pending:
+            self._pending.popleft()._finish(None)
+
+    def send(self, command):
+        """
+        Send a cue and return immediately.
+
+        Args:
+            command (str): "<output> on|off", e.g. "candle1 on"
+
+        Returns:
+            CandleCue: Handle whose ack resolves once the sketch has set the relay
+        """
+        cue = CandleCue(command)
+        if not self.is_connected:
+            warning('candles.offline', "⚠️  Candle Arduino not connected, skipping cue: {command}", command=command)
+            cue._finish(None)
+            return cue
+
+        line = cue_line(command)
+        with self._write_lock:
+            # Queued before writing, so the answer cannot arrive first
+            self._pending.append(cue)
+            cue.sent_at = time.monotonic()
+            if not self._write(line):
+                self._pending.remove(cue)
+                cue._finish(None)
+        return cue
+
+    def _write(self, data):
+        try:
+            with self._write_lock:
+                self.serial_connection.write(data)
+            return True
+        except (serial.SerialException, OSError) as e:
+            error('candles.write_failed', "❌ Candle Arduino write failed: {error}", error=str(e))
+            return False
+
+    def _start_reader_thread(self):
+        def _reader():
+            buffer = bytearray()
+            while self.is_connected:
+                try:
+                    data = self.serial_connection.read(self.serial_connection.in_waiting or 1)
+                except (serial.SerialException, OSError, TypeError) as e:
+                    if self.is_connected:
+                        error('candles.link_lost', "❌ Candle Arduino link lost: {error}", error=str(e), port=self.port)
+                        threading.Thread(target=self.disconnect, daemon=True).start()
+                    return
+
+                buffer.extend(data)
+                while b"\n" in buffer:
+                    raw, _, rest = buffer.partition(b"\n")
+                    buffer = bytearray(rest)
+                    self._handle_line(raw.decode('utf-8', errors='replace').strip())
+                self._expire_pending()
+
+        self._reader_thread = threading.Thread(target=_reader, name="CandleSerialReader", daemon=True)
+        self._reader_thread.start()
+
+    def _handle_line(self, line):
+        if not line:
+            return
+        if line == "ROLE candles":
+            self._ready.set()
+            return
+        if line.startswith("OK ") or line.startswith("ERR "):
+            self._handle_answer(line)
+            return
+        info('candles.line', "🕯️  Candles: {line}", line=line)
+
+    def _handle_answer(self, line):
+        # "OK <output> <state>" or "ERR <output>". The sketch answers cues
+        # in the order it reads them, so the answer is the oldest cue for
+        # that output still owed one; cues ahead of it went unanswered
+        parts = line.split()
+        ok = parts[0] == "OK"
+        output = parts[1] if len(parts) > 1 else ""
+        state = parts[2] if len(parts) > 2 else ""
+        match = next((cue for cue in list(self._pending)
+                      if cue.output == output and (not ok or cue.state == state)), None)
+        if match is None:
+            warning('candles.unmatched', "⚠️  Candle Arduino answer matches no cue: {line}", line=line)
+            return
+        while self._pending:
+            cue = self._pending.popleft()
+            if cue is match:
+                break
+            cue._finish(None)
+
+        if match.ack.done():
+            # Timed out already; the sketch was busy with its own sequence
+            info('candles.late_answer', "🕯️  Late answer to candle cue {command} after {delay_s:.1f}s",
+                 command=match.command, delay_s=time.monotonic() - match.sent_at, ok=ok)
+            return
+        if not ok:
+            warning('candles.rejected', "⚠️  Candle Arduino rejected cue: {command}", command=match.command)
+        match._finish("OK" if ok else None)
+
+    def _expire_pending(self):
+        # A cue that times out is failed but kept for a while, so its
+        # late answer is not taken for a newer cue's
+        now = time.monotonic()
+        for cue in list(self._pending):
+            if not cue.ack.done() and now - cue.sent_at > CUE_TIMEOUT:
+                warning('candles.ack_timeout', "⚠️  No answer to candle cue: {command}", command=cue.command)
+                cue._finish(None)
+        while self._pending and now - self._pending[0].sent_at > LATE_REPLY_TIMEOUT:
+            self._pending.popleft()
+
+
+# Global candle link instance
+candles = None
+
+
+def init_candles(port=None, background=False):
+    """
+    Initialize the global candle link.
+
+    Args:
+        port (str): Serial port (None finds the candle board by role)
+        background (bool): Connect on a background thread and return at once
+
+    Returns:
+        CandleSerial: Link instance (check is_connected before relying on it)
+    """
+    global candles
+    candles = CandleSerial(port=port)
+    if background:
+        threading.Thread(target=candles.connect, name="CandleConnect", daemon=True).start()
+    else:
+        candles.connect()
+    return candles
+
+
+def get_candles():
+    """Get the global candle link instance."""
+    global candles
+    return candles
@@ -0,0 +1,398 @@
+"""
+Live content registry.
+The page text (CONTENT in content.py) and the fortune templates
+(FORTUNE_TEMPLATES and DEFAULT_TEMPLATE in fortune_generator.py) are
+reloaded when those files are saved, without restarting the app, so an
+edit does not reconnect the Arduino or drop a visit in progress.
+
+A background thread notices the change (watchdog if it is installed,
+otherwise by polling), reads the literals out of the files without
+importing them, validates them, compiles the templates and publishes
+the result as a new ContentVersion with one reference assignment. A
+request keeps the version that was current when it started. An edit
+that does not validate is reported and the running version stays.
+"""
+import os
+import ast
+import time
+import hashlib
+import threading
+from flask import g, has_request_context
+from kiosk_log import info, warning, error
+import fortune_generator
+from fortune_generator import (FortuneTemplate, compile_templates, layout_fortune,
+                               MAX_NAME_LENGTH, MAX_FEATURE_LENGTH, MAX_FORTUNE_BYTES)
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTENT_PATH = os.path.join(BASE_DIR, 'content.py')
+TEMPLATES_PATH = os.path.join(BASE_DIR, 'fortune_generator.py')
+
+# Categories offered on step 2; each needs a *Step1 and *Step2 page and
+# templates for every answer its *Step2 page knows
+CATEGORIES = ('love', 'guidance', 'fortune', 'surprise')
+
+# Pages every visit passes through
+REQUIRED_PAGES = ('start', 'step1', 'step2', 'step3', 'result')
+
+# Fields a fortune template may use, and how they are written
+TEMPLATE_FIELDS = ('name', 'feature')
+placeholder = fortune_generator._PLACEHOLDER
+
+# Seconds between checks when watchdog is not installed
+POLL_INTERVAL = 1.0
+
+# Seconds to wait after a change before reloading, so an editor's
+# save (often several writes or a rename) is read once, complete
+SETTLE_DELAY = 0.2
+
+
+class ContentError(ValueError):
+    """Edited content that cannot be published."""
+
+
+class ContentVersion:
+    """
+    One published set of content and fortune templates.
+
+    Attributes:
+        number (int): 1 for the version loaded at startup, then counting up
+        content (dict): Page name -> page content, as CONTENT in content.py
+        templates (dict): Compiled fortune templates (see compile_templates())
+        default_template (FortuneTemplate): Used when no template matches
+        digest (str): Hash of the source files it was built from
+    """
+
+    __slots__ = ('number', 'content', 'templates', 'default_template', 'digest')
+
+    def __init__(self, number, content, templates, default_template, digest):
+        self.number = number
+        self.content = content
+        self.templates = templates
+        self.default_template = default_template
+        self.digest = digest
+
+
+def read_literals(path, names):
+    """
+    Evaluate module-level assignments of literals in a Python file
+    without running it.
+
+    Args:
+        path (str): Python source file
+        names (tuple): Variable names to read
+
+    Returns:
+        dict: Name -> value
+
+    Raises:
+        ContentError: Syntax error, a missing name or a value that is not a literal
+    """
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    try:
+        tree = ast.parse(source, filename=path)
+    except SyntaxError as e:
+        raise ContentError(f"{os.path.basename(path)} line {e.lineno}: {e.msg}")
+
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in names:
+                try:
+                    values[name] = ast.literal_eval(node.value)
+                except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError) as e:
+                    # TypeError: e.g. a set or list used as a dict key
+                    raise ContentError(f"{os.path.basename(path)} line {node.lineno}: {name} is not a plain literal ({e})")
+    missing = [name for name in names if name not in values]
+    if missing:
+        raise ContentError(f"{os.path.basename(path)}: {', '.join(missing)} not found")
+    return values
+
+
+def check_template(text, where):
+    """
+    Check that a fortune template only uses known, well-formed fields.
+
+    Raises:
+        ContentError: The problem, with where it is
+    """
+    if not isinstance(text, str) or not text.strip():
+        raise ContentError(f"{where}: template is empty or not text")
+    # Fields are exactly "{word}" (fortune_generator._PLACEHOLDER); any
+    # other brace would be printed as it is
+    if '{' in placeholder.sub('', text) or '}' in placeholder.sub('', text):
+        raise ContentError(f"{where}: unmatched or malformed brace in {text!r}")
+    for field in placeholder.findall(text):
+        if field not in TEMPLATE_FIELDS:
+            raise ContentError(f"{where}: unknown field {{{field}}} in {text!r}")
+    # Longest name and feature, as one word each (the worst case for
+    # line breaks); the fortune must still fit in one frame
+    longest = "\n".join(layout_fortune(FortuneTemplate(text), {
+        'name': "W" * MAX_NAME_LENGTH, 'feature': "W" * MAX_FEATURE_LENGTH}))
+    if len(longest.encode('utf-8')) > MAX_FORTUNE_BYTES:
+        raise ContentError(f"{where}: template is too long to print with a {MAX_NAME_LENGTH}-character name "
+                           f"and {MAX_FEATURE_LENGTH}-character feature ({MAX_FORTUNE_BYTES} bytes at most)")
+
+
+def validate(content, templates, default_template):
+    """
+    Check content and fortune templates before they are published.
+
+    Args:
+        content (dict): CONTENT
+        templates (dict): FORTUNE_TEMPLATES
+        default_template (str): DEFAULT_TEMPLATE
+
+    Raises:
+        ContentError: The first problem found
+    """
+    if not isinstance(content, dict):
+        raise ContentError("CONTENT is not a dict")
+    for page in REQUIRED_PAGES:
+        if not isinstance(content.get(page), dict):
+            raise ContentError(f"CONTENT has no {page!r} page")
+    if not isinstance(templates, dict):
+        raise ContentError("FORTUNE_TEMPLATES is not a dict")
+    for category, answers in templates.items():
+        if not isinstance(answers, dict):
+            raise ContentError(f"FORTUNE_TEMPLATES[{category!r}] is not a dict of answers")
+        for answer, texts in answers.items():
+            if not isinstance(texts, (list, tuple)):
+                raise ContentError(f"FORTUNE_TEMPLATES[{category!r}][{answer!r}] is not a list of templates")
+
+    for category in CATEGORIES:
+        for page in (f"{category}Step1", f"{category}Step2"):
+            if not isinstance(content.get(page), dict):
+                raise ContentError(f"CONTENT has no {page!r} page")
+        answers = [key for key, value in content[f"{category}Step2"].items() if isinstance(value, dict)]
+        if not answers:
+            raise ContentError(f"CONTENT[{category + 'Step2'!r}] has no answers")
+        for answer in answers:
+            texts = templates.get(category, {}).get(answer)
+            if not texts:
+                raise ContentError(f"FORTUNE_TEMPLATES has no templates for {category}/{answer}")
+
+    for category, answers in templates.items():
+        for answer, texts in answers.items():
+            for index, text in enumerate(texts):
+                check_template(text, f"FORTUNE_TEMPLATES[{category!r}][{answer!r}][{index}]")
+    check_template(default_template, "DEFAULT_TEMPLATE")
+
+
+def source_digest(paths):
+    """Hash of the files a version is built from."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_any_event(self, event):
+        paths = {os.path.abspath(event.src_path), os.path.abspath(getattr(event, 'dest_path', '') or event.src_path)}
+        if paths & set(self.registry.paths):
+            self.registry._changed.set()
+
+
+class ContentRegistry:
+    """Holds the current ContentVersion and reloads it when the sources change."""
+
+    def __init__(self, content_path=CONTENT_PATH, templates_path=TEMPLATES_PATH):
+        """
+        Args:
+            content_path (str): File defining CONTENT
+            templates_path (str): File defining FORTUNE_TEMPLATES and DEFAULT_TEMPLATE
+
+        Raises:
+            ContentError: The content on disk does not validate
+        """
+        self.content_path = content_path
+        self.templates_path = templates_path
+        self.paths = (os.path.abspath(content_path), os.path.abspath(templates_path))
+        self.listeners = []
+        self._rejected = None
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+        self.current = self._build(1)
+
+    def _build(self, number):
+        digest = source_digest(self.paths)
+        content = read_literals(self.content_path, ('CONTENT',))['CONTENT']
+        literals = read_literals(self.templates_path, ('FORTUNE_TEMPLATES', 'DEFAULT_TEMPLATE'))
+        validate(content, literals['FORTUNE_TEMPLATES'], literals['DEFAULT_TEMPLATE'])
+        return ContentVersion(
+            number,
+            content,
+            compile_templates(literals['FORTUNE_TEMPLATES']),
+            FortuneTemplate(literals['DEFAULT_TEMPLATE']),
+            digest,
+        )
+
+    def reload(self):
+        """
+        Rebuild from the sources and publish the result if they changed.
+
+        Returns:
+            bool: True if a new version was published
+        """
+        digest = None
+        try:
+            digest = source_digest(self.paths)
+            # Unchanged, or the edit already reported as invalid
+            if digest in (self.current.digest, self._rejected):
+                return False
+            version = self._build(self.current.number + 1)
+        except Exception as e:
+            # ContentError or OSError as a rule; anything else is a shape
+            # validate() does not check yet, and only this edit is refused
+            self._rejected = digest
+            detail = str(e) if isinstance(e, (ContentError, OSError)) else f"{type(e).__name__}: {e}"
+            error('content.rejected', "❌ Content not reloaded, still on version {version}: {error}",
+                  version=self.current.number, error=detail)
+            return False
+
+        # The one step that publishes it; requests read self.current once
+        self.current = version
+        info('content.published', "🔄 Content version {version} published", version=version.number)
+        for listener in self.listeners:
+            try:
+                listener(version)
+            except Exception as e:
+                warning('content.listener_failed', "⚠️  Content listener failed: {error}", error=str(e))
+        return True
+
+    def start(self):
+        """Start watching the sources on a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        if Observer is not None:
+            self._observer = Observer()
+            for directory in sorted({os.path.dirname(path) for path in self.paths}):
+                self._observer.schedule(_ChangeHandler(self), directory, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name="ContentReload", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching."""
+        self._stop.set()
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._observer is not None:
+                self._changed.wait()
+            else:
+                self._changed.wait(POLL_INTERVAL)
+            if self._stop.is_set():
+                return
+            self._changed.clear()
+            time.sleep(SETTLE_DELAY)
+            # Whatever goes wrong, the last good version stays published
+            # and the next edit is still picked up
+            try:
+                self.reload()
+            except Exception as e:
+                error('content.reload_failed', "❌ Content reload failed, still on version {version}: {error}",
+                      version=self.current.number, error=f"{type(e).__name__}: {e}")
+
+
+# Global registry instance
+registry = None
+
+
+def init_content_registry(app=None, watch=True):
+    """
+    Load the content and, optionally, start reloading it on change.
+
+    With an app, each request keeps the version that was current when it
+    started, and fortunes are generated from that version's templates.
+
+    Args:
+        app (Flask): Application (None outside the web app)
+        watch (bool): Reload when the source files change
+
+    Returns:
+        ContentRegistry: Registry instance
+    """
+    global registry
+    registry = ContentRegistry()
+    # Line layouts are cached per compiled template; old ones are unused
+    # once a new version is out
+    registry.listeners.append(lambda version: fortune_generator._plan_layout.cache_clear())
+    fortune_generator.template_source = _version_templates
+
+    if app is not None:
+        @app.before_request
+        def pin_content_version():
+            g.content_version = registry.current
+
+    if watch:
+        registry.start()
+        print(f"👀 Watching content for edits ({'watchdog' if Observer else 'polling'})")
+    return registry
+
+
+def _version_templates():
+    version = get_content_version()
+    return version.templates, version.default_template
+
+
+def get_content_registry():
+    """Get the global registry instance."""
+    global registry
+    return registry
+
+
+def get_content_version():
+    """
+    The content version to use: the one the current request started
+    with, or the latest outside a request.
+
+    Returns:
+        ContentVersion: Version, or None if the registry is not initialized
+    """
+    if has_request_context():
+        version = g.get('content_version')
+        if version is not None:
+            return version
+    return registry.current if registry else None
+
+
+def get_content(page_name):
+    """
+    Get content for a specific page (see content.get_content()).
+
+    Args:
+        page_name (str): Name of the page (e.g., 'start', 'step1', 'result')
+
+    Returns:
+        dict: Content dictionary for the page
+    """
+    version = get_content_version()
+    if version is None:
+        from content import get_content as get_static_content
+        return get_static_content(page_name)
+    return version.content.get(page_name, {})
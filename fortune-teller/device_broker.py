@@ -0,0 +1,497 @@
+"""
+Device broker.
+The Arduinos and the print spool can only belong to one process: two
+processes opening the same /dev/ttyUSB* would garble each other's
+frames. Running the broker lets the web app run in as many worker
+processes as the WSGI server likes, and lets workers restart without
+touching the hardware.
+
+The broker owns the printer and candle links, their supervisor, the
+show timeline and the print spool (everything init_devices() starts),
+and answers commands on a Unix domain socket. Commands are run one at a
+time, most urgent first: what a visitor is waiting for (the cabinet, a
+commit) before staging and printing, and monitoring last.
+
+Protocol: one JSON object per line each way.
+
+    -> {"id": 7, "cmd": "spool.commit", "args": ["<flow id>"]}
+    <- {"id": 7, "ok": true, "result": 12}
+
+The web app uses BrokerClient when DEVICE_BROKER_SOCKET is set; its
+get_arduino() and get_spool() stand in for the in-process ones.
+
+Usage:
+    python device_broker.py [--socket PATH]
+    DEVICE_BROKER_SOCKET=PATH SESSION_BACKEND=sqlite gunicorn -w 4 -b 0.0.0.0:5001 app:app
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import itertools
+import threading
+import arduino_serial
+import arduino_supervisor
+import print_spool
+from arduino_serial import init_arduino
+from arduino_supervisor import init_supervisor
+from candle_serial import init_candles
+from show_timeline import init_show
+from print_spool import init_spool
+from kiosk_log import init_kiosk_log, debug, info, warning, error
+from metrics import registry, HTTP_METRICS
+
+
+# Socket the web app talks to the broker on; when empty, the app opens
+# the devices itself (single-process server)
+BROKER_SOCKET = os.getenv('DEVICE_BROKER_SOCKET', '')
+
+# Where the broker listens when DEVICE_BROKER_SOCKET is not set
+DEFAULT_SOCKET = os.path.join(os.getenv('XDG_RUNTIME_DIR', '/tmp'), 'fortune-cookie-broker.sock')
+
+# Seconds a client waits for an answer
+BROKER_TIMEOUT = 5.0
+
+# Order in which queued commands run (lower first)
+PRIORITY_VISITOR = 0        # a visitor is waiting on it
+PRIORITY_PRINT = 1          # staging and queueing fortunes
+PRIORITY_MONITOR = 2        # status and statistics
+
+
+class BrokerError(RuntimeError):
+    """A command failed in the broker."""
+
+
+class BrokerUnavailable(ConnectionError):
+    """The broker could not be reached."""
+
+
+def init_devices():
+    """
+    Open the kiosk's devices in this process: the printer Arduino with
+    its supervisor, the candle board, the show timeline and the print
+    spool.
+
+    Returns:
+        tuple: (ArduinoSerial, PrintSpool)
+    """
+    # Set port=None for auto-detection, or specify like port='/dev/ttyUSB0'
+    # ARDUINO_PORT overrides it, e.g. to point at virtual_arduino.py
+    # The connection is made in the background so Flask can serve right away
+    arduino = init_arduino(port=os.getenv('ARDUINO_PORT') or None, baudrate=9600, background=True)
+
+    # Reconnect in the background if the link drops; commands sent meanwhile
+    # are held and replayed once the Arduino is back
+    init_supervisor(arduino)
+
+    # The candle board is driven cue by cue from the show timeline when it is
+    # on USB too; CANDLES_PORT pins its port like ARDUINO_PORT
+    candles = init_candles(port=os.getenv('CANDLES_PORT') or None, background=True)
+    show = init_show(arduino, candles)
+
+    # Fortunes go through a durable spool, so one queued before a restart or
+    # while the Arduino is unplugged is still printed; each print is played
+    # as a show with the candles
+    spool = init_spool(arduino, show=show)
+    return arduino, spool
+
+
+class DeviceBroker:
+    """Serves commands for the devices over a Unix domain socket."""
+
+    def __init__(self, socket_path, arduino, spool, supervisor=None):
+        """
+        Args:
+            socket_path (str): Unix socket to listen on
+            arduino (ArduinoSerial): Printer Arduino
+            spool (PrintSpool): Print spool dispatching to it
+            supervisor (ArduinoSupervisor): Reports reconnects and heartbeats, if any
+        """
+        self.socket_path = socket_path
+        self.arduino = arduino
+        self.spool = spool
+        self.supervisor = supervisor
+        self.commands = {
+            'arduino.send': (PRIORITY_VISITOR, self._send),
+            'arduino.status': (PRIORITY_MONITOR, self._status),
+            'spool.commit': (PRIORITY_VISITOR, spool.commit),
+            'spool.cancel': (PRIORITY_VISITOR, spool.cancel),
+            'spool.stage': (PRIORITY_PRINT, spool.stage),
+            'spool.append': (PRIORITY_PRINT, spool.append),
+            'spool.job_for_key': (PRIORITY_PRINT, spool.job_for_key),
+            'spool.stats': (PRIORITY_MONITOR, spool.stats),
+            'spool.recent': (PRIORITY_MONITOR, spool.recent),
+            # Routes are timed by the web workers; only the device side here
+            'metrics': (PRIORITY_MONITOR, lambda: registry.render(exclude=HTTP_METRICS)),
+            'ping': (PRIORITY_MONITOR, lambda: "pong"),
+        }
+        self._queue = None
+        self._order = itertools.count()
+        self._writers = set()
+
+    def _send(self, data):
+        """Queue a command for the Arduino, as the routes did in-process."""
+        if not self.arduino.is_available:
+            return None
+        request = self.arduino.send_data(data)
+        return request.seq if request else None
+
+    def _status(self):
+        return self.supervisor.status() if self.supervisor else self.arduino.status()
+
+    async def serve(self):
+        """Listen until SIGTERM or SIGINT."""
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        runner = asyncio.create_task(self._run_commands())
+
+        stop = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        print(f"📡 Device broker listening on {self.socket_path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            # Workers keep their connections open; close them so the
+            # server can finish
+            for writer in list(self._writers):
+                writer.close()
+            await server.wait_closed()
+            runner.cancel()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    async def _handle_client(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self._answer(line)
+                writer.write(json.dumps(reply, default=str).encode('utf-8') + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _answer(self, line):
+        try:
+            message = json.loads(line)
+            message_id = message.get('id')
+            priority, function = self.commands[message['cmd']]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return {'id': None, 'ok': False, 'error': f"bad request: {line[:80]!r}"}
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._order), time.perf_counter(), message['cmd'], function,
+                               message.get('args', []), message.get('kwargs', {}), future))
+        try:
+            return {'id': message_id, 'ok': True, 'result': await future}
+        except Exception as e:
+            return {'id': message_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    async def _run_commands(self):
+        # One command at a time, so the devices only ever see one caller
+        while True:
+            priority, _, queued_at, name, function, args, kwargs, future = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                # The device layer blocks (SQLite, serial locks); keep the
+                # loop free to accept and queue other commands meanwhile
+                result = await asyncio.to_thread(function, *args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            debug('broker.command', "📡 {command} waited {wait_ms:.1f} ms, ran {run_ms:.1f} ms",
+                  command=name, priority=priority, wait_ms=(started - queued_at) * 1000,
+                  run_ms=(time.perf_counter() - started) * 1000)
+
+
+def claim_socket(socket_path):
+    """
+    Remove a socket left by a broker that is no longer running.
+
+    Raises:
+        BrokerError: A broker is still answering on it
+    """
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    raise BrokerError(f"Another device broker is running on {socket_path}")
+
+
+class _ArduinoProxy:
+    """The part of ArduinoSerial the routes use, through the broker."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def is_available(self):
+        # The broker checks availability itself when a command arrives
+        return True
+
+    def send_data(self, data_string):
+        """
+        Queue a command for the Arduino. Like an offline Arduino, an
+        unreachable broker only costs a warning.
+
+        Returns:
+            int: Sequence number, or None if it was not queued
+        """
+        try:
+            return self.client.call('arduino.send', data_string)
+        except BrokerUnavailable as e:
+            warning('broker.unavailable', "⚠️  Device broker unreachable, dropping {data}: {error}",
+                    data=data_string, error=str(e))
+            return None
+
+    def status(self):
+        try:
+            return self.client.call('arduino.status')
+        except BrokerUnavailable as e:
+            return {'connected': False, 'last_error': f"device broker unreachable: {e}"}
+
+
+class _SpoolProxy:
+    """PrintSpool's interface, through the broker."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def append(self, payload, key=None):
+        """
+        Add a print job. Unlike the in-process spool, this can fail: the
+        fortune is then not printed, and the failure is logged as an error.
+
+        Returns:
+            int: Job id, or None if the broker could not be reached or
+                 could not add it
+        """
+        try:
+            return self.client.call('spool.append', payload, key)
+        except (BrokerUnavailable, BrokerError) as e:
+            error('broker.print_lost', "❌ Device broker did not take the fortune for visit {visit}, not printed: {error}",
+                  visit=key, error=str(e))
+            return None
+
+    def stage(self, payload, key):
+        # Staging is only a head start; commit() falls back to append()
+        return self._optional('spool.stage', payload, key)
+
+    def commit(self, key):
+        return self._optional('spool.commit', key)
+
+    def cancel(self, key=None):
+        # A staged fortune left behind expires after STAGE_MAX_AGE
+        return self._optional('spool.cancel', key)
+
+    def job_for_key(self, key):
+        """
+        Returns:
+            dict: The job, None if there is none, or {"state": None,
+                  "unavailable": reason} if the broker could not be asked
+        """
+        return self._optional('spool.job_for_key', key,
+                              fallback=lambda reason: {'state': None, 'unavailable': reason})
+
+    def stats(self):
+        return self._optional('spool.stats', fallback=lambda reason: {
+            'depth': None, 'states': {}, 'dispatcher_alive': False, 'unavailable': reason})
+
+    def recent(self, limit=20):
+        return self._optional('spool.recent', limit, fallback=lambda reason: [])
+
+    def _optional(self, command, *args, fallback=None):
+        """
+        Run a command the routes can do without. An unreachable broker, or
+        a command that fails in it, only costs a warning.
+
+        Args:
+            command (str): e.g. "spool.stats"
+            *args: Its arguments
+            fallback: Called with the reason to build the result instead
+                      (default: None)
+        """
+        try:
+            return self.client.call(command, *args)
+        except (BrokerUnavailable, BrokerError) as e:
+            reason = f"device broker unreachable: {e}" if isinstance(e, BrokerUnavailable) else f"device broker: {e}"
+            warning('broker.unavailable', "⚠️  {command} failed, {reason}", command=command, reason=reason)
+            return fallback(reason) if fallback else None
+
+
+class BrokerClient:
+    """Blocking client for the device broker, one connection per thread."""
+
+    def __init__(self, socket_path=BROKER_SOCKET, timeout=BROKER_TIMEOUT):
+        """
+        Args:
+            socket_path (str): Broker's Unix socket
+            timeout (float): Seconds to wait for an answer
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.arduino = _ArduinoProxy(self)
+        self.spool = _SpoolProxy(self)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def _connection(self):
+        stream = getattr(self._local, 'stream', None)
+        if stream is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            stream = sock.makefile('rwb')
+            self._local.sock = sock
+            self._local.stream = stream
+        return stream
+
+    def _disconnect(self):
+        for name in ('stream', 'sock'):
+            handle = getattr(self._local, name, None)
+            if handle is not None:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+                setattr(self._local, name, None)
+
+    def call(self, command, *args, **kwargs):
+        """
+        Run a command in the broker.
+
+        Args:
+            command (str): e.g. "spool.stage"
+            *args, **kwargs: Its arguments (JSON-serializable)
+
+        Returns:
+            The command's result
+
+        Raises:
+            BrokerUnavailable: No answer from the broker
+            BrokerError: The command failed there
+        """
+        message_id = next(self._ids)
+        request = json.dumps({'id': message_id, 'cmd': command, 'args': args, 'kwargs': kwargs}).encode('utf-8')
+        # A connection idle since a broker restart fails when the request
+        # is written, and the broker never saw it, so that is retried once
+        # on a new connection. Once the request is out, it is not: commands
+        # such as arduino.send or an append without a key would run twice
+        for attempt in (1, 2):
+            try:
+                stream = self._connection()
+                stream.write(request + b"\n")
+                stream.flush()
+                break
+            except OSError as e:
+                self._disconnect()
+                if attempt == 2:
+                    raise BrokerUnavailable(f"{self.socket_path}: {e}")
+        try:
+            line = stream.readline()
+        except OSError as e:
+            self._disconnect()
+            raise BrokerUnavailable(f"{self.socket_path}: no answer to {command}: {e}")
+        if not line:
+            self._disconnect()
+            raise BrokerUnavailable(f"{self.socket_path}: connection closed before {command} was answered")
+
+        reply = json.loads(line)
+        if reply.get('id') != message_id:
+            self._disconnect()
+            raise BrokerUnavailable(f"{self.socket_path}: answer out of order")
+        if not reply.get('ok'):
+            raise BrokerError(reply.get('error'))
+        return reply.get('result')
+
+
+# Global client instance (None when the devices are in this process)
+client = None
+
+
+def init_device_client(socket_path=BROKER_SOCKET):
+    """
+    Reach the devices through the broker instead of opening them here.
+
+    Args:
+        socket_path (str): Broker's Unix socket
+
+    Returns:
+        BrokerClient: Client instance
+    """
+    global client
+    client = BrokerClient(socket_path)
+    print(f"📡 Using the device broker on {socket_path}")
+    return client
+
+
+def get_device_client():
+    """Get the global broker client instance."""
+    global client
+    return client
+
+
+def get_arduino():
+    """The Arduino for the routes: the broker's, or this process's."""
+    return client.arduino if client else arduino_serial.get_arduino()
+
+
+def get_spool():
+    """The print spool for the routes: the broker's, or this process's."""
+    return client.spool if client else print_spool.get_spool()
+
+
+def get_supervisor():
+    """This process's supervisor; None with a broker (its status comes with get_arduino().status())."""
+    return None if client else arduino_supervisor.get_supervisor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Own the kiosk's devices and serve them on a Unix socket.")
+    parser.add_argument("--socket", default=BROKER_SOCKET or DEFAULT_SOCKET,
+                        help=f"Unix socket to listen on (default: DEVICE_BROKER_SOCKET or {DEFAULT_SOCKET})")
+    args = parser.parse_args()
+
+    # Before opening anything, so a second broker leaves the devices alone
+    try:
+        claim_socket(args.socket)
+    except BrokerError as e:
+        print(f"❌ {e}")
+        return 1
+
+    init_kiosk_log()
+    arduino, spool = init_devices()
+    broker = DeviceBroker(args.socket, arduino, spool, supervisor=arduino_supervisor.get_supervisor())
+    try:
+        asyncio.run(broker.serve())
+    finally:
+        spool.stop()
+        arduino.disconnect()
+    info('broker.stopped', "🛑 Device broker stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
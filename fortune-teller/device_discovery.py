@@ -0,0 +1,293 @@
+"""
+Role-based discovery of the kiosk's Arduino boards.
+Every USB serial port is probed in parallel with a short identity query,
+so the printer/curtain Uno and the candle Arduino are told apart by what
+they answer rather than by a port description like "CH340". The result
+is a role -> port map, found within a fixed time budget and cached by
+USB serial number (or VID:PID) for the next start. A role no port
+answered for is cached as absent too, so a kiosk without a candle board
+does not probe again on every start until its USB ports change.
+"""
+import os
+import json
+import time
+import threading
+import concurrent.futures
+import serial
+import serial.tools.list_ports
+from serial_protocol import (
+    FrameDecoder,
+    encode_frame,
+    FRAME_DONE,
+    FRAME_IDENT,
+    ROLE_QUERY,
+    BASE_BAUD,
+)
+from kiosk_log import info, warning
+
+
+ROLE_PRINTER = "printer"
+ROLE_CANDLES = "candles"
+ROLES = (ROLE_PRINTER, ROLE_CANDLES)
+
+# Boot banners, for a board that resets when its port is opened
+BANNERS = {
+    "Arduino Fortune Printer Ready": ROLE_PRINTER,
+    "System ready.": ROLE_CANDLES,
+}
+
+# Seconds discovery may take in total. Covers an auto-reset, after which
+# the printer sketch needs about 1.5 s to answer.
+DISCOVERY_BUDGET = 3.0
+
+# Seconds between identity queries on a port that has not answered
+PROBE_INTERVAL = 0.25
+
+# Where the ports of the boards are remembered between runs
+PORT_CACHE_PATH = os.getenv(
+    'ARDUINO_PORT_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'fortune-cookie', 'arduino-port.json')
+)
+
+# One discovery at a time: the printer and candle links may both look for
+# their board at startup, and a port can only be probed by one of them
+_discovery_lock = threading.Lock()
+
+
+def candidate_ports():
+    """
+    Serial ports that may be one of our boards: USB devices only, so the
+    Raspberry Pi's UART console and Bluetooth ports are never written to.
+
+    Returns:
+        list: Port paths
+    """
+    return [port.device for port in serial.tools.list_ports.comports() if port.vid is not None]
+
+
+def probe_port(device, timeout=DISCOVERY_BUDGET, stop=None):
+    """
+    Ask the board on a port what it is.
+
+    Sends the IDENT frame (answered by framed sketches such as the
+    printer) followed by the text ROLE_QUERY (answered by line-based
+    sketches such as the candles), repeating until an answer or a boot
+    banner arrives.
+
+    Args:
+        device (str): Port path
+        timeout (float): Seconds to wait for an answer
+        stop (threading.Event): Set to give up early
+
+    Returns:
+        str: Role reported by the board, or None
+    """
+    deadline = time.monotonic() + timeout
+    connection = serial.Serial()
+    connection.port = device
+    connection.baudrate = BASE_BAUD
+    connection.timeout = 0.05
+    connection.dtr = False
+    connection.exclusive = True
+    try:
+        connection.open()
+    except (serial.SerialException, OSError, ValueError):
+        return None
+
+    query = encode_frame(FRAME_IDENT, 0) + ROLE_QUERY
+    decoder = FrameDecoder()
+    next_query = 0.0
+    try:
+        while time.monotonic() < deadline and not (stop and stop.is_set()):
+            now = time.monotonic()
+            if now >= next_query:
+                connection.write(query)
+                next_query = now + PROBE_INTERVAL
+
+            data = connection.read(connection.in_waiting or 1)
+            for kind, value in decoder.feed(data):
+                if kind == "frame" and value.type == FRAME_DONE:
+                    return value.payload.decode('utf-8', errors='replace')
+                if kind == "line":
+                    if value.startswith("ROLE "):
+                        return value[5:].strip()
+                    if value in BANNERS:
+                        return BANNERS[value]
+        return None
+    except (serial.SerialException, OSError):
+        return None
+    finally:
+        connection.close()
+
+
+def discover_devices(ports=None, budget=DISCOVERY_BUDGET, use_cache=True, path=PORT_CACHE_PATH, roles=ROLES):
+    """
+    Find which port each board is on.
+
+    Args:
+        ports (list): Ports to probe (default: candidate_ports())
+        budget (float): Seconds the probing may take
+        use_cache (bool): Return the cached ports without probing when
+                          each role in `roles` is still attached, or was
+                          not found on the ports attached now; otherwise
+                          probe only the ports no cached role is on
+        path (str): Cache file
+        roles (tuple): Roles the caller needs
+
+    Returns:
+        dict: role -> port path, for the boards that were found
+    """
+    with _discovery_lock:
+        if not use_cache or ports is not None:
+            return _probe_all(candidate_ports() if ports is None else list(ports), budget, path, roles)
+
+        devices = candidate_ports()
+        cached = {role: load_cached_port(role, path) for role in ROLES}
+        known = {role: port for role, port in cached.items() if port}
+        missing = [role for role in roles if role not in known]
+        if all(_cached_absent(role, devices, path) for role in missing):
+            return known
+        # A port a cached board is on is left alone: opening it may reset it
+        found = _probe_all([device for device in devices if device not in known.values()], budget, path, missing,
+                           attached=devices)
+        return {**known, **found}
+
+
+def _probe_all(devices, budget, path, roles=ROLES, attached=None):
+    # A role not found is cached as absent for all the ports attached
+    attached = devices if attached is None else attached
+    if not devices:
+        for role in roles:
+            remember_absent(role, attached, path)
+        return {}
+
+    start = time.monotonic()
+    found = {}
+    stop = threading.Event()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="ArduinoProbe")
+    futures = {pool.submit(probe_port, device, budget, stop): device for device in devices}
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=budget + 1):
+            role = future.result()
+            if role in ROLES and role not in found:
+                found[role] = futures[future]
+                if all(role in found for role in roles):
+                    break
+    except concurrent.futures.TimeoutError:
+        pass
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+    summary = ", ".join(f"{role} on {device}" for role, device in found.items()) or "no boards"
+    info('discovery.probed', "🔍 Probed {ports} port(s) in {elapsed_s:.2f}s: {summary}",
+         ports=len(devices), elapsed_s=time.monotonic() - start, summary=summary, found=found)
+    for role, device in found.items():
+        remember_port(device, role, path)
+    for role in roles:
+        if role not in found:
+            remember_absent(role, attached, path)
+    return found
+
+
+def _read_cache(path):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if 'device' in cached:
+        # Single-board cache from before roles existed
+        return {ROLE_PRINTER: cached}
+    return cached
+
+
+def load_cached_port(role=ROLE_PRINTER, path=PORT_CACHE_PATH):
+    """
+    Find the port of the board last seen in a role.
+    The device is matched by USB serial number, or VID:PID for adapters
+    without one, because /dev/ttyUSB* numbering can change between boots.
+
+    Args:
+        role (str): ROLE_PRINTER or ROLE_CANDLES
+        path (str): Cache file written by remember_port()
+
+    Returns:
+        str: Current port path of that device, or None if it is not attached
+    """
+    cached = _read_cache(path).get(role)
+    if not cached:
+        return None
+
+    device = cached.get('device')
+    serial_number = cached.get('serial_number')
+    vid = cached.get('vid')
+    pid = cached.get('pid')
+
+    if not serial_number and vid is None:
+        # Not a USB device we can identify (e.g. a pty); trust the path
+        return device if device and os.path.exists(device) else None
+
+    ports = serial.tools.list_ports.comports()
+    if serial_number:
+        for port in ports:
+            if port.serial_number == serial_number:
+                return port.device
+        return None
+
+    matches = [port for port in ports if port.vid == vid and port.pid == pid]
+    # Several identical adapters: prefer the one on the same path as before
+    for port in matches:
+        if port.device == device:
+            return port.device
+    return matches[0].device if matches else None
+
+
+def remember_port(device, role=ROLE_PRINTER, path=PORT_CACHE_PATH):
+    """
+    Record the port of a board, so the next start can use it without
+    probing.
+
+    Args:
+        device (str): Port path
+        role (str): ROLE_PRINTER or ROLE_CANDLES
+        path (str): Cache file to write
+    """
+    port_info = next((port for port in serial.tools.list_ports.comports() if port.device == device), None)
+    _write_cache_entry(role, {
+        'device': device,
+        'serial_number': port_info.serial_number if port_info else None,
+        'vid': port_info.vid if port_info else None,
+        'pid': port_info.pid if port_info else None,
+    }, path)
+
+
+def remember_absent(role, devices, path=PORT_CACHE_PATH):
+    """
+    Record that no board answered for a role on these ports, so discovery
+    is skipped for it while the same ports are attached.
+
+    Args:
+        role (str): ROLE_PRINTER or ROLE_CANDLES
+        devices (list): Ports that were probed
+        path (str): Cache file to write
+    """
+    _write_cache_entry(role, {'absent_on': sorted(devices)}, path)
+
+
+def _cached_absent(role, devices, path):
+    entry = _read_cache(path).get(role) or {}
+    return 'absent_on' in entry and entry['absent_on'] == sorted(devices)
+
+
+def _write_cache_entry(role, entry, path):
+    cache = _read_cache(path)
+    cache[role] = entry
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        warning('discovery.cache_failed', "⚠️  Could not remember Arduino port: {error}", error=str(e), path=path)
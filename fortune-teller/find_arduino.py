@@ -1,90 +1,55 @@
 #!/usr/bin/env python3
 """
-Utility script to find and list all serial ports.
-Run this to identify which port your Arduino is on.
+Utility script to find which port each Arduino is on.
+Asks every USB serial port what board it is (see device_discovery.py),
+so the printer/curtain Uno and the candle Arduino are told apart.
 
 Usage:
     python find_arduino.py
 """
 import serial.tools.list_ports
+from device_discovery import discover_devices, ROLES
+from serial_protocol import BASE_BAUD
 
 
 def main():
-    """List all available serial ports with details."""
+    """Probe all USB serial ports and show the role of each board."""
     ports = serial.tools.list_ports.comports()
-    
+
     if not ports:
         print("❌ No serial ports found!")
         return
-    
+
     print("\n" + "="*70)
-    print("AVAILABLE SERIAL PORTS")
+    print("SERIAL PORTS")
     print("="*70)
-    
-    arduino_ports = []
-    other_ports = []
-    
     for port in ports:
-        # Categorize ports
-        is_arduino = False
-        arduino_keywords = [
-            'Arduino', 'CH340', 'CH341', 'CP2102', 'FTDI', 
-            'USB Serial', 'ttyUSB', 'ttyACM', 'cu.usb', 'FT232'
-        ]
-        
-        for keyword in arduino_keywords:
-            if keyword.lower() in port.description.lower() or \
-               keyword.lower() in port.device.lower():
-                is_arduino = True
-                break
-        
-        if is_arduino:
-            arduino_ports.append(port)
-        else:
-            other_ports.append(port)
-    
-    # Show Arduino ports first
-    if arduino_ports:
-        print("\n🎯 LIKELY ARDUINO DEVICES:")
-        print("-" * 70)
-        for port in arduino_ports:
-            print(f"\n✅ {port.device}")
-            print(f"   Description: {port.description}")
-            print(f"   Hardware ID: {port.hwid}")
-            print(f"   Manufacturer: {port.manufacturer if port.manufacturer else 'Unknown'}")
-    
-    # Show other devices
-    if other_ports:
-        print("\n\n📱 OTHER SERIAL DEVICES (keyboard, mouse, etc):")
-        print("-" * 70)
-        for port in other_ports:
-            print(f"\n   {port.device}")
-            print(f"   Description: {port.description}")
-            print(f"   Hardware ID: {port.hwid}")
-    
+        usb = "USB" if port.vid is not None else "   "
+        print(f"   {usb}  {port.device:<24} {port.description}")
+
+    print("\n🔍 Asking each USB port which board it is...")
+    devices = discover_devices(use_cache=False)
+
     print("\n" + "="*70)
-    
-    # Provide instructions
-    if arduino_ports:
-        recommended_port = arduino_ports[0].device
-        print(f"\n💡 RECOMMENDED: Use this port in app.py:")
-        print(f"   arduino_connection = init_arduino(port='{recommended_port}', baudrate=9600)")
-    else:
-        print("\n⚠️  No Arduino automatically detected.")
-        print("   If you know which port your Arduino is on, specify it manually:")
-        if other_ports:
-            print(f"   Try one of these: {', '.join([p.device for p in other_ports])}")
-    
+    for role in ROLES:
+        if role in devices:
+            print(f"✅ {role:<8} → {devices[role]}")
+        else:
+            print(f"❌ {role:<8} → not found")
+    print("="*70)
+
+    if 'printer' in devices:
+        print("\n💡 The app finds this automatically; to pin it in app.py:")
+        print(f"   arduino_connection = init_arduino(port='{devices['printer']}', baudrate={BASE_BAUD})")
+
     print("\n📝 TIPS:")
+    print("   • A board that is not found may be running an older sketch without")
+    print("     the identity reply; upload the current sketch from this repository")
     print("   • Disconnect and reconnect Arduino to see which port disappears/appears")
-    print("   • On macOS/Linux: Arduino usually shows as /dev/ttyUSB* or /dev/ttyACM*")
-    print("   •                  Or /dev/cu.usbserial* or /dev/cu.usbmodem*")
-    print("   • On Windows: Arduino shows as COM3, COM4, COM5, etc")
-    print("   • Keyboard/mouse typically DON'T show up as serial ports")
-    print("   • The baud rate (9600) MUST match your Arduino sketch's Serial.begin()")
+    print("   • The sketch's Serial.begin() must use serial_protocol.BASE_BAUD")
+    print(f"     ({BASE_BAUD}); the app negotiates a faster rate from there")
     print("="*70 + "\n")
 
 
 if __name__ == "__main__":
     main()
-
@@ -1,8 +1,35 @@
 """
 Fortune message generator for Arduino thermal printer.
-Generates personalized fortunes based on user choices.
+Generates personalized fortunes based on user choices, laid out to the
+printer's line width.
 """
+import re
 import random
+import functools
+from kiosk_log import debug, warning
+from serial_protocol import MAX_PAYLOAD
+
+
+# Characters per printed line: 384 dots at 12 dots per character
+PRINTER_COLUMNS = 32
+
+# Longest name and feature used; must match the maxlength of the text
+# inputs in templates/step1.html and templates/*Step2.html
+MAX_NAME_LENGTH = 30
+MAX_FEATURE_LENGTH = 50
+
+# Bytes a laid-out fortune may take: one frame's payload, less the
+# "<job id>\n" a staged upload puts in front of it
+STAGE_PREFIX_BYTES = 21
+MAX_FORTUNE_BYTES = MAX_PAYLOAD - STAGE_PREFIX_BYTES
+
+# Number of layouts remembered for repeated template / input-length pairs
+LAYOUT_CACHE_SIZE = 512
+
+DEFAULT_TEMPLATE = "{name}, the stars align in mysterious ways. Your path is unique."
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_SENTENCE_END = (".", "!", "?")
 
 
 # Fortune templates organized by category and choice
@@ -66,6 +93,222 @@ FORTUNE_TEMPLATES = {
 }
 
 
+class FortuneTemplate:
+    """
+    A fortune template compiled for reflowing to the printer width.
+    
+    The hand-placed line breaks in FORTUNE_TEMPLATES were tuned for one
+    name length. A break that ends a sentence is kept as a paragraph
+    break; the others are treated as spaces, so each paragraph is refilled
+    to the line width whatever the length of the name and feature.
+    
+    Attributes:
+        source (str): Template text as written in FORTUNE_TEMPLATES
+        paragraphs (tuple): Paragraphs, each a tuple of words, each word a
+                            tuple of (is_field, text) parts
+    """
+    
+    __slots__ = ("source", "paragraphs")
+    
+    def __init__(self, source):
+        self.source = source
+        paragraphs = []
+        current = []
+        for line in source.split("\n"):
+            current.extend(_compile_word(word) for word in line.split())
+            if line.rstrip().endswith(_SENTENCE_END) and current:
+                paragraphs.append(tuple(current))
+                current = []
+        if current:
+            paragraphs.append(tuple(current))
+        self.paragraphs = tuple(paragraphs)
+    
+    def render_words(self, values, width=PRINTER_COLUMNS):
+        """
+        Substitute the fields and split into words.
+        
+        Args:
+            values (dict): Field name -> tuple of words
+            width (int): Words longer than this are cut into pieces that fit
+            
+        Returns:
+            list: One list of words per paragraph
+        """
+        paragraphs = []
+        for paragraph in self.paragraphs:
+            words = []
+            for parts in paragraph:
+                current = ""
+                for is_field, text in parts:
+                    if not is_field:
+                        current += text
+                        continue
+                    field_words = values.get(text, ())
+                    if field_words:
+                        current += field_words[0]
+                        for word in field_words[1:]:
+                            words.append(current)
+                            current = word
+                if current:
+                    words.append(current)
+            
+            fitted = []
+            for word in words:
+                while len(word) > width:
+                    fitted.append(word[:width])
+                    word = word[width:]
+                fitted.append(word)
+            paragraphs.append(fitted)
+        return paragraphs
+
+
+def _compile_word(word):
+    pieces = _PLACEHOLDER.split(word)
+    # re.split alternates literal text and captured field names
+    return tuple((i % 2 == 1, piece) for i, piece in enumerate(pieces) if piece)
+
+
+def compile_templates(templates):
+    """
+    Compile a FORTUNE_TEMPLATES-shaped dict.
+    
+    Args:
+        templates (dict): category -> answer -> list of template strings
+        
+    Returns:
+        dict: category -> answer -> tuple of FortuneTemplate
+    """
+    return {
+        category: {
+            answer: tuple(FortuneTemplate(text) for text in texts)
+            for answer, texts in answers.items()
+        }
+        for category, answers in templates.items()
+    }
+
+
+def wrap_greedy(lengths, width):
+    """
+    Fill each line with as many words as fit.
+    
+    Args:
+        lengths (list): Word lengths, none longer than `width`
+        width (int): Line width in characters
+        
+    Returns:
+        tuple: Index one past the last word of each line
+    """
+    ends = []
+    line = -1
+    for i, length in enumerate(lengths):
+        if line >= 0 and line + 1 + length > width:
+            ends.append(i)
+            line = -1
+        line += 1 + length
+    if lengths:
+        ends.append(len(lengths))
+    return tuple(ends)
+
+
+def wrap_balanced(lengths, width):
+    """
+    Minimum-raggedness wrapping: the fewest lines (as greedy would use),
+    with the squared free space at the end of each line but the last as
+    small as possible.
+    
+    Args:
+        lengths (list): Word lengths, none longer than `width`
+        width (int): Line width in characters
+        
+    Returns:
+        tuple: Index one past the last word of each line
+    """
+    count = len(lengths)
+    # Outweighs any raggedness, so an extra line never pays off
+    line_penalty = (count + 1) * width * width
+    best = [0] + [None] * count
+    cut = [0] * (count + 1)
+    
+    for end in range(1, count + 1):
+        line = -1
+        for start in range(end - 1, -1, -1):
+            line += lengths[start] + 1
+            if line > width and start < end - 1:
+                break
+            slack = width - line
+            cost = best[start] + line_penalty + (0 if end == count else slack * slack)
+            if best[end] is None or cost < best[end]:
+                best[end] = cost
+                cut[end] = start
+    
+    ends = []
+    end = count
+    while end > 0:
+        ends.append(end)
+        end = cut[end]
+    return tuple(reversed(ends))
+
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _plan_layout(template, field_lengths, width, balanced):
+    """
+    Line breaks for a template, which depend only on the word lengths of
+    the substituted fields.
+    
+    Args:
+        template (FortuneTemplate): Compiled template
+        field_lengths (tuple): (field name, tuple of word lengths) pairs
+        width (int): Line width in characters
+        balanced (bool): Minimum-raggedness instead of greedy wrapping
+        
+    Returns:
+        tuple: Line ends (see wrap_greedy) for each paragraph
+    """
+    stand_ins = {field: tuple("x" * n for n in lengths) for field, lengths in field_lengths}
+    wrap = wrap_balanced if balanced else wrap_greedy
+    return tuple(
+        wrap([len(word) for word in words], width)
+        for words in template.render_words(stand_ins, width)
+    )
+
+
+def layout_fortune(template, values, width=PRINTER_COLUMNS, balanced=True):
+    """
+    Fill a compiled template and lay it out in lines for the printer.
+    
+    Args:
+        template (FortuneTemplate): Compiled template
+        values (dict): Field name -> text to substitute
+        width (int): Line width in characters
+        balanced (bool): Minimum-raggedness instead of greedy wrapping
+        
+    Returns:
+        list: Lines, none longer than `width`
+    """
+    field_words = {field: tuple(text.split()) for field, text in values.items()}
+    field_lengths = tuple(sorted(
+        (field, tuple(len(word) for word in words)) for field, words in field_words.items()
+    ))
+    plan = _plan_layout(template, field_lengths, width, balanced)
+    
+    lines = []
+    for words, ends in zip(template.render_words(field_words, width), plan):
+        start = 0
+        for end in ends:
+            lines.append(" ".join(words[start:end]))
+            start = end
+    return lines
+
+
+COMPILED_TEMPLATES = compile_templates(FORTUNE_TEMPLATES)
+COMPILED_DEFAULT = FortuneTemplate(DEFAULT_TEMPLATE)
+
+# Callable returning (compiled templates, default template) to generate
+# from instead of the ones above; content_registry.py sets it so edited
+# templates are used without a restart
+template_source = None
+
+
 def generate_fortune_message(session_data):
     """
     Generate a personalized fortune message based on user's choices.
@@ -74,7 +317,8 @@ def generate_fortune_message(session_data):
         session_data (dict): Flask session containing user inputs
         
     Returns:
-        str: Formatted fortune message ready for Arduino
+        str: Fortune laid out in lines of at most PRINTER_COLUMNS
+             characters, ready for Arduino
     """
     # Extract data from session
     name = session_data.get('name', 'Seeker')
@@ -107,22 +351,49 @@ def generate_fortune_message(session_data):
         feature = feature.capitalize() if feature else 'mystery'
     
     # Get templates for this category and answer
-    templates = FORTUNE_TEMPLATES.get(category, {}).get(answer_key, [])
+    compiled, default = template_source() if template_source else (COMPILED_TEMPLATES, COMPILED_DEFAULT)
+    templates = compiled.get(category, {}).get(answer_key, ())
     
-    # If no templates found, use a default
-    if not templates:
-        return f"{name}, the stars align in mysterious ways. Your path is unique."
+    # Randomly select a template, or use a default if none found
+    template = random.choice(templates) if templates else default
     
-    # Randomly select a template
-    template = random.choice(templates)
-    
-    # Replace placeholders - add line breaks after custom inputs to prevent word wrapping issues
-    fortune = template.format(name=name, feature=feature)
-    
-    # Clean up any double line breaks that might have been created
-    fortune = fortune.replace("\n\n\n", "\n\n")
-    
-    return fortune
+    # Reflow to the printer width, so long names and features do not
+    # spill onto ragged extra lines
+    return fit_fortune(template, name[:MAX_NAME_LENGTH], feature[:MAX_FEATURE_LENGTH])
+
+
+def fit_fortune(template, name, feature):
+    """
+    Lay a fortune out so it fits in one frame (MAX_FORTUNE_BYTES).
+
+    Within the length limits, only multi-byte characters or an oversized
+    template can make a fortune too long; the longer of name and feature
+    is then shortened until it fits.
+
+    Args:
+        template (FortuneTemplate): Compiled template
+        name (str): Visitor's name
+        feature (str): Answer from Step2
+
+    Returns:
+        str: Fortune laid out in lines, at most MAX_FORTUNE_BYTES in UTF-8
+    """
+    message = "\n".join(layout_fortune(template, {'name': name, 'feature': feature}))
+    size = len(message.encode('utf-8'))
+    if size <= MAX_FORTUNE_BYTES:
+        return message
+
+    warning('fortune.too_long', "⚠️  Fortune of {bytes} bytes is over {limit}; shortening its fields",
+            bytes=size, limit=MAX_FORTUNE_BYTES, name_chars=len(name), feature_chars=len(feature))
+    while size > MAX_FORTUNE_BYTES and (name or feature):
+        if len(feature) >= len(name):
+            feature = feature[:-4].rstrip()
+        else:
+            name = name[:-4].rstrip()
+        message = "\n".join(layout_fortune(template, {'name': name, 'feature': feature}))
+        size = len(message.encode('utf-8'))
+    # content_registry rejects templates too long to get here
+    return message.encode('utf-8')[:MAX_FORTUNE_BYTES].decode('utf-8', 'ignore')
 
 
 def get_fortune_for_arduino(session_data):
@@ -137,12 +408,9 @@ def get_fortune_for_arduino(session_data):
     """
     fortune = generate_fortune_message(session_data)
     
-    # Log for debugging
-    print("\n" + "="*70)
-    print("FORTUNE GENERATED FOR ARDUINO")
-    print("="*70)
-    print(fortune)
-    print("="*70 + "\n")
+    debug('fortune.generated', "🥠 Fortune for visit {visit}:\n{fortune}",
+          visit=session_data.get('flow_id'), category=session_data.get('category'),
+          fortune=fortune, chars=len(fortune))
     
     return fortune
 
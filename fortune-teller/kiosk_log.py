@@ -0,0 +1,301 @@
+"""
+Non-blocking kiosk log.
+Request handlers and the serial reader threads used to print() straight
+to stdout; under systemd that write goes to journald and can block the
+thread doing it. Here a log call only appends a record to a bounded
+deque (an atomic operation, no lock), and a background thread formats
+the records and writes them out. If the writer falls behind, the oldest
+records are dropped rather than blocking anyone.
+
+Records are structured: an event name (e.g. "serial.sent"), a message
+template and fields (seq, bytes, durations, visit id...). The message is
+only formatted when it is written, and a call below the log level
+returns at once, so debug tracing costs close to nothing when it is off.
+Chatty device output (RATE_LIMITED_EVENTS) is limited per event, with a
+count of what was suppressed. The most recent records are kept for the
+/api/log endpoint.
+
+Usage:
+    from kiosk_log import debug, info, warning, error
+    debug('serial.sent', "📤 Sent to Arduino #{seq}: {payload}", seq=7, payload=data)
+
+Configuration:
+    KIOSK_LOG_LEVEL   debug | info | warning | error (default info)
+    KIOSK_LOG_FORMAT  text (the message) | json (one object per line)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import collections
+from flask import g, request, session
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+KIOSK_LOG_LEVEL = os.getenv('KIOSK_LOG_LEVEL', 'info')
+KIOSK_LOG_FORMAT = os.getenv('KIOSK_LOG_FORMAT', 'text')
+
+# Records waiting to be written; beyond this the oldest are dropped
+QUEUE_SIZE = 4096
+
+# Records kept for tail()
+TAIL_SIZE = 500
+
+# Seconds the writer sleeps when there is nothing to write
+DRAIN_INTERVAL = 0.05
+
+# Device output that can arrive faster than anyone reads it: at most
+# RATE_LIMIT records per event per RATE_WINDOW seconds
+RATE_LIMITED_EVENTS = ('arduino.line', 'candles.line')
+RATE_LIMIT = 20
+RATE_WINDOW = 1.0
+
+
+class Record:
+    """One log record."""
+
+    __slots__ = ('time', 'level', 'event', 'message', 'fields')
+
+    def __init__(self, level, event, message, fields):
+        self.time = time.time()
+        self.level = level
+        self.event = event
+        self.message = message
+        self.fields = fields
+
+    def text(self):
+        """The message with its fields filled in."""
+        if not self.fields:
+            return self.message
+        try:
+            return self.message.format(**self.fields)
+        except (KeyError, IndexError, ValueError):
+            return f"{self.message} {self.fields}"
+
+    def as_dict(self):
+        return {
+            'time': round(self.time, 3),
+            'level': LEVEL_NAMES.get(self.level, str(self.level)),
+            'event': self.event,
+            'message': self.text(),
+            **{key: value for key, value in self.fields.items() if key not in ('time', 'level', 'event', 'message')},
+        }
+
+
+class KioskLog:
+    """Ring-buffered log with a background writer."""
+
+    def __init__(self, level=INFO, output_format='text', stream=None):
+        """
+        Args:
+            level (int): Records below this level are discarded at once
+            output_format (str): "text" or "json"
+            stream: Where records are written (default sys.stdout)
+        """
+        self.level = level
+        self.output_format = output_format
+        self.stream = stream
+        self.dropped = 0
+        self.suppressed = 0
+        self._queue = collections.deque(maxlen=QUEUE_SIZE)
+        self._tail = collections.deque(maxlen=TAIL_SIZE)
+        # event -> [window start, records in window, suppressed in window]
+        self._rates = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def enabled_for(self, level):
+        return level >= self.level
+
+    def emit(self, level, event, message, fields):
+        """
+        Queue a record. Never blocks.
+
+        Args:
+            level (int): DEBUG, INFO, WARNING or ERROR
+            event (str): Event name, e.g. "serial.sent"
+            message (str): Message, with {field} placeholders
+            fields (dict): Structured fields
+        """
+        if level < self.level:
+            return
+        if event in RATE_LIMITED_EVENTS and not self._allow(event):
+            return
+        record = Record(level, event, message, fields)
+        if len(self._queue) == QUEUE_SIZE:
+            self.dropped += 1
+        self._queue.append(record)
+        self._tail.append(record)
+        if self._thread is None:
+            self.start()
+
+    def _allow(self, event):
+        now = time.monotonic()
+        rate = self._rates.get(event)
+        if rate is None or now - rate[0] >= RATE_WINDOW:
+            if rate is not None and rate[2]:
+                self._report_suppressed(event, rate[2])
+            self._rates[event] = [now, 1, 0]
+            return True
+        if rate[1] < RATE_LIMIT:
+            rate[1] += 1
+            return True
+        rate[2] += 1
+        self.suppressed += 1
+        return False
+
+    def _report_suppressed(self, event, count):
+        record = Record(WARNING, 'log.suppressed', "🔇 {count} {suppressed_event} record(s) suppressed",
+                        {'count': count, 'suppressed_event': event})
+        self._queue.append(record)
+        self._tail.append(record)
+
+    def start(self):
+        """Start the writer thread (done on the first record if not before)."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="KioskLogWriter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write what is queued and stop the writer thread."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.flush():
+                self._flush_suppressed()
+                self._stop.wait(DRAIN_INTERVAL)
+
+    def _flush_suppressed(self):
+        # A quiet event still gets its count once its window has passed
+        now = time.monotonic()
+        for event, rate in list(self._rates.items()):
+            if rate[2] and now - rate[0] >= RATE_WINDOW:
+                self._report_suppressed(event, rate[2])
+                rate[2] = 0
+
+    def flush(self):
+        """
+        Write every queued record.
+
+        Returns:
+            int: Records written
+        """
+        lines = []
+        while True:
+            try:
+                record = self._queue.popleft()
+            except IndexError:
+                break
+            if self.output_format == 'json':
+                lines.append(json.dumps(record.as_dict(), ensure_ascii=False, default=str))
+            else:
+                lines.append(record.text())
+        if lines:
+            stream = self.stream or sys.stdout
+            try:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        return len(lines)
+
+    def tail(self, limit=100, level=DEBUG, event=None):
+        """
+        The most recent records, oldest first.
+
+        Args:
+            limit (int): At most this many
+            level (int): Only records at this level or above
+            event (str): Only events starting with this, e.g. "serial."
+
+        Returns:
+            list: Records as dicts
+        """
+        records = [record for record in list(self._tail)
+                   if record.level >= level and (not event or record.event.startswith(event))]
+        return [record.as_dict() for record in records[-limit:]] if limit > 0 else []
+
+    def stats(self):
+        return {
+            'level': LEVEL_NAMES.get(self.level, str(self.level)),
+            'queued': len(self._queue),
+            'dropped': self.dropped,
+            'suppressed': self.suppressed,
+        }
+
+
+# Global log instance; records are queued from import time on, so
+# modules can log before init_kiosk_log() runs
+log = KioskLog(level=LEVELS.get(KIOSK_LOG_LEVEL.lower(), INFO), output_format=KIOSK_LOG_FORMAT)
+atexit.register(log.stop)
+
+
+def debug(event, message, **fields):
+    log.emit(DEBUG, event, message, fields)
+
+
+def info(event, message, **fields):
+    log.emit(INFO, event, message, fields)
+
+
+def warning(event, message, **fields):
+    log.emit(WARNING, event, message, fields)
+
+
+def error(event, message, **fields):
+    log.emit(ERROR, event, message, fields)
+
+
+def init_kiosk_log(app=None, level=None):
+    """
+    Start the log writer and, with an app, time each request at debug
+    level (event "http.request", with the visit's flow id).
+
+    Args:
+        app (Flask): Application
+        level (str): Override KIOSK_LOG_LEVEL
+
+    Returns:
+        KioskLog: Log instance
+    """
+    if level is not None:
+        log.level = LEVELS[level.lower()]
+    log.start()
+
+    if app is not None:
+        @app.before_request
+        def start_request_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def log_request(response):
+            if log.enabled_for(DEBUG) and request.endpoint != 'static':
+                debug('http.request', "{method} {path} -> {status} in {ms:.1f} ms",
+                      method=request.method, path=request.path, status=response.status_code,
+                      ms=(time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000,
+                      bytes=response.content_length, visit=session.get('flow_id'))
+            return response
+
+    return log
+
+
+def get_kiosk_log():
+    """Get the global log instance."""
+    global log
+    return log
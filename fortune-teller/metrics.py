@@ -0,0 +1,324 @@
+"""
+Kiosk metrics.
+Counters, gauges and histograms for the routes, the serial link and the
+print spool, served at /metrics in the Prometheus text format.
+
+Recording is meant to be cheap enough to leave on on a Raspberry Pi:
+every metric and label combination is created once, histogram buckets
+are fixed when the metric is defined, and an observation is a bisect
+and two additions under a lock. Nothing is formatted until /metrics is
+scraped. Gauges such as queue depths are read at scrape time from a
+function instead of being kept up to date.
+
+Usage:
+    from metrics import SERIAL_BYTES_SENT
+    SERIAL_BYTES_SENT.inc(len(frame))
+"""
+import os
+import time
+import bisect
+import threading
+from flask import Response, g, request
+
+
+# Prefix of every metric name
+NAMESPACE = 'fortune'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Names of the per-route metrics, which each web worker keeps itself
+HTTP_METRICS = (f"{NAMESPACE}_http_",)
+
+# Bucket upper bounds, in seconds
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SERIAL_WRITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+ACK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PRINT_JOB_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Args:
+            name (str): Name without the namespace prefix
+            documentation (str): HELP text
+            labels (tuple): Label names; values are given with labels()
+        """
+        self.name = f"{NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        """The metric for one combination of label values (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """(suffix, label names, label values, value) for every sample."""
+        children = [((), self)] if not self.label_names else sorted(self._children.items())
+        for values, child in children:
+            yield from child._child_samples(self.label_names, values)
+
+    def render(self, labels=None):
+        """
+        Args:
+            labels (dict): Extra labels put on every sample, e.g. {"worker": "1234"}
+        """
+        extra_names = tuple(labels) if labels else ()
+        extra_values = tuple(labels.values()) if labels else ()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self._samples():
+            label_text = _format_labels(extra_names + names, extra_values + values)
+            lines.append(f"{self.name}{suffix}{label_text} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A count that only goes up."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._value = 0
+
+    def _new_child(self):
+        child = Counter.__new__(Counter)
+        child._value = 0
+        child._lock = threading.Lock()
+        return child
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def _child_samples(self, names, values):
+        yield '_total', names, values, self._value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or read from a function."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._value = 0
+        self._function = None
+
+    def _new_child(self):
+        child = Gauge.__new__(Gauge)
+        child._value = 0
+        child._function = None
+        return child
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """
+        Read the value from function() at scrape time instead.
+
+        Args:
+            function: Callable returning a number; if it raises, the
+                      sample is left out of the scrape
+        """
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function() if self._function is not None else self._value
+
+    def _child_samples(self, names, values):
+        try:
+            value = self.value
+        except Exception:
+            return
+        if value is not None:
+            yield '', names, values, value
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, with their sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        """
+        Args:
+            name (str): Name without the namespace prefix
+            documentation (str): HELP text
+            buckets (tuple): Ascending bucket upper bounds (+Inf is added)
+            labels (tuple): Label names
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self):
+        child = Histogram.__new__(Histogram)
+        child.buckets = self.buckets
+        child._counts = [0] * (len(self.buckets) + 1)
+        child._sum = 0.0
+        child._lock = threading.Lock()
+        return child
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def _child_samples(self, names, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        bucket_names = names + ('le',)
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', bucket_names, values + (_format_value(float(bound)),), cumulative
+        yield '_sum', names, values, total
+        yield '_count', names, values, cumulative
+
+
+class Registry:
+    """Every metric that /metrics serves."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self, include=None, exclude=(), labels=None):
+        """
+        Metrics in the Prometheus text format.
+
+        Args:
+            include (tuple): Only names starting with one of these (default: all)
+            exclude (tuple): Leave out names starting with one of these
+            labels (dict): Extra labels put on every sample
+        """
+        return "".join(metric.render(labels) + "\n" for metric in self.metrics
+                       if (include is None or metric.name.startswith(include))
+                       and not metric.name.startswith(exclude))
+
+
+registry = Registry()
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Time to handle a request, by route.",
+    REQUEST_BUCKETS, labels=('route', 'method'))
+HTTP_RESPONSES = Counter(
+    'http_responses', "Responses sent, by route and status code.", labels=('route', 'status'))
+
+SERIAL_WRITE_SECONDS = Histogram(
+    'serial_write_duration_seconds', "Time to write and flush one frame to the printer Arduino.",
+    SERIAL_WRITE_BUCKETS)
+SERIAL_BYTES_SENT = Counter('serial_sent_bytes', "Bytes written to the printer Arduino, retransmissions included.")
+SERIAL_FRAMES_SENT = Counter('serial_frames_sent', "Frames written to the printer Arduino, retransmissions included.")
+SERIAL_RETRANSMITS = Counter('serial_retransmits', "Frames sent again after a NAK or no receipt.")
+SERIAL_ACK_SECONDS = Histogram(
+    'serial_ack_round_trip_seconds', "Time from writing a command to its acknowledgement (heartbeats excluded).",
+    ACK_BUCKETS)
+SERIAL_ACK_TIMEOUTS = Counter('serial_ack_timeouts', "Commands whose acknowledgement never came.")
+SERIAL_RECONNECTS = Counter('serial_reconnects', "Times the printer Arduino link was restored after a loss.")
+SERIAL_CONNECTED = Gauge('serial_connected', "1 while the printer Arduino is connected.")
+SERIAL_QUEUE_DEPTH = Gauge('serial_queue_depth', "Commands waiting to be written to the printer Arduino.")
+
+PRINT_JOB_SECONDS = Histogram(
+    'print_job_duration_seconds', "Time from queueing a fortune to the device reporting it printed.",
+    PRINT_JOB_BUCKETS)
+PRINT_JOBS = Counter('print_jobs', "Print jobs finished, by outcome.", labels=('outcome',))
+PRINT_QUEUE_DEPTH = Gauge('print_queue_depth', "Print jobs not yet printed or failed.")
+
+
+def init_metrics(app, remote=None):
+    """
+    Time every request and serve the metrics at /metrics.
+
+    Args:
+        app (Flask): Application
+        remote: Callable returning the device metrics as text, when the
+                devices are in another process (device_broker.py); only
+                the route metrics are then served from this one
+    """
+    @app.before_request
+    def start_metrics_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def note_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    # Recorded at teardown, which also runs when a view raises and no
+    # response (or no after_request) comes; that request counts as a 500
+    @app.teardown_request
+    def record_request(exception):
+        started = g.pop('metrics_started', None)
+        status = g.pop('metrics_status', None)
+        if status is None:
+            if exception is None:
+                return
+            status = 500
+        # By rule, not path, so /animation/<category> is one route
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        if started is not None:
+            HTTP_REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - started)
+        HTTP_RESPONSES.labels(route, str(status)).inc()
+
+    @app.get("/metrics")
+    def serve_metrics():
+        """Metrics in the Prometheus text format."""
+        if remote is None:
+            return Response(registry.render(), content_type=CONTENT_TYPE)
+        # Each worker process counts its own requests, and a scrape
+        # reaches one of them; the worker label keeps every worker's
+        # series separate and monotonic (sum them by route)
+        body = registry.render(include=HTTP_METRICS, labels={'worker': str(os.getpid())})
+        try:
+            body += remote()
+        except Exception as e:
+            body += f"# device metrics unavailable: {e}\n"
+        return Response(body, content_type=CONTENT_TYPE)
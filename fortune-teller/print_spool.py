@@ -0,0 +1,617 @@
+"""
+Durable print spool for fortunes.
+Request handlers append a job to a SQLite database (WAL mode) and return
+at once; a background dispatcher sends queued jobs to the Arduino in
+order, retrying those the device never received. A fortune queued before
+a crash, restart or unplugged cable is printed once the kiosk is back.
+
+A fortune can be staged before the visitor reaches the fingerprint
+step: the dispatcher uploads it and the sketch prints the cookie graphic
+while the visitor is still answering, so committing it only sends a few
+bytes and prints the text.
+
+Job states:
+    staging    -> staged, waiting to be uploaded to the sketch
+    staged     -> held by the sketch, waiting for the commit
+    held       -> staged but not uploaded (device offline); printed in
+                  full once committed
+    queued     -> waiting for the dispatcher
+    sent       -> frame written to the serial port
+    acked      -> the sketch confirmed receipt
+    printed    -> the sketch reported "OK"
+    failed     -> gave up (see last_error)
+    cancelling -> visitor left; the sketch's copy is still to be dropped
+    cancelled  -> visitor left before the commit
+"""
+import os
+import time
+import sqlite3
+import threading
+import kiosk_log
+from metrics import PRINT_JOB_SECONDS, PRINT_JOBS, PRINT_QUEUE_DEPTH
+from arduino_serial import ACK_PRINTED, ACK_STAGED, ACK_NOSTAGE, ACK_CANCELLED, RECEIPT_GRACE
+from serial_protocol import FRAME_STAGE, FRAME_COMMIT, FRAME_CANCEL
+from show_timeline import PRINT_CUE, SHOW_MAX_DURATION
+from fortune_generator import MAX_FORTUNE_BYTES
+
+
+# Where the spool lives; outside the repository so updates keep it
+PRINT_SPOOL_PATH = os.getenv(
+    'PRINT_SPOOL_PATH',
+    os.path.join(os.path.expanduser('~'), '.local', 'share', 'fortune-cookie', 'print-spool.db')
+)
+
+# Times a job is sent before it is marked failed
+MAX_JOB_ATTEMPTS = 3
+
+# Seconds between attempts at a job the device did not receive
+RETRY_DELAY = 2.0
+
+# A queued job older than this is not printed any more; the visitor has gone
+JOB_MAX_AGE = 600
+
+# Seconds to wait for a job's frame to be written (covers a reconnect)
+SEND_TIMEOUT = 70.0
+
+# A repeat submission with the same idempotency key within this many
+# seconds returns the existing job instead of printing again
+IDEMPOTENCY_WINDOW = 15 * 60
+
+# Finished jobs are deleted after this many seconds
+JOB_RETENTION = 7 * 24 * 3600
+
+# A staged fortune not committed within this many seconds is cancelled;
+# the visitor has walked away
+STAGE_MAX_AGE = 300
+
+STATE_QUEUED = "queued"
+STATE_SENT = "sent"
+STATE_ACKED = "acked"
+STATE_PRINTED = "printed"
+STATE_FAILED = "failed"
+STATE_STAGING = "staging"
+STATE_STAGED = "staged"
+STATE_HELD = "held"
+STATE_CANCELLING = "cancelling"
+STATE_CANCELLED = "cancelled"
+
+# Staged and not yet committed
+UNCOMMITTED_STATES = (STATE_STAGING, STATE_STAGED, STATE_HELD)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    acked_at REAL,
+    printed_at REAL,
+    last_error TEXT,
+    idem_key TEXT,
+    staged_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class PrintSpool:
+    """SQLite-backed queue of print jobs with a dispatcher thread."""
+
+    def __init__(self, path=PRINT_SPOOL_PATH, max_attempts=MAX_JOB_ATTEMPTS,
+                 retry_delay=RETRY_DELAY, max_age=JOB_MAX_AGE):
+        """
+        Open (or create) the spool and recover jobs from a previous run.
+
+        Args:
+            path (str): SQLite database file
+            max_attempts (int): Sends before a job is marked failed
+            retry_delay (float): Seconds between attempts at a job
+            max_age (float): Seconds after which a queued job is dropped
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_age = max_age
+        self.arduino = None
+        self.show = None
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.executescript(_SCHEMA)
+        columns = [row['name'] for row in db.execute("PRAGMA table_info(jobs)")]
+        if 'idem_key' not in columns:
+            db.execute("ALTER TABLE jobs ADD COLUMN idem_key TEXT")
+        if 'staged_at' not in columns:
+            db.execute("ALTER TABLE jobs ADD COLUMN staged_at REAL")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_idem_key ON jobs (idem_key)")
+        self._recover()
+
+    def _db(self):
+        """Connection for the calling thread (sqlite3 objects are per thread)."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            # A committed job survives a process crash; only an OS crash or
+            # power cut can lose the last few appends
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _recover(self):
+        """Requeue jobs interrupted before the device saw them."""
+        db = self._db()
+        now = time.time()
+        requeued = db.execute(
+            "UPDATE jobs SET state = ? WHERE state = ?", (STATE_QUEUED, STATE_SENT)
+        ).rowcount
+        # The device had these and may well have printed them; sending
+        # again could print the same fortune twice
+        interrupted = db.execute(
+            "UPDATE jobs SET state = ?, last_error = ? WHERE state = ?",
+            (STATE_FAILED, "interrupted after the device received it", STATE_ACKED)
+        ).rowcount
+        db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND created_at < ?",
+            (STATE_PRINTED, STATE_FAILED, now - JOB_RETENTION)
+        )
+        queued = self.depth()
+        if requeued or interrupted or queued:
+            print(f"🗂️  Print spool: {queued} job(s) waiting, {requeued} requeued, {interrupted} interrupted")
+
+    def append(self, payload, key=None):
+        """
+        Add a print job. Only a local SQLite insert; never waits on the device.
+
+        Args:
+            payload (str): Fortune text to print
+            key (str): Idempotency key; if a job with this key was added
+                       within IDEMPOTENCY_WINDOW, no new job is created
+
+        Returns:
+            int: Id of the new job, or of the existing one for `key`
+
+        Raises:
+            ValueError: The fortune is too long to send in one frame
+        """
+        _check_payload(payload)
+        db = self._db()
+        now = time.time()
+        if key is None:
+            job_id = db.execute(
+                "INSERT INTO jobs (payload, state, created_at) VALUES (?, ?, ?)",
+                (payload, STATE_QUEUED, now)
+            ).lastrowid
+            self._wake.set()
+            return job_id
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # An old job keeps its row but gives its key up to the new one
+            db.execute(
+                "UPDATE jobs SET idem_key = NULL WHERE idem_key = ? AND created_at < ?",
+                (key, now - IDEMPOTENCY_WINDOW)
+            )
+            cursor = db.execute(
+                "INSERT INTO jobs (payload, state, created_at, idem_key) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (idem_key) DO NOTHING",
+                (payload, STATE_QUEUED, now, key)
+            )
+            created = cursor.rowcount == 1
+            job_id = db.execute("SELECT id FROM jobs WHERE idem_key = ?", (key,)).fetchone()[0]
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        if created:
+            self._wake.set()
+        return job_id
+
+    def stage(self, payload, key):
+        """
+        Stage a fortune for the current visit before it is confirmed. The
+        dispatcher uploads it so the sketch can print the cookie graphic
+        ahead of time; commit() later prints it. Any other visit's staged
+        fortune is cancelled, since the sketch holds only one.
+
+        Args:
+            payload (str): Fortune text
+            key (str): Idempotency key of the visit
+
+        Returns:
+            int: Id of the job for `key`
+
+        Raises:
+            ValueError: The fortune is too long to send in one frame
+        """
+        _check_payload(payload)
+        db = self._db()
+        now = time.time()
+        uncommitted = ", ".join("?" * len(UNCOMMITTED_STATES))
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "UPDATE jobs SET idem_key = NULL WHERE idem_key = ? AND created_at < ?",
+                (key, now - IDEMPOTENCY_WINDOW)
+            )
+            self._cancel_where(f"state IN ({uncommitted}) AND idem_key IS NOT ?", (*UNCOMMITTED_STATES, key))
+            row = db.execute("SELECT id, state, payload FROM jobs WHERE idem_key = ?", (key,)).fetchone()
+            if row is None:
+                job_id = db.execute(
+                    "INSERT INTO jobs (payload, state, created_at, idem_key) VALUES (?, ?, ?, ?)",
+                    (payload, STATE_STAGING, now, key)
+                ).lastrowid
+            else:
+                job_id = row['id']
+                if row['state'] in UNCOMMITTED_STATES and row['payload'] != payload:
+                    # Answers changed (back button); upload the new text
+                    db.execute(
+                        "UPDATE jobs SET payload = ?, state = ?, staged_at = NULL WHERE id = ?",
+                        (payload, STATE_STAGING, job_id)
+                    )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        self._wake.set()
+        return job_id
+
+    def commit(self, key):
+        """
+        Confirm the fortune staged for a visit, so it is printed.
+
+        Args:
+            key (str): Idempotency key passed to stage()
+
+        Returns:
+            int: Id of the visit's job (committed now or earlier), or None
+                 if nothing was staged or added under `key`, or the staged
+                 fortune was cancelled; append() then prints it in full
+        """
+        job = self.job_for_key(key)
+        if job is None:
+            return None
+        if job['state'] in UNCOMMITTED_STATES:
+            # created_at restarts, so max_age counts from the commit
+            committed = self._db().execute(
+                f"UPDATE jobs SET state = ?, created_at = ? WHERE id = ? AND state IN "
+                f"({', '.join('?' * len(UNCOMMITTED_STATES))})",
+                (STATE_QUEUED, time.time(), job['id'], *UNCOMMITTED_STATES)
+            ).rowcount
+            if not committed:
+                # Cancelled (or committed) since it was read; append()
+                # then queues it in full or returns the committed job
+                return None
+            self._wake.set()
+        return job['id']
+
+    def cancel(self, key=None):
+        """
+        Cancel staged fortunes whose visitor has left.
+
+        Args:
+            key (str): Visit to cancel (default: every uncommitted job)
+
+        Returns:
+            int: Number of jobs cancelled
+        """
+        uncommitted = ", ".join("?" * len(UNCOMMITTED_STATES))
+        if key is None:
+            count = self._cancel_where(f"state IN ({uncommitted})", UNCOMMITTED_STATES)
+        else:
+            count = self._cancel_where(f"state IN ({uncommitted}) AND idem_key = ?", (*UNCOMMITTED_STATES, key))
+        if count:
+            self._wake.set()
+        return count
+
+    def _cancel_where(self, condition, params):
+        # Jobs the sketch may hold go through cancelling, so the
+        # dispatcher can tell it to drop them. A cancelled job gives its
+        # key up, so a visitor who still reaches the fingerprint step
+        # gets a new job instead of the cancelled one
+        return self._db().execute(
+            f"UPDATE jobs SET state = CASE WHEN staged_at IS NULL AND state != ? THEN ? ELSE ? END, "
+            f"idem_key = NULL WHERE {condition}",
+            (STATE_STAGING, STATE_CANCELLED, STATE_CANCELLING, *params)
+        ).rowcount
+
+    def job_for_key(self, key):
+        """
+        Look up the job added under an idempotency key within the window.
+
+        Args:
+            key (str): Idempotency key passed to append()
+
+        Returns:
+            dict: Job fields and timings, or None if there is none
+        """
+        row = self._db().execute(
+            "SELECT * FROM jobs WHERE idem_key = ? AND created_at >= ?",
+            (key, time.time() - IDEMPOTENCY_WINDOW)
+        ).fetchone()
+        return _job_dict(row) if row else None
+
+    def job(self, job_id):
+        """
+        Look up a job.
+
+        Args:
+            job_id (int): Id returned by append()
+
+        Returns:
+            dict: Job fields and timings, or None if unknown
+        """
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def recent(self, limit=20):
+        """
+        Most recent jobs, newest first.
+
+        Args:
+            limit (int): Number of jobs
+
+        Returns:
+            list: Job dicts with timings
+        """
+        rows = self._db().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_job_dict(row) for row in rows]
+
+    def depth(self):
+        """Number of jobs not yet printed or failed."""
+        return self._db().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?, ?)",
+            (STATE_QUEUED, STATE_SENT, STATE_ACKED)
+        ).fetchone()[0]
+
+    def stats(self):
+        """
+        Summarize the spool for monitoring.
+
+        Returns:
+            dict: Queue depth, job counts per state and average timings of
+                  the last 100 printed jobs
+        """
+        db = self._db()
+        counts = dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        timings = db.execute(
+            "SELECT AVG(sent_at - created_at), AVG(acked_at - sent_at), "
+            "AVG(printed_at - acked_at), AVG(printed_at - created_at) "
+            "FROM (SELECT * FROM jobs WHERE state = ? ORDER BY id DESC LIMIT 100)",
+            (STATE_PRINTED,)
+        ).fetchone()
+        return {
+            'depth': self.depth(),
+            'states': counts,
+            'avg_wait_s': timings[0],
+            'avg_receipt_s': timings[1],
+            'avg_print_s': timings[2],
+            'avg_total_s': timings[3],
+            'dispatcher_alive': bool(self._thread and self._thread.is_alive()),
+        }
+
+    def start(self, arduino, show=None):
+        """
+        Start the dispatcher thread.
+
+        Args:
+            arduino (ArduinoSerial): Connection to print through
+            show (ShowTimeline): Plays each job's first attempt as a show,
+                                 whose print cue sends the fortune
+        """
+        self.arduino = arduino
+        self.show = show
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="PrintSpoolDispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the dispatcher; queued jobs stay on disk."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+    def _set(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._db().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _next_job(self):
+        return self._db().execute(
+            "SELECT * FROM jobs WHERE state IN (?, ?, ?) ORDER BY id LIMIT 1",
+            (STATE_QUEUED, STATE_STAGING, STATE_CANCELLING)
+        ).fetchone()
+
+    def _expire_staged(self):
+        uncommitted = ", ".join("?" * len(UNCOMMITTED_STATES))
+        count = self._cancel_where(
+            f"state IN ({uncommitted}) AND created_at < ?",
+            (*UNCOMMITTED_STATES, time.time() - STAGE_MAX_AGE)
+        )
+        if count:
+            kiosk_log.info('spool.stage_expired', "🗑️  Cancelled {count} staged fortune(s) never committed",
+                           count=count, max_age_s=STAGE_MAX_AGE)
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            if not self.arduino or not self.arduino.is_connected:
+                self._stop.wait(0.5)
+                continue
+
+            self._wake.clear()
+            self._expire_staged()
+            job = self._next_job()
+            if job is None:
+                self._wake.wait(1.0)
+                continue
+
+            try:
+                if job['state'] == STATE_STAGING:
+                    self._upload_staged(job)
+                    continue
+                if job['state'] == STATE_CANCELLING:
+                    self._cancel_staged(job)
+                    continue
+            except Exception as e:
+                kiosk_log.error('spool.error', "❌ Print spool error on job #{job}: {error}", job=job['id'], error=str(e))
+                self._stop.wait(self.retry_delay)
+                continue
+
+            if time.time() - job['created_at'] > self.max_age:
+                kiosk_log.warning('spool.expired', "🗑️  Print job #{job} expired before it could be printed", job=job['id'])
+                self._set(job['id'], state=STATE_FAILED, last_error="expired")
+                PRINT_JOBS.labels("expired").inc()
+                continue
+
+            try:
+                self._dispatch(job)
+            except Exception as e:
+                kiosk_log.error('spool.error', "❌ Print spool error on job #{job}: {error}", job=job['id'], error=str(e))
+                self._stop.wait(self.retry_delay)
+
+    def _dispatch(self, job):
+        """Send one job and follow it to printed, a retry, or failed."""
+        job_id = job['id']
+        attempts = job['attempts'] + 1
+        self._set(job_id, attempts=attempts)
+        kiosk_log.info('spool.dispatch', "🖨️  Print job #{job} (attempt {attempts})", job=job_id, attempts=attempts,
+                       wait_s=round(time.time() - job['created_at'], 3))
+
+        request = self._send(job, attempts)
+        if request is not None and request.wait(SEND_TIMEOUT):
+            self._set(job_id, state=STATE_SENT, sent_at=time.time())
+            if request.received.wait(RECEIPT_GRACE * 4):
+                self._set(job_id, state=STATE_ACKED, acked_at=time.time())
+
+            status = request.wait_ack(request.ack_timeout + RECEIPT_GRACE * 4)
+            if status == ACK_PRINTED:
+                self._set(job_id, state=STATE_PRINTED, printed_at=time.time(), last_error=None)
+                total = time.time() - job['created_at']
+                PRINT_JOB_SECONDS.observe(total)
+                PRINT_JOBS.labels("printed").inc()
+                kiosk_log.debug('spool.printed', "✅ Print job #{job} printed {total_s:.1f}s after it was queued",
+                                job=job_id, total_s=total)
+                return
+            if status == ACK_NOSTAGE:
+                # The sketch reset or was given a newer visit's fortune;
+                # nothing was printed, so send the whole fortune instead.
+                # The attempt still counts: the show has been played, and
+                # the resend (a retry) sends only the fortune
+                kiosk_log.info('spool.unstaged', "🔁 Print job #{job} was no longer staged, sending it in full", job=job_id)
+                self._set(job_id, state=STATE_QUEUED, staged_at=None)
+                return
+            if request.received.is_set():
+                # The device took the job and never finished it; it may
+                # have printed, so do not risk a second copy
+                self._set(job_id, state=STATE_FAILED, last_error=f"no completion (got {status!r})")
+                PRINT_JOBS.labels("failed").inc()
+                return
+            error = "device did not confirm receipt"
+        else:
+            error = "not written to the serial port"
+
+        if attempts >= self.max_attempts:
+            kiosk_log.error('spool.failed', "❌ Print job #{job} failed: {error}", job=job_id, error=error)
+            self._set(job_id, state=STATE_FAILED, last_error=error)
+            PRINT_JOBS.labels("failed").inc()
+        else:
+            self._set(job_id, state=STATE_QUEUED, last_error=error)
+            self._stop.wait(self.retry_delay)
+
+    def _send(self, job, attempts):
+        """Queue a fortune; returns its SerialRequest, or None if the show never sent it."""
+        stage_id = job['id'] if job['staged_at'] else None
+        if self.show is None or attempts > 1:
+            # A retry only needs the fortune, not the candles again
+            if stage_id is not None:
+                return self.arduino.send_data(str(stage_id), expect=ACK_PRINTED, frame_type=FRAME_COMMIT)
+            return self.arduino.send_data(job['payload'])
+        run = self.show.play(job['payload'], stage_id=stage_id)
+        return run.request(PRINT_CUE, SHOW_MAX_DURATION)
+
+    def _upload_staged(self, job):
+        """Hand a staged fortune to the sketch, which prints the graphic."""
+        job_id = job['id']
+        request = self.arduino.send_data(f"{job_id}\n{job['payload']}", expect=ACK_STAGED,
+                                         frame_type=FRAME_STAGE)
+        staged = request.wait(SEND_TIMEOUT) and request.wait_ack(request.ack_timeout + RECEIPT_GRACE * 4) == ACK_STAGED
+        if staged:
+            kiosk_log.info('spool.staged', "📌 Print job #{job} staged on the device", job=job_id)
+        # The visit may have been committed or cancelled meanwhile
+        self._db().execute(
+            "UPDATE jobs SET staged_at = ?, state = CASE state WHEN ? THEN ? ELSE state END WHERE id = ?",
+            (time.time() if staged else None, STATE_STAGING, STATE_STAGED if staged else STATE_HELD, job_id)
+        )
+
+    def _cancel_staged(self, job):
+        """Tell the sketch to drop a cancelled visit's fortune."""
+        request = self.arduino.send_data(str(job['id']), expect=ACK_CANCELLED, frame_type=FRAME_CANCEL)
+        request.wait_ack(request.ack_timeout + SEND_TIMEOUT)
+        self._set(job['id'], state=STATE_CANCELLED, staged_at=None)
+
+
+def _check_payload(payload):
+    # The dispatcher could only fail such a job after its retries, and
+    # the visitor would never know; refuse it where it is added instead
+    size = len(payload.encode('utf-8'))
+    if size > MAX_FORTUNE_BYTES:
+        kiosk_log.error('spool.too_long', "❌ Fortune of {bytes} bytes is too long to print ({limit} at most)",
+                        bytes=size, limit=MAX_FORTUNE_BYTES)
+        raise ValueError(f"Fortune of {size} bytes exceeds {MAX_FORTUNE_BYTES}")
+
+
+def _job_dict(row):
+    job = dict(row)
+
+    def span(start, end):
+        if job[start] is None or job[end] is None:
+            return None
+        return job[end] - job[start]
+
+    job['wait_s'] = span('created_at', 'sent_at')
+    job['receipt_s'] = span('sent_at', 'acked_at')
+    job['print_s'] = span('acked_at', 'printed_at')
+    job['total_s'] = span('created_at', 'printed_at')
+    return job
+
+
+# Global print spool instance
+spool = None
+
+
+def init_spool(arduino, path=PRINT_SPOOL_PATH, show=None):
+    """
+    Open the global print spool and start dispatching to the Arduino.
+
+    Args:
+        arduino (ArduinoSerial): Connection to print through
+        path (str): SQLite database file
+        show (ShowTimeline): Show to play around each print (optional)
+
+    Returns:
+        PrintSpool: Running spool
+    """
+    global spool
+    spool = PrintSpool(path=path)
+    PRINT_QUEUE_DEPTH.set_function(lambda: spool.depth())
+    spool.start(arduino, show=show)
+    return spool
+
+
+def get_spool():
+    """Get the global print spool instance."""
+    global spool
+    return spool
@@ -0,0 +1,185 @@
+"""
+Rendered page cache.
+Most pages in the flow render the same HTML for every visitor: their
+only input is get_content(...), and the *Step2 pages also depend on
+which multiple choice answer was picked. This cache keeps each rendered
+page as bytes, keyed by content version, template and variant, so the
+page is rendered by Jinja once and served from bytes after that. Each
+page gets a strong ETag. A GET that already has the page is answered
+304 Not Modified.
+
+Pages are rendered again once content_registry.py publishes a new
+content version, and the cache is cleared when a template changes on
+disk, so edits to either show up without a restart.
+
+Only pass context that is fully determined by (template, variant):
+per-visitor data must not go through the cache.
+"""
+import os
+import time
+import hashlib
+import threading
+from flask import Response, render_template, request
+from content_registry import get_content_version
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Files whose changes make cached pages stale (content edits come as
+# new content versions instead)
+WATCH_PATHS = (
+    os.path.join(BASE_DIR, 'templates'),
+)
+
+# Seconds between checks of the watched files
+CHECK_INTERVAL = 1.0
+
+# Hex digits of the page hash used as its ETag
+ETAG_LENGTH = 16
+
+
+class _Page:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+
+
+class ResponseCache:
+    """Rendered pages as bytes, keyed by template and variant."""
+
+    def __init__(self, app, watch=WATCH_PATHS, check_interval=CHECK_INTERVAL):
+        """
+        Args:
+            app (Flask): Application whose templates are cached
+            watch (tuple): Files and directories whose changes clear the cache
+            check_interval (float): Seconds between checks of the watched files
+        """
+        self.app = app
+        self.watch = watch
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._content_version = 0
+        self._fingerprint = self._scan()
+        self._checked_at = time.monotonic()
+
+    def _scan(self):
+        """Modification times and sizes of every watched file."""
+        stamps = []
+        for path in self.watch:
+            if os.path.isdir(path):
+                paths = [os.path.join(root, name) for root, _, files in os.walk(path) for name in files]
+            else:
+                paths = [path]
+            for file_path in paths:
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                stamps.append((file_path, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(stamps))
+
+    def _check(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        fingerprint = self._scan()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            # Jinja keeps compiled templates too; without this an edited
+            # template is not read again unless auto-reload is on
+            if self.app.jinja_env.cache is not None:
+                self.app.jinja_env.cache.clear()
+            self.clear()
+            print("♻️  Templates changed; rendered pages cleared")
+
+    def clear(self):
+        """Drop every rendered page."""
+        with self._lock:
+            self._pages.clear()
+
+    def render(self, template_name, variant=None, **context):
+        """
+        Respond with a page, rendering it only if it is not cached for
+        the request's content version.
+
+        Args:
+            template_name (str): Template to render
+            variant (str): What else the page depends on (e.g. the answer
+                           picked on the previous page), or None
+            **context: Template context; must depend only on
+                       template_name and variant
+
+        Returns:
+            Response: The page, or 304 Not Modified if the client has it
+        """
+        self._check()
+        version = get_content_version()
+        number = version.number if version else 0
+        if number > self._content_version:
+            # Pages of older versions are only wanted by requests that
+            # started before the new one was published
+            self._content_version = number
+            self.clear()
+        key = (number, template_name, variant)
+        page = self._pages.get(key)
+        if page is None:
+            body = render_template(template_name, **context).encode('utf-8')
+            page = _Page(body, hashlib.sha256(body).hexdigest()[:ETAG_LENGTH])
+            if number == self._content_version:
+                with self._lock:
+                    self._pages[key] = page
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        response = Response(page.body, mimetype='text/html')
+        response.set_etag(page.etag)
+        # Revalidate every time: the route may have side effects
+        # (clearing the session, opening the cabinet), and it still runs
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def __len__(self):
+        return len(self._pages)
+
+
+# Global page cache instance
+cache = None
+
+
+def init_response_cache(app, watch=WATCH_PATHS):
+    """
+    Initialize the global page cache.
+
+    Args:
+        app (Flask): Application
+        watch (tuple): Files and directories whose changes clear the cache
+
+    Returns:
+        ResponseCache: Cache instance
+    """
+    global cache
+    cache = ResponseCache(app, watch=watch)
+    return cache
+
+
+def get_response_cache():
+    """Get the global page cache instance."""
+    global cache
+    return cache
+
+
+def render_cached(template_name, variant=None, **context):
+    """
+    Render a page through the global page cache, or directly if there
+    is none. See ResponseCache.render().
+    """
+    if cache is None:
+        return render_template(template_name, **context)
+    return cache.render(template_name, variant, **context)
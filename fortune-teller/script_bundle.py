@@ -0,0 +1,221 @@
+"""
+Compiled script bundle.
+"Fortune cookie - Script.tsv" holds every line the Great Cookie can say,
+one row per string id (cook_01A, sc_07, fortune_love_A_B, ...). Prompts
+pick a random line among the ids that share a prefix. This module
+compiles the TSV once into a bundle (JSON, next to the TSV):
+
+    - the ids sorted, with their text, "\\n" escapes already decoded
+    - for every prefix of every id, the range of ids that start with it
+
+so a prompt's choice pool is one dict lookup and a slice, instead of a
+scan of every id. A prefix that no id has falls back to a bisect on the
+sorted ids. The bundle records the TSV's hash and is rebuilt when the
+script changes.
+
+Usage:
+    python script_bundle.py                  # compile the default script
+    python script_bundle.py path/to/script.tsv
+"""
+import os
+import sys
+import json
+import bisect
+import random
+import hashlib
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The script as exported from the writers' spreadsheet
+SCRIPT_PATH = os.getenv(
+    'SCRIPT_PATH',
+    os.path.join(os.path.dirname(BASE_DIR), 'resources', '01 Raxter Code', 'Fortune cookie - Script.tsv')
+)
+
+# Columns in the TSV (after the header row)
+KEY_COLUMN = 0
+TEXT_COLUMN = 2
+
+BUNDLE_VERSION = 1
+
+
+def bundle_path_for(script_path):
+    """Where the bundle for a script lives: beside it, ".bundle.json"."""
+    return os.path.splitext(script_path)[0] + '.bundle.json'
+
+
+def compile_script(script_path=SCRIPT_PATH):
+    """
+    Compile a script TSV into a bundle.
+
+    Args:
+        script_path (str): TSV with a header row, the string id in the
+                           first column and the text in the third
+
+    Returns:
+        dict: Bundle, as written by write_bundle()
+    """
+    with open(script_path, 'rb') as f:
+        raw = f.read()
+
+    texts = {}
+    for line in raw.decode('utf-8').splitlines()[1:]:
+        columns = line.strip().split('\t')
+        if not columns[KEY_COLUMN]:
+            continue
+        text = columns[TEXT_COLUMN] if len(columns) > TEXT_COLUMN else ''
+        # A repeated id keeps its last row, as the game always did
+        texts[columns[KEY_COLUMN]] = text.replace('\\n', '\n')
+
+    keys = sorted(texts)
+    pools = {}
+    for index, key in enumerate(keys):
+        for end in range(len(key) + 1):
+            prefix = key[:end]
+            if prefix in pools:
+                pools[prefix][1] = index + 1
+            else:
+                pools[prefix] = [index, index + 1]
+
+    return {
+        'version': BUNDLE_VERSION,
+        'source_hash': hashlib.sha256(raw).hexdigest(),
+        'keys': keys,
+        'texts': [texts[key] for key in keys],
+        'pools': pools,
+    }
+
+
+def write_bundle(bundle, path):
+    """Write a bundle atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(bundle, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+class ScriptBundle:
+    """Script lines by string id, with a choice pool per prefix."""
+
+    def __init__(self, bundle):
+        """
+        Args:
+            bundle (dict): As returned by compile_script()
+        """
+        self.keys = bundle['keys']
+        self._texts = tuple(bundle['texts'])
+        self._by_key = dict(zip(self.keys, self._texts))
+        self._pools = {prefix: self._texts[start:end] for prefix, (start, end) in bundle['pools'].items()}
+
+    def text(self, key):
+        """
+        Get one line by its exact id.
+
+        Raises:
+            KeyError: Unknown id
+        """
+        return self._by_key[key]
+
+    def texts(self, prefix):
+        """
+        Get every line whose id starts with prefix, in id order.
+
+        Args:
+            prefix (str): e.g. "cook_01" for cook_01A, cook_01B, ...
+
+        Returns:
+            tuple: The lines (empty if no id has this prefix)
+        """
+        pool = self._pools.get(prefix)
+        if pool is not None:
+            return pool
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self._texts[start:end]
+
+    def random_text(self, prefix, rng=random):
+        """
+        Pick a random line among the ids that start with prefix.
+
+        Raises:
+            IndexError: No id has this prefix
+        """
+        return rng.choice(self.texts(prefix))
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def load_bundle(script_path=SCRIPT_PATH):
+    """
+    Load the bundle for a script, compiling it first if it is missing or
+    was built from a different version of the script.
+
+    Args:
+        script_path (str): Script TSV
+
+    Returns:
+        ScriptBundle: The loaded bundle
+    """
+    path = bundle_path_for(script_path)
+    with open(script_path, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            bundle = json.load(f)
+        if bundle.get('version') == BUNDLE_VERSION and bundle.get('source_hash') == source_hash:
+            return ScriptBundle(bundle)
+    except (OSError, ValueError):
+        pass
+
+    bundle = compile_script(script_path)
+    try:
+        write_bundle(bundle, path)
+    except OSError as e:
+        print(f"⚠️  Could not write script bundle {path}: {e}")
+    return ScriptBundle(bundle)
+
+
+# Global script bundle instance
+script = None
+
+
+def init_script(script_path=SCRIPT_PATH):
+    """
+    Load the global script bundle.
+
+    Args:
+        script_path (str): Script TSV
+
+    Returns:
+        ScriptBundle: Bundle instance
+    """
+    global script
+    script = load_bundle(script_path)
+    return script
+
+
+def get_script():
+    """Get the global script bundle instance."""
+    global script
+    return script
+
+
+def main():
+    script_path = sys.argv[1] if len(sys.argv) > 1 else SCRIPT_PATH
+    bundle = compile_script(script_path)
+    path = bundle_path_for(script_path)
+    write_bundle(bundle, path)
+    print(f"📜 {len(bundle['keys'])} line(s), {len(bundle['pools'])} prefix pool(s) -> {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""
+Serial traffic capture and replay.
+With SERIAL_CAPTURE_DIR set, ArduinoSerial records every byte it writes
+to and reads from the printer Arduino, with monotonic timestamps, so a
+field incident ("it printed half a fortune") can be looked at and
+reproduced offline.
+
+Capture file (.fcap), little-endian:
+
+    header:  b"FCAP" | version (u8) | wall clock at start (f64, Unix time)
+    record:  kind (u8) | microseconds since the previous record (u32) |
+             length (u16) | data (length bytes)
+
+Kinds are WRITE (host -> Arduino), READ (Arduino -> host), BAUD (data is
+the new rate, u32), OPEN (data is the port) and CLOSE. Records cost 7
+bytes plus their data. A gap longer than the u32 allows (~71 minutes)
+is shortened to that. Files rotate at SERIAL_CAPTURE_MAX_BYTES and the
+newest SERIAL_CAPTURE_KEEP are kept.
+
+Usage:
+    SERIAL_CAPTURE_DIR=~/captures python app.py
+    python serial_capture.py show capture.fcap              # decoded timeline
+    python serial_capture.py replay capture.fcap            # through FrameDecoder, as fast as possible
+    python serial_capture.py replay capture.fcap --speed 1 --port /tmp/ttyFORTUNE
+                                                            # host side into a stand-in device
+"""
+import os
+import sys
+import time
+import glob
+import struct
+import argparse
+import threading
+from serial_protocol import FrameDecoder, FRAME_RETRY
+import serial_protocol
+
+
+# Directory for capture files; capture is off when empty
+SERIAL_CAPTURE_DIR = os.path.expanduser(os.getenv('SERIAL_CAPTURE_DIR', ''))
+
+# Size at which a capture file is closed and a new one started
+SERIAL_CAPTURE_MAX_BYTES = int(os.getenv('SERIAL_CAPTURE_MAX_BYTES', 16 * 1024 * 1024))
+
+# Capture files kept in the directory, newest first
+SERIAL_CAPTURE_KEEP = int(os.getenv('SERIAL_CAPTURE_KEEP', 10))
+
+# Seconds buffered records may wait before they are flushed to disk
+FLUSH_INTERVAL = 1.0
+
+MAGIC = b"FCAP"
+VERSION = 1
+HEADER = struct.Struct('<4sBd')
+RECORD = struct.Struct('<BIH')
+MAX_DELTA_US = 0xFFFFFFFF
+MAX_CHUNK = 0xFFFF
+
+KIND_WRITE = 0
+KIND_READ = 1
+KIND_BAUD = 2
+KIND_OPEN = 3
+KIND_CLOSE = 4
+
+KIND_NAMES = {KIND_WRITE: 'write', KIND_READ: 'read', KIND_BAUD: 'baud', KIND_OPEN: 'open', KIND_CLOSE: 'close'}
+
+FRAME_NAMES = {value: name[len('FRAME_'):] for name, value in vars(serial_protocol).items()
+               if name.startswith('FRAME_') and name not in ('FRAME_START', 'FRAME_RETRY')}
+
+
+class SerialCapture:
+    """Appends timestamped serial traffic to rotating capture files."""
+
+    def __init__(self, directory=SERIAL_CAPTURE_DIR, max_bytes=SERIAL_CAPTURE_MAX_BYTES,
+                 keep=SERIAL_CAPTURE_KEEP):
+        """
+        Args:
+            directory (str): Where capture files are written
+            max_bytes (int): Size at which a file is rotated
+            keep (int): Files kept, newest first
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.path = None
+        self._file = None
+        self._size = 0
+        self._start = None
+        self._last_us = 0
+        self._flushed_at = 0.0
+        # Repeated at the top of a rotated file, so it replays on its own
+        self._link = {}
+        self.enabled = True
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, now):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f"serial-{stamp}.fcap")
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.directory, f"serial-{stamp}-{suffix}.fcap")
+        self._file = open(path, 'wb', buffering=64 * 1024)
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.path = path
+        self._size = HEADER.size
+        self._start = now
+        self._last_us = 0
+        self._prune()
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.directory, 'serial-*.fcap')), key=os.path.getmtime)
+        for old in files[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def record(self, kind, data=b""):
+        """
+        Append one record, timestamped now. Data longer than a record
+        holds is split over several.
+
+        Args:
+            kind (int): KIND_WRITE, KIND_READ, KIND_BAUD, KIND_OPEN or KIND_CLOSE
+            data (bytes): Bytes on the wire, or the kind's payload
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            try:
+                if self._file is None or self._size >= self.max_bytes:
+                    self._close_file()
+                    self._open(now)
+                    if kind != KIND_OPEN:
+                        for link_kind in (KIND_OPEN, KIND_BAUD):
+                            if link_kind in self._link:
+                                self._write(link_kind, 0, self._link[link_kind])
+                if kind in (KIND_OPEN, KIND_BAUD):
+                    self._link[kind] = data
+                elif kind == KIND_CLOSE:
+                    self._link.clear()
+                elapsed_us = int((now - self._start) * 1_000_000)
+                delta = min(elapsed_us - self._last_us, MAX_DELTA_US)
+                self._last_us += delta
+                self._write(kind, delta, data)
+                if kind == KIND_CLOSE or now - self._flushed_at >= FLUSH_INTERVAL:
+                    self._file.flush()
+                    self._flushed_at = now
+            except OSError as e:
+                # Capturing must never break the link; stop instead
+                print(f"⚠️  Serial capture stopped: {e}")
+                self.enabled = False
+                self._file = None
+
+    def _write(self, kind, delta, data):
+        for offset in range(0, max(len(data), 1), MAX_CHUNK):
+            chunk = data[offset:offset + MAX_CHUNK]
+            self._file.write(RECORD.pack(kind, delta, len(chunk)))
+            self._file.write(chunk)
+            self._size += RECORD.size + len(chunk)
+            delta = 0
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Flush and close the current file."""
+        with self._lock:
+            self._close_file()
+
+
+class SerialTap:
+    """
+    Stands in for a serial.Serial, recording what is read, written and
+    every rate change into a SerialCapture. Everything else is passed
+    through to the real port.
+    """
+
+    def __init__(self, connection, capture):
+        """
+        Args:
+            connection (serial.Serial): Open port
+            capture (SerialCapture): Where traffic is recorded
+        """
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_capture', capture)
+        capture.record(KIND_OPEN, str(connection.port).encode('utf-8'))
+        capture.record(KIND_BAUD, struct.pack('<I', connection.baudrate))
+
+    def read(self, size=1):
+        data = self._connection.read(size)
+        if data:
+            self._capture.record(KIND_READ, data)
+        return data
+
+    def write(self, data):
+        # Recorded first, so a fast reply cannot appear before it
+        self._capture.record(KIND_WRITE, bytes(data))
+        return self._connection.write(data)
+
+    def close(self):
+        self._connection.close()
+        self._capture.record(KIND_CLOSE)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+        if name == 'baudrate':
+            self._capture.record(KIND_BAUD, struct.pack('<I', value))
+
+
+def read_capture(path):
+    """
+    Read a capture file.
+
+    Args:
+        path (str): .fcap file
+
+    Yields:
+        tuple: (seconds since the start of the capture, kind, data)
+
+    Raises:
+        ValueError: Not a capture file, or an unknown version
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: not a serial capture")
+        magic, version, _ = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} serial capture")
+        elapsed_us = 0
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                # A file cut short by a crash ends at its last whole record
+                return
+            kind, delta, length = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            elapsed_us += delta
+            yield elapsed_us / 1_000_000, kind, data
+
+
+def capture_started_at(path):
+    """Wall clock time (Unix) at which a capture file was started."""
+    with open(path, 'rb') as f:
+        return HEADER.unpack(f.read(HEADER.size))[2]
+
+
+class _Pacer:
+    """Sleeps so records are replayed at their captured times divided by speed."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def wait_until(self, at):
+        if self.speed > 0:
+            delay = self.start + at / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def describe(kind, value):
+    """One decoded event (from FrameDecoder.feed()) as text."""
+    if kind == "frame":
+        name = FRAME_NAMES.get(value.type & ~FRAME_RETRY, f"0x{value.type:02X}")
+        retry = " (retry)" if value.type < 0x80 and value.type & FRAME_RETRY else ""
+        return f"{name}{retry} #{value.seq} {value.payload[:60]!r}"
+    if kind == "line":
+        return f"line {value!r}"
+    return "corrupt frame dropped"
+
+
+def replay_into_decoder(path, speed=0.0, on_event=None):
+    """
+    Feed a capture through FrameDecoder, one decoder per direction,
+    with the captured arrival times, so the result does not depend on
+    the replay speed. Gaps that would expire a partial frame on the kiosk
+    do so here too.
+
+    Args:
+        path (str): .fcap file
+        speed (float): 1 for the captured pace, 10 for ten times faster,
+                       0 for as fast as possible
+        on_event: Called with (time, direction, kind, value) for every
+                  decoded event and, with direction None, for every
+                  "open", "baud" and "close" record, if given
+
+    Returns:
+        dict: Counts per direction and the time spent decoding
+    """
+    decoders = {}
+    stats = {'records': 0, 'bytes': {'write': 0, 'read': 0}, 'frames': {'write': 0, 'read': 0},
+             'lines': {'write': 0, 'read': 0}, 'corrupt': {'write': 0, 'read': 0},
+             'connections': 0, 'duration_s': 0.0, 'decode_s': 0.0}
+    pacer = _Pacer(speed)
+    for at, kind, data in read_capture(path):
+        stats['records'] += 1
+        stats['duration_s'] = at
+        if kind not in (KIND_WRITE, KIND_READ):
+            if kind == KIND_OPEN:
+                # A new connection starts both parsers afresh, as the kiosk does
+                decoders = {'write': FrameDecoder(), 'read': FrameDecoder()}
+                stats['connections'] += 1
+            if on_event is not None:
+                value = struct.unpack('<I', data)[0] if kind == KIND_BAUD else data.decode('utf-8', errors='replace')
+                on_event(at, None, KIND_NAMES.get(kind, str(kind)), value)
+            continue
+        direction = 'write' if kind == KIND_WRITE else 'read'
+        decoder = decoders.setdefault(direction, FrameDecoder())
+        pacer.wait_until(at)
+
+        started = time.perf_counter()
+        events = []
+        if decoder._buffer and at - decoder._last_byte_at > decoder.byte_timeout:
+            events.extend(decoder.feed(b"", now=at))
+        events.extend(decoder.feed(data, now=at))
+        stats['decode_s'] += time.perf_counter() - started
+
+        stats['bytes'][direction] += len(data)
+        for event_kind, value in events:
+            bucket = {'frame': 'frames', 'line': 'lines', 'corrupt': 'corrupt'}[event_kind]
+            stats[bucket][direction] += 1
+            if on_event is not None:
+                on_event(at, direction, event_kind, value)
+    return stats
+
+
+def replay_into_device(path, port, speed=1.0, baudrate=None):
+    """
+    Write the host side of a capture to a stand-in device (e.g. the pty
+    of virtual_arduino.py) at the captured pace, following the captured
+    rate changes, and decode what the device sends back.
+
+    Args:
+        path (str): .fcap file
+        port (str): Serial port of the stand-in device
+        speed (float): 1 for the captured pace, 0 for as fast as possible
+        baudrate (int): Starting rate (default: the capture's)
+
+    Returns:
+        dict: Bytes written, and frames and lines received
+    """
+    import serial
+
+    connection = serial.Serial(port, baudrate or serial_protocol.BASE_BAUD, timeout=0)
+    decoder = FrameDecoder()
+    stats = {'written': 0, 'frames': 0, 'lines': 0, 'corrupt': 0}
+
+    def drain():
+        data = connection.read(connection.in_waiting or 1)
+        for kind, _ in decoder.feed(data):
+            stats[{'frame': 'frames', 'line': 'lines', 'corrupt': 'corrupt'}[kind]] += 1
+
+    pacer = _Pacer(speed)
+    last = 0.0
+    try:
+        for at, kind, data in read_capture(path):
+            pacer.wait_until(at)
+            drain()
+            last = at
+            if kind == KIND_WRITE:
+                connection.write(data)
+                connection.flush()
+                stats['written'] += len(data)
+            elif kind == KIND_BAUD and baudrate is None:
+                connection.baudrate = struct.unpack('<I', data)[0]
+        # Give the device time to answer the last command
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline:
+            drain()
+            time.sleep(0.01)
+    finally:
+        connection.close()
+    stats['duration_s'] = last
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a serial capture.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print the decoded timeline")
+    show.add_argument("path", help="capture file (.fcap)")
+    replay = commands.add_parser("replay", help="replay through the frame parser or into a device")
+    replay.add_argument("path", help="capture file (.fcap)")
+    replay.add_argument("--speed", type=float, default=0.0,
+                        help="1 = captured pace, 10 = ten times faster, 0 = as fast as possible (default)")
+    replay.add_argument("--port", help="write the host side to this stand-in device instead")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(capture_started_at(args.path)))
+        print(f"📼 {args.path}, started {started}")
+
+        def show_event(at, direction, kind, value):
+            if direction is None:
+                print(f"{at:10.4f}  == {kind} {value}".rstrip())
+            else:
+                print(f"{at:10.4f}  {'->' if direction == 'write' else '<-'} {describe(kind, value)}")
+
+        replay_into_decoder(args.path, on_event=show_event)
+        return 0
+
+    if args.port:
+        stats = replay_into_device(args.path, args.port, speed=args.speed)
+        print(f"📤 Replayed {stats['written']} byte(s) over {stats['duration_s']:.1f}s of capture: "
+              f"{stats['frames']} frame(s), {stats['lines']} line(s), {stats['corrupt']} corrupt back")
+        return 0
+
+    stats = replay_into_decoder(args.path, speed=args.speed)
+    print(f"📼 {stats['records']} record(s), {stats['connections']} connection(s), "
+          f"{stats['duration_s']:.1f}s of capture")
+    for direction, arrow in (('write', 'host -> Arduino'), ('read', 'Arduino -> host')):
+        print(f"   {arrow}: {stats['bytes'][direction]} byte(s), {stats['frames'][direction]} frame(s), "
+              f"{stats['lines'][direction]} line(s), {stats['corrupt'][direction]} corrupt")
+    print(f"   Decoding took {stats['decode_s'] * 1000:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Framing for the host <-> Arduino serial link.
+
+Every message is sent as a length-prefixed, CRC-checked frame so the
+receiver knows exactly when a frame is complete and can reject (and ask
+for a retransmission of) garbled data instead of printing it:
+
+    0xAA | type | seq | len lo | len hi | payload (len bytes) | crc lo | crc hi
+
+The CRC is CRC16-CCITT (poly 0x1021, init 0xFFFF) over type..payload.
+The printer sketch (cookie_thermal_printer.ino) implements the same
+format. Anything the sketch prints outside a frame with Serial.println()
+is still delivered to the host as plain text lines.
+"""
+import time
+import collections
+
+
+FRAME_START = 0xAA
+HEADER_SIZE = 5             # start, type, seq, len lo, len hi
+CRC_SIZE = 2
+MAX_PAYLOAD = 400           # must match MAX_PAYLOAD in the printer sketch
+
+# Host -> Arduino
+FRAME_OPEN = 0x01
+FRAME_CLOSE = 0x02
+FRAME_PRINT = 0x03
+FRAME_PING = 0x04           # payload is echoed back in the DONE frame
+FRAME_BAUD = 0x05           # payload is the new link rate, uint32 little-endian
+FRAME_IDENT = 0x06          # DONE payload is the sketch's role, e.g. "printer"
+FRAME_PRINT_NOW = 0x07      # print without the sketch's candle ritual
+FRAME_CANDLES = 0x08        # pulse the candle trigger line, DONE "Candles"
+FRAME_STAGE = 0x09          # "<token>\n<fortune>": hold the fortune, print the graphic
+FRAME_COMMIT = 0x0A         # "<token>": print the held fortune
+FRAME_CANCEL = 0x0B         # "<token>": drop the held fortune
+
+# Set on a retransmitted frame so the sketch can ignore a duplicate whose
+# receipt was lost, without ever dropping a fresh command
+FRAME_RETRY = 0x40
+
+# Arduino -> Host
+FRAME_ACK = 0x80            # frame received intact
+FRAME_NAK = 0x81            # frame failed its CRC, please retransmit
+FRAME_DONE = 0x82           # command finished, payload is the status text
+
+# Rate the sketch boots at and falls back to; must match BASE_BAUD in the sketch
+BASE_BAUD = 9600
+
+# Echoed by the sketch after a rate change. The run of 'U' (0x55) gives
+# alternating bits, which is what breaks first on a marginal rate.
+LINK_TEST_PATTERN = b"U" * 8 + bytes(range(0x21, 0x7F))
+
+# Seconds the sketch waits for a valid frame at a new rate before it
+# reverts to BASE_BAUD; must match BAUD_CONFIRM_TIMEOUT in the sketch
+BAUD_CONFIRM_TIMEOUT = 1.0
+
+
+# Identity query for sketches that do not speak the framed protocol
+# (the candle controller); they answer with a "ROLE <name>" line
+ROLE_QUERY = b"?ROLE\n"
+
+
+Frame = collections.namedtuple("Frame", ["type", "seq", "payload"])
+
+
+def _make_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """
+    Compute CRC16-CCITT (poly 0x1021).
+
+    Args:
+        data (bytes): Data to checksum
+        crc (int): Initial value (0xFFFF, or a previous result to continue)
+
+    Returns:
+        int: 16-bit CRC
+    """
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def encode_frame(frame_type, seq, payload=b""):
+    """
+    Build a frame ready to write to the serial port.
+
+    Args:
+        frame_type (int): One of the FRAME_* constants
+        seq (int): Sequence id (only the low 8 bits are sent)
+        payload (bytes): Frame payload, at most MAX_PAYLOAD bytes
+
+    Returns:
+        bytes: Encoded frame
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD}")
+
+    length = len(payload)
+    body = bytes((frame_type, seq & 0xFF, length & 0xFF, length >> 8)) + payload
+    crc = crc16(body)
+    return bytes((FRAME_START,)) + body + bytes((crc & 0xFF, crc >> 8))
+
+
+def frame_type_for(data_string):
+    """
+    Pick the frame type for a message passed to ArduinoSerial.send_data().
+
+    Args:
+        data_string (str): Message text
+
+    Returns:
+        int: FRAME_OPEN, FRAME_CLOSE or FRAME_PRINT
+    """
+    if data_string == "open":
+        return FRAME_OPEN
+    if data_string == "close":
+        return FRAME_CLOSE
+    return FRAME_PRINT
+
+
+class FrameDecoder:
+    """
+    Incremental parser for bytes read from the Arduino.
+
+    Separates complete frames from the plain-text lines the sketch prints
+    for debugging. A frame that fails its length or CRC check is dropped
+    and parsing resumes from the byte after its start marker, so the
+    decoder resynchronises on the next good frame.
+    """
+
+    def __init__(self, max_payload=MAX_PAYLOAD, byte_timeout=0.2):
+        """
+        Args:
+            max_payload (int): Largest payload accepted before a frame is
+                               treated as corrupt
+            byte_timeout (float): Seconds a partial frame may wait for its
+                                  remaining bytes before it is dropped
+        """
+        self.max_payload = max_payload
+        self.byte_timeout = byte_timeout
+        self.corrupt_frames = 0
+        self._buffer = bytearray()
+        self._line = bytearray()
+        self._last_byte_at = time.monotonic()
+
+    def feed(self, data, now=None):
+        """
+        Add received bytes and return everything that is now complete.
+        Call with b"" on read timeouts so stalled partial frames expire.
+
+        Args:
+            data (bytes): Bytes read from the serial port
+            now (float): Arrival time on the monotonic clock (default:
+                         time.monotonic(); a replay passes capture times)
+
+        Returns:
+            list: (kind, value) tuples in arrival order, where kind is
+                  "frame" (value is a Frame), "line" (value is a str) or
+                  "corrupt" (value is None)
+        """
+        if now is None:
+            now = time.monotonic()
+        events = []
+        buf = self._buffer
+
+        if buf and not data and now - self._last_byte_at > self.byte_timeout:
+            # The rest of this frame is never coming; resync past its start
+            self._drop_start(events)
+
+        if data:
+            buf.extend(data)
+            self._last_byte_at = now
+
+        while buf:
+            if buf[0] != FRAME_START:
+                end = buf.find(FRAME_START)
+                if end < 0:
+                    end = len(buf)
+                self._add_text(buf[:end], events)
+                del buf[:end]
+                continue
+
+            if len(buf) < HEADER_SIZE:
+                break
+
+            length = buf[3] | (buf[4] << 8)
+            if length > self.max_payload:
+                self._drop_start(events)
+                continue
+
+            total = HEADER_SIZE + length + CRC_SIZE
+            if len(buf) < total:
+                break
+
+            received_crc = buf[total - 2] | (buf[total - 1] << 8)
+            if crc16(buf[1:total - CRC_SIZE]) != received_crc:
+                self._drop_start(events)
+                continue
+
+            events.append(("frame", Frame(buf[1], buf[2], bytes(buf[HEADER_SIZE:total - CRC_SIZE]))))
+            del buf[:total]
+
+        return events
+
+    def _drop_start(self, events):
+        self.corrupt_frames += 1
+        events.append(("corrupt", None))
+        del self._buffer[0]
+
+    def _add_text(self, chunk, events):
+        for byte in chunk:
+            if byte == 0x0A:  # \n
+                text = self._line.decode("utf-8", errors="replace").strip()
+                self._line.clear()
+                if text:
+                    events.append(("line", text))
+            else:
+                self._line.append(byte)
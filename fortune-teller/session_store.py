@@ -0,0 +1,274 @@
+"""
+Server-side sessions for the Flask app.
+Flask's default session signs and serializes every answer into the
+cookie on each response. Here the visit's data stays on the server and
+the cookie carries only a random, opaque session id, so requests do no
+signing or verification and the cookie does not grow as the flow goes
+on. Background threads (e.g. the print dispatcher) can read a visit's
+data from the store by its id.
+
+Backends:
+    memory -> MemorySessionStore: a fixed number of slots in this
+              process, least recently used evicted first, expired by TTL
+    sqlite -> SQLiteSessionStore: shared by every worker process on the
+              machine (SESSION_DB_PATH)
+"""
+import os
+import json
+import time
+import sqlite3
+import secrets
+import threading
+import collections
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+# Which store to use: "memory" or "sqlite"
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+
+# Where the SQLite store lives
+SESSION_DB_PATH = os.getenv(
+    'SESSION_DB_PATH',
+    os.path.join(os.path.expanduser('~'), '.local', 'share', 'fortune-cookie', 'sessions.db')
+)
+
+# Seconds a session lives after its last change; a visit takes minutes
+SESSION_TTL = 3600
+
+# Sessions the memory store holds; a kiosk has one visitor at a time, so
+# this only bounds what stray clients (e.g. a status page) can use
+SESSION_SLOTS = 256
+
+# Bytes of randomness in a session id
+SESSION_ID_BYTES = 32
+
+
+class _Slot:
+    __slots__ = ('data', 'expires')
+
+    def __init__(self, data, expires):
+        self.data = data
+        self.expires = expires
+
+
+class MemorySessionStore:
+    """In-process session store with a fixed number of slots."""
+
+    def __init__(self, slots=SESSION_SLOTS):
+        """
+        Args:
+            slots (int): Sessions kept before the least recently used is evicted
+        """
+        self.slots = slots
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        """
+        Look up a session.
+
+        Args:
+            sid (str): Session id
+
+        Returns:
+            dict: Copy of the session data, or None if unknown or expired
+        """
+        with self._lock:
+            slot = self._sessions.get(sid)
+            if slot is None:
+                return None
+            if slot.expires < time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return dict(slot.data)
+
+    def save(self, sid, data, ttl=SESSION_TTL):
+        """
+        Store a session.
+
+        Args:
+            sid (str): Session id
+            data (dict): Session data
+            ttl (float): Seconds until it expires
+        """
+        now = time.time()
+        with self._lock:
+            self._sessions[sid] = _Slot(dict(data), now + ttl)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.slots:
+                self._sessions.popitem(last=False)
+            # Oldest first, so expired sessions are dropped from the front
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if oldest.expires >= now:
+                    break
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        """Forget a session."""
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Session store in SQLite, shared across worker processes."""
+
+    def __init__(self, path=SESSION_DB_PATH):
+        """
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db().execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+    def _db(self):
+        """Connection for the calling thread (sqlite3 objects are per thread)."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Losing the last answers to a power cut only restarts a visit
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def load(self, sid):
+        row = self._db().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires >= ?", (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, ttl=SESSION_TTL):
+        now = time.time()
+        db = self._db()
+        db.execute(
+            "INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+            (sid, json.dumps(data, separators=(',', ':')), now + ttl)
+        )
+        db.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def delete(self, sid):
+        self._db().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data for one request, saved to the store if it changed."""
+
+    def __init__(self, sid, initial=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface that keeps the data in a session store."""
+
+    def __init__(self, store, ttl=SESSION_TTL):
+        """
+        Args:
+            store: MemorySessionStore or SQLiteSessionStore
+            ttl (float): Seconds a session lives after its last change
+        """
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(sid, data)
+        # The id is random and never reused, so a guessed or stale cookie
+        # only ever gets a fresh, empty session
+        return ServerSession(secrets.token_urlsafe(SESSION_ID_BYTES), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.save(session.sid, dict(session), self.ttl)
+        if session.new and session.modified:
+            response.set_cookie(
+                name,
+                session.sid,
+                max_age=int(self.ttl),
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain,
+                path=path,
+            )
+        if session.accessed:
+            response.vary.add("Cookie")
+
+
+# Global session store instance
+store = None
+
+
+def init_session_store(app, backend=SESSION_BACKEND, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+    """
+    Make a Flask app keep its sessions server-side.
+
+    Args:
+        app (Flask): Application
+        backend (str): "memory" or "sqlite"
+        path (str): SQLite database file (sqlite backend)
+        ttl (float): Seconds a session lives after its last change
+
+    Returns:
+        MemorySessionStore or SQLiteSessionStore: The store
+    """
+    global store
+    if backend == 'sqlite':
+        store = SQLiteSessionStore(path)
+    elif backend == 'memory':
+        store = MemorySessionStore()
+    else:
+        raise ValueError(f"Unknown session backend: {backend!r}")
+    app.session_interface = ServerSessionInterface(store, ttl)
+    return store
+
+
+def get_session_store():
+    """Get the global session store instance."""
+    global store
+    return store
@@ -30,6 +30,7 @@ sudo apt-get install -y \
     x11-xserver-utils \
     chromium-browser \
     netcat-openbsd \
+    ffmpeg \
     xbindkeys
 
 echo ""
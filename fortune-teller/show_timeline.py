@@ -0,0 +1,609 @@
+"""
+Show timeline for the fortune ritual.
+The candles, curtains and printing used to be timed by delay() calls in
+the two sketches. A show is now a declarative list of cues, each sent to
+its device by the host at its time, so the ritual can be reordered,
+overlapped or tightened without reflashing:
+
+    Cue(0.0, "candles", "candle1 on")
+    Cue(2.0, "printer", "print", name="print")
+    Cue(3.0, "candles", "all off", after="print")   # 3 s after the print's ack
+
+Cue times are measured on a monotonic clock from the start of the show
+(or from the acknowledgement of the `after` cue) and each cue is fired
+against that absolute time, so a late wake-up never delays the cues that
+follow it. Cues to the candle board are sent early by its measured link
+latency. With SimulatedClock and SimulatedDevice the same engine runs
+without hardware in virtual time.
+
+Usage:
+    python show_timeline.py                     # simulate the default show
+    python show_timeline.py --show my-show.json
+"""
+import os
+import sys
+import json
+import heapq
+import time
+import argparse
+import itertools
+import threading
+import concurrent.futures
+from candle_serial import cue_line
+from kiosk_log import info, warning, error
+from arduino_serial import ACK_CANDLES, ACK_PRINTED
+from serial_protocol import FRAME_PRINT_NOW, FRAME_CANDLES, FRAME_COMMIT
+
+
+# Optional JSON cue list replacing DEFAULT_SHOW (see load_show())
+SHOW_TIMELINE_PATH = os.getenv('SHOW_TIMELINE_PATH')
+
+# Name of the cue that prints the fortune; every show needs one
+PRINT_CUE = "print"
+
+# Commands the printer sketch takes as cues
+PRINTER_COMMANDS = ("open", "close", "print", "candles")
+
+# A cue is fired once it is due within this many seconds
+FIRE_TOLERANCE = 0.001
+
+# A show still waiting after this many seconds skips its remaining cues
+SHOW_MAX_DURATION = 120.0
+
+# Weight of the newest sample in a device's latency estimate
+LATENCY_SMOOTHING = 0.3
+
+
+class Cue:
+    """One step of a show."""
+
+    def __init__(self, at, device, command, name=None, after=None):
+        """
+        Args:
+            at (float): Seconds after the show starts, or after the `after`
+                        cue was acknowledged
+            device (str): "printer" or "candles"
+            command (str): Printer: open, close, print or candles (pulse the
+                           trigger line). Candles: "<output> on|off"
+            name (str): Lets later cues refer to this one in `after`
+            after (str): Name of an earlier cue to time this one from
+        """
+        self.at = at
+        self.device = device
+        self.command = command
+        self.name = name
+        self.after = after
+
+    def __repr__(self):
+        anchor = f" after {self.after}" if self.after else ""
+        return f"Cue({self.at:g}s{anchor}, {self.device}: {self.command})"
+
+
+def flicker(output, start, count, period):
+    """
+    Cues that switch an output on and off `count` times, ending on.
+
+    Args:
+        output (str): Candle board output, e.g. "fairy"
+        start (float): Seconds into the show of the first cue
+        count (int): Number of on/off cycles
+        period (float): Seconds per cycle
+
+    Returns:
+        list: Cues
+    """
+    cues = []
+    for i in range(count):
+        cues.append(Cue(start + i * period, "candles", f"{output} on"))
+        cues.append(Cue(start + (i + 0.5) * period, "candles", f"{output} off"))
+    cues.append(Cue(start + count * period, "candles", f"{output} on"))
+    return cues
+
+
+# The candle sequence from arduino-candles.ino, overlapped with printing
+# instead of finishing before it starts
+DEFAULT_SHOW = [
+    Cue(0.0, "candles", "candle1 on"),
+    Cue(0.5, "candles", "candle2 on"),
+    Cue(1.0, "candles", "candle3 on"),
+    Cue(1.5, "candles", "fairy on"),
+    Cue(1.5, "candles", "crystal on"),
+    Cue(2.0, "candles", "diffusers on"),
+    Cue(2.0, "printer", "print", name=PRINT_CUE),
+    Cue(5.0, "candles", "diffusers off"),
+    *flicker("fairy", 5.0, 12, 0.2),
+    Cue(3.0, "candles", "all off", after=PRINT_CUE),
+]
+
+# Without a USB link to the candle board: start its built-in sequence
+# through the trigger line and print 5 s later, as the sketch used to
+TRIGGER_SHOW = [
+    Cue(0.0, "printer", "candles"),
+    Cue(5.0, "printer", "print", name=PRINT_CUE),
+]
+
+
+def load_show(path):
+    """
+    Read a show from a JSON list of cues, e.g.
+    [{"at": 0, "device": "candles", "command": "candle1 on"}, ...]
+
+    Args:
+        path (str): JSON file
+
+    Returns:
+        list: Cues
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    return [Cue(float(entry['at']), entry['device'], entry['command'],
+                name=entry.get('name'), after=entry.get('after')) for entry in entries]
+
+
+def validate_show(cues):
+    """
+    Check a cue list before it is played.
+
+    Args:
+        cues (list): Cues
+
+    Raises:
+        ValueError: Unknown device or command, an `after` that does not
+                    name an earlier cue, or no print cue
+    """
+    names = set()
+    for cue in cues:
+        if cue.device == "printer":
+            if cue.command not in PRINTER_COMMANDS:
+                raise ValueError(f"Unknown printer command in {cue!r}")
+        elif cue.device == "candles":
+            cue_line(cue.command)
+        else:
+            raise ValueError(f"Unknown device in {cue!r}")
+        if cue.at < 0:
+            raise ValueError(f"Negative time in {cue!r}")
+        if cue.after and cue.after not in names:
+            raise ValueError(f"{cue!r} is timed after a cue not defined before it")
+        if cue.name:
+            names.add(cue.name)
+    if PRINT_CUE not in names:
+        raise ValueError(f"Show has no cue named {PRINT_CUE!r}")
+
+
+class PrinterCues:
+    """Cue adapter for the printer/curtain Uno (ArduinoSerial)."""
+
+    def __init__(self, arduino):
+        self.arduino = arduino
+
+    @property
+    def available(self):
+        return self.arduino.is_available
+
+    def send(self, command, run):
+        """Send a printer cue; returns the SerialRequest."""
+        if command == "print" and run.stage_id is not None:
+            # The sketch already holds the fortune; only the commit goes out
+            return self.arduino.send_data(str(run.stage_id), expect=ACK_PRINTED, frame_type=FRAME_COMMIT)
+        if command == "print":
+            return self.arduino.send_data(run.fortune, frame_type=FRAME_PRINT_NOW)
+        if command == "candles":
+            return self.arduino.send_data(command, expect=ACK_CANDLES, frame_type=FRAME_CANDLES)
+        return self.arduino.send_data(command)
+
+
+class CandleCues:
+    """Cue adapter for the candle controller (CandleSerial)."""
+
+    # Relays switch as soon as the line is read, so half the round trip
+    # is how long a cue takes to show
+    instant = True
+
+    def __init__(self, candles):
+        self.candles = candles
+
+    @property
+    def available(self):
+        return self.candles.is_connected
+
+    def send(self, command, run):
+        """Send a candle cue; returns the CandleCue."""
+        return self.candles.send(command)
+
+
+class MonotonicClock:
+    """Real time, for shows played on hardware."""
+
+    def now(self):
+        return time.monotonic()
+
+    def wait(self, event, timeout):
+        return event.wait(timeout)
+
+
+class SimulatedClock:
+    """
+    Virtual time for playing shows without hardware. Waiting advances the
+    clock straight to the next scheduled callback (or the timeout), so a
+    two-minute show is simulated in milliseconds.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        self._queue = []
+        self._order = itertools.count()
+
+    def now(self):
+        return self._now
+
+    def call_at(self, when, callback):
+        """Run callback() once virtual time reaches `when`."""
+        heapq.heappush(self._queue, (when, next(self._order), callback))
+
+    def wait(self, event, timeout):
+        target = self._now + (timeout if timeout is not None else 1.0)
+        if self._queue and self._queue[0][0] <= target:
+            when, _, callback = heapq.heappop(self._queue)
+            self._now = max(self._now, when)
+            callback()
+        else:
+            self._now = target
+        return event.is_set()
+
+
+class SimulatedDevice:
+    """
+    Stand-in for a board on a SimulatedClock. Commands run one at a time
+    (like the printer sketch) or complete immediately (like a relay).
+    """
+
+    def __init__(self, clock, durations=None, latency=0.01, serial=True, instant=False):
+        """
+        Args:
+            clock (SimulatedClock): Clock the device runs on
+            durations (dict): Seconds each command takes, by command (or by
+                              its first word); unlisted commands take 0
+            latency (float): One-way link latency in seconds
+            serial (bool): Queue commands behind the one running
+            instant (bool): Mark the device's acks as effect times, so the
+                            timeline compensates for its latency
+        """
+        self.clock = clock
+        self.durations = durations or {}
+        self.latency = latency
+        self.serial = serial
+        self.instant = instant
+        self.available = True
+        self._busy_until = 0.0
+
+    def send(self, command, run):
+        now = self.clock.now()
+        duration = self.durations.get(command, self.durations.get(command.split()[0], 0.0))
+        if callable(duration):
+            duration = duration(run.fortune)
+        start = now + self.latency
+        if self.serial:
+            start = max(start, self._busy_until)
+        finish = start + duration
+        self._busy_until = finish
+
+        handle = _SimulatedRequest(command, now)
+
+        def _done():
+            handle.acked_at = self.clock.now()
+            handle.ack.set_result("OK")
+
+        self.clock.call_at(finish + self.latency, _done)
+        return handle
+
+
+class _SimulatedRequest:
+    def __init__(self, command, sent_at):
+        self.command = command
+        self.sent_at = sent_at
+        self.acked_at = None
+        self.ack = concurrent.futures.Future()
+
+
+class ShowRun:
+    """
+    One performance of a show: what was fired when, and what the devices
+    answered.
+    """
+
+    def __init__(self, cues, fortune, stage_id=None):
+        self.fortune = fortune
+        self.stage_id = stage_id
+        self.records = [{
+            'cue': cue,
+            'target': None,
+            'fired': None,
+            'acked': None,
+            'status': None,
+            'handle': None,
+            'dispatched': threading.Event(),
+        } for cue in cues]
+        self.started_at = None
+        self.finished = threading.Event()
+
+    def _named(self, name):
+        for record in self.records:
+            if record['cue'].name == name:
+                return record
+        return None
+
+    def request(self, name, timeout=None):
+        """
+        Wait until a named cue has been sent.
+
+        Args:
+            name (str): Cue name, e.g. PRINT_CUE
+            timeout (float): Seconds to wait
+
+        Returns:
+            The device's handle for the cue (a SerialRequest for the
+            printer), or None if it was skipped or not sent in time
+        """
+        record = self._named(name)
+        if record is None or not record['dispatched'].wait(timeout):
+            return None
+        return record['handle']
+
+    def wait(self, timeout=None):
+        """Wait for every cue to be answered; True if the show finished."""
+        return self.finished.wait(timeout)
+
+    def report(self):
+        """
+        Returns:
+            list: One dict per cue with its times in seconds from the start
+                  of the show and `late` (fired minus target)
+        """
+        rows = []
+        for record in self.records:
+            cue = record['cue']
+
+            def offset(value):
+                return None if value is None else value - self.started_at
+
+            rows.append({
+                'device': cue.device,
+                'command': cue.command,
+                'target': offset(record['target']),
+                'fired': offset(record['fired']),
+                'acked': offset(record['acked']),
+                'late': (None if record['fired'] is None or record['target'] is None
+                         else record['fired'] - record['target']),
+                'status': record['status'],
+            })
+        return rows
+
+
+class ShowTimeline:
+    """Plays cue lists against the kiosk's devices."""
+
+    def __init__(self, cues, devices, fallback=None, clock=None, time_scale=1.0):
+        """
+        Args:
+            cues (list): Cues of the show
+            devices (dict): Device name -> adapter with `available` and
+                            send(command, run) returning a handle
+                            whose `ack` future resolves when it finishes
+            fallback (list): Cues to play instead while a device used by
+                             `cues` is unavailable
+            clock: MonotonicClock (default) or SimulatedClock
+            time_scale (float): Multiplier for every cue time (the
+                                benchmark matches the virtual Arduino's)
+        """
+        validate_show(cues)
+        if fallback:
+            validate_show(fallback)
+        self.cues = list(cues)
+        self.fallback = list(fallback) if fallback else None
+        self.devices = devices
+        self.clock = clock or MonotonicClock()
+        self.time_scale = time_scale
+        self.latency = {}
+        self._wake = threading.Event()
+
+    def cues_for_now(self):
+        """The cue list to play with the devices available right now."""
+        def playable(cues):
+            return all(cue.device in self.devices and self.devices[cue.device].available for cue in cues)
+
+        if self.fallback and not playable(self.cues) and playable(self.fallback):
+            return self.fallback
+        return self.cues
+
+    def play(self, fortune, background=True, stage_id=None):
+        """
+        Start the show.
+
+        Args:
+            fortune (str): Text for the print cue
+            background (bool): Play on a ShowTimeline thread and return at
+                               once (False plays it before returning, as
+                               a simulation does)
+            stage_id (int): Token of the fortune staged on the printer;
+                            the print cue then only commits it
+
+        Returns:
+            ShowRun: Progress of this performance
+        """
+        run = ShowRun(self.cues_for_now(), fortune, stage_id)
+        if background:
+            threading.Thread(target=self._play, args=(run,), name="ShowTimeline", daemon=True).start()
+        else:
+            self._play(run)
+        return run
+
+    def _play(self, run):
+        clock = self.clock
+        run.started_at = start = clock.now()
+        waiting = list(run.records)
+        outstanding = []
+
+        while waiting or outstanding:
+            self._wake.clear()
+            now = clock.now()
+            if now - start > SHOW_MAX_DURATION:
+                for record in waiting:
+                    record['status'] = "skipped"
+                    record['dispatched'].set()
+                warning('show.overrun', "⚠️  Show ran past {limit:.0f}s, skipped {skipped} cue(s)",
+                        limit=SHOW_MAX_DURATION, skipped=len(waiting))
+                break
+
+            next_fire = None
+            for record in list(waiting):
+                cue = record['cue']
+                anchor = start
+                if cue.after:
+                    previous = run._named(cue.after)
+                    if previous['status'] in ("failed", "skipped"):
+                        # What this cue follows never finished
+                        record['status'] = "skipped"
+                        record['dispatched'].set()
+                        waiting.remove(record)
+                        continue
+                    anchor = previous['acked']
+                    if anchor is None:
+                        continue
+
+                record['target'] = anchor + cue.at * self.time_scale
+                fire_at = record['target'] - self.latency.get(cue.device, 0.0)
+                if fire_at - now <= FIRE_TOLERANCE:
+                    waiting.remove(record)
+                    self._fire(run, record)
+                    if record['handle'] is not None:
+                        outstanding.append(record)
+                elif next_fire is None or fire_at < next_fire:
+                    next_fire = fire_at
+
+            outstanding = [record for record in outstanding if record['acked'] is None]
+            if not waiting and not outstanding:
+                break
+            timeout = None if next_fire is None else max(0.0, next_fire - clock.now())
+            clock.wait(self._wake, timeout)
+
+        late = [record['fired'] - record['target'] for record in run.records if record['fired'] is not None]
+        if late:
+            info('show.finished', "🎭 Show finished in {duration:.1f}s, {cues} cue(s), latest {late_ms:.1f} ms behind schedule",
+                 duration=clock.now() - start, cues=len(late), late_ms=max(late) * 1000)
+        run.finished.set()
+
+    def _fire(self, run, record):
+        cue = record['cue']
+        device = self.devices.get(cue.device)
+        record['fired'] = self.clock.now()
+        try:
+            handle = device.send(cue.command, run)
+        except Exception as e:
+            error('show.cue_failed', "❌ Cue {cue} failed: {error}", cue=repr(cue), error=str(e))
+            handle = None
+
+        record['handle'] = handle
+        record['dispatched'].set()
+        if handle is None:
+            record['status'] = "failed"
+            return
+
+        def _answered(future):
+            record['acked'] = self.clock.now()
+            record['status'] = "OK" if future.result() else "failed"
+            if getattr(device, 'instant', False) and future.result():
+                self._note_latency(cue.device, (record['acked'] - record['fired']) / 2)
+            self._wake.set()
+
+        handle.ack.add_done_callback(_answered)
+
+    def _note_latency(self, device, sample):
+        previous = self.latency.get(device)
+        if previous is None:
+            self.latency[device] = sample
+        else:
+            self.latency[device] = previous + LATENCY_SMOOTHING * (sample - previous)
+
+
+# Global show timeline instance
+show = None
+
+
+def init_show(arduino, candles, path=SHOW_TIMELINE_PATH):
+    """
+    Set up the global show timeline for the kiosk's boards.
+
+    Args:
+        arduino (ArduinoSerial): Printer/curtain connection
+        candles (CandleSerial): Candle controller link
+        path (str): Optional JSON cue list replacing DEFAULT_SHOW
+
+    Returns:
+        ShowTimeline: The timeline
+    """
+    global show
+    cues = load_show(path) if path else DEFAULT_SHOW
+    show = ShowTimeline(
+        cues,
+        {"printer": PrinterCues(arduino), "candles": CandleCues(candles)},
+        fallback=TRIGGER_SHOW,
+    )
+    return show
+
+
+def get_show():
+    """Get the global show timeline instance."""
+    global show
+    return show
+
+
+def simulate(cues, fortune, link_latency=0.01):
+    """
+    Play a show in virtual time against devices timed like the sketches.
+
+    Args:
+        cues (list): Cues to play
+        fortune (str): Fortune text, which sets the print time
+        link_latency (float): One-way serial latency in seconds
+
+    Returns:
+        ShowRun: The finished performance
+    """
+    from virtual_arduino import print_duration, SERVO_STEP_DELAY, OPEN_POS, CLOSE_POS, CANDLE_PULSE
+
+    clock = SimulatedClock()
+    sweep = abs(OPEN_POS - CLOSE_POS) * SERVO_STEP_DELAY
+    printer = SimulatedDevice(clock, {
+        "open": sweep,
+        "close": sweep,
+        "print": print_duration,
+        "candles": CANDLE_PULSE,
+    }, latency=link_latency)
+    candles = SimulatedDevice(clock, latency=link_latency, serial=False, instant=True)
+    timeline = ShowTimeline(cues, {"printer": printer, "candles": candles}, clock=clock)
+    return timeline.play(fortune, background=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a show timeline without hardware.")
+    parser.add_argument("--show", default=SHOW_TIMELINE_PATH,
+                        help="JSON cue list (default: the built-in show)")
+    parser.add_argument("--trigger", action="store_true",
+                        help="simulate the show used without a candle board link")
+    parser.add_argument("--fortune", default="Your journey through this life will be truly charmed!",
+                        help="fortune text, which sets the print time")
+    args = parser.parse_args()
+
+    cues = TRIGGER_SHOW if args.trigger else (load_show(args.show) if args.show else DEFAULT_SHOW)
+    run = simulate(cues, args.fortune)
+
+    print(f"\n{'target':>8} {'fired':>8} {'acked':>8}  device   command")
+    for row in run.report():
+        def fmt(value):
+            return f"{value:8.2f}" if value is not None else "       -"
+        print(f"{fmt(row['target'])} {fmt(row['fired'])} {fmt(row['acked'])}  {row['device']:<8} {row['command']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
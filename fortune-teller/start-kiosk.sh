@@ -79,6 +79,13 @@ if ! command -v python &> /dev/null; then
     exit 1
 fi
 
+echo "Building audio cues, animation sprites and the precache manifest..."
+# Incremental: only what changed is rebuilt
+python build_audio.py || echo "WARNING: audio build failed, serving the original WAV files"
+python build_sprites.py || echo "WARNING: sprite build failed, animating the individual frames"
+# Last: lists what the two builds above produced
+python build_precache.py || echo "WARNING: precache build failed, assets load from the server"
+
 echo "Starting Flask app..."
 # Set FLASK_DEBUG=false for production kiosk mode
 FLASK_DEBUG=false python app.py &
@@ -0,0 +1,57 @@
+// Service worker for the kiosk, rendered from build_precache.py's manifest.
+// Every asset in the manifest is cached at install; after that anything
+// under /static/ is served cache-first. Pages and API calls always go to
+// the server. A new manifest version means new worker bytes, so the
+// browser installs it and the old version's cache is deleted.
+const VERSION = {{ version | tojson }};
+const CACHE_PREFIX = 'fortune-teller-';
+const CACHE_NAME = CACHE_PREFIX + VERSION;
+const PRECACHE = {{ assets | tojson }};
+const STATIC_PREFIX = {{ url_for('static', filename='') | tojson }};
+
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHE_NAME)
+      .then(cache => cache.addAll(PRECACHE))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(
+        names
+          .filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+          .map(name => caches.delete(name))
+      ))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  // Without a build there is nothing versioned to cache against
+  if (PRECACHE.length === 0 || request.method !== 'GET' ||
+      url.origin !== self.location.origin || !url.pathname.startsWith(STATIC_PREFIX)) {
+    return;
+  }
+
+  event.respondWith(
+    caches.open(CACHE_NAME).then(cache =>
+      cache.match(request, { ignoreSearch: true }).then(cached => {
+        if (cached) {
+          return cached;
+        }
+        return fetch(request).then(response => {
+          // Only whole files; audio range requests can come back as 206
+          if (response.status === 200) {
+            cache.put(request, response.clone());
+          }
+          return response;
+        });
+      })
+    )
+  );
+});
@@ -0,0 +1,69 @@
+"""
+Tests for hot reload of content and fortune templates.
+
+Usage:
+    python -m pytest test_content_registry.py
+"""
+import time
+import shutil
+import pytest
+from content_registry import ContentRegistry, ContentError, CONTENT_PATH, TEMPLATES_PATH, validate, read_literals
+
+
+def make_registry(tmp_path):
+    content_path = tmp_path / "content.py"
+    templates_path = tmp_path / "fortune_generator.py"
+    shutil.copy(CONTENT_PATH, content_path)
+    shutil.copy(TEMPLATES_PATH, templates_path)
+    return ContentRegistry(str(content_path), str(templates_path)), templates_path
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def first_template(registry):
+    return registry.current.templates['guidance']['sage'][0].source
+
+
+def test_bad_shape_keeps_serving_and_later_edit_is_picked_up(tmp_path):
+    registry, templates_path = make_registry(tmp_path)
+    original = templates_path.read_text(encoding='utf-8')
+    registry.start()
+    try:
+        # A list where a category's dict of answers belongs
+        templates_path.write_text(original + "\nFORTUNE_TEMPLATES = {'love': ['{name}']}\n", encoding='utf-8')
+        registry._changed.set()
+        assert not wait_for(lambda: registry.current.number != 1, timeout=1.0)
+        assert first_template(registry).startswith("Oh wise {name}!")
+
+        templates_path.write_text(original.replace("Oh wise {name}!", "Oh very wise {name}!"), encoding='utf-8')
+        registry._changed.set()
+        assert wait_for(lambda: registry.current.number == 2)
+        assert first_template(registry).startswith("Oh very wise {name}!")
+        assert registry._thread.is_alive()
+    finally:
+        registry.stop()
+
+
+@pytest.mark.parametrize("templates", [
+    ['{name}'],
+    {'love': ['{name}']},
+    {'love': {'searching': '{name}'}},
+])
+def test_validate_names_the_wrong_shape(templates):
+    content = read_literals(CONTENT_PATH, ('CONTENT',))['CONTENT']
+    with pytest.raises(ContentError, match="FORTUNE_TEMPLATES"):
+        validate(content, templates, "{name}")
+
+
+def test_unhashable_key_is_a_content_error(tmp_path):
+    path = tmp_path / "content.py"
+    path.write_text("CONTENT = {{'start'}: {}}\n", encoding='utf-8')
+    with pytest.raises(ContentError, match="not a plain literal"):
+        read_literals(str(path), ('CONTENT',))
@@ -0,0 +1,46 @@
+"""
+Tests for the web app's routes through a device broker that is not running.
+
+Usage:
+    python -m pytest test_device_broker.py
+"""
+import os
+import tempfile
+import pytest
+
+# Read when device_broker is imported: the app then only talks to the
+# broker, and this socket does not exist
+os.environ['DEVICE_BROKER_SOCKET'] = os.path.join(tempfile.mkdtemp(), 'no-broker.sock')
+
+import app as kiosk_app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    assert kiosk_app.get_device_client() is not None
+    assert not os.path.exists(kiosk_app.BROKER_SOCKET)
+    return kiosk_app.app.test_client()
+
+
+def test_print_spool_reports_unavailable(client):
+    response = client.get("/api/print-spool")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert "unreachable" in body['unavailable']
+    assert body['recent'] == []
+
+
+def test_print_status_reports_unavailable(client):
+    with client.session_transaction() as session:
+        session['flow_id'] = "visit"
+    response = client.get("/api/print-status")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['state'] is None
+    assert "unreachable" in body['unavailable']
+
+
+def test_visit_goes_on_without_the_broker(client):
+    assert client.get("/").status_code == 200
+    assert client.get("/step1").status_code == 200
+    assert client.post("/fingerprint-animation").status_code == 200
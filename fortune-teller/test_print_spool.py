@@ -0,0 +1,115 @@
+"""
+Tests for the print spool's staging, commit and resend paths.
+
+Usage:
+    python -m pytest test_print_spool.py
+"""
+import time
+from print_spool import PrintSpool, STAGE_MAX_AGE, STATE_QUEUED, STATE_PRINTED, STATE_CANCELLING, STATE_CANCELLED
+from arduino_serial import ACK_PRINTED, ACK_NOSTAGE
+
+
+def make_spool(tmp_path):
+    # No dispatcher: the tests drive the job states directly
+    return PrintSpool(path=str(tmp_path / "spool.db"))
+
+
+def test_commit_after_expiry_prints_in_full(tmp_path):
+    spool = make_spool(tmp_path)
+    staged_id = spool.stage("staged fortune", key="visit")
+    spool._set(staged_id, created_at=time.time() - STAGE_MAX_AGE - 1)
+    spool._expire_staged()
+
+    assert spool.commit("visit") is None
+    job_id = spool.append("fortune", key="visit")
+
+    assert job_id != staged_id
+    assert spool.job(job_id)['state'] == STATE_QUEUED
+    assert spool.job(staged_id)['state'] in (STATE_CANCELLING, STATE_CANCELLED)
+    # A resubmitted form still gets the same job
+    assert spool.append("fortune", key="visit") == job_id
+
+
+def test_commit_after_another_visit_staged(tmp_path):
+    spool = make_spool(tmp_path)
+    staged_id = spool.stage("first visit", key="first")
+    spool._set(staged_id, staged_at=time.time())
+    spool.stage("second visit", key="second")
+
+    assert spool.commit("first") is None
+    job_id = spool.append("first visit", key="first")
+
+    assert job_id != staged_id
+    assert spool.job(job_id)['state'] == STATE_QUEUED
+    assert spool.commit("second") is not None
+
+
+def test_commit_staged(tmp_path):
+    spool = make_spool(tmp_path)
+    job_id = spool.stage("fortune", key="visit")
+
+    assert spool.commit("visit") == job_id
+    assert spool.job(job_id)['state'] == STATE_QUEUED
+    # Committing again is a no-op
+    assert spool.commit("visit") == job_id
+
+
+class FakeRequest:
+    def __init__(self, status):
+        self.status = status
+        self.ack_timeout = 0
+        self.received = FakeEvent()
+
+    def wait(self, timeout=None):
+        return True
+
+    def wait_ack(self, timeout=None):
+        return self.status
+
+
+class FakeEvent:
+    def is_set(self):
+        return True
+
+    def wait(self, timeout=None):
+        return True
+
+
+class FakeShow:
+    """Plays the show; its commit finds the sketch no longer holds the fortune."""
+
+    def __init__(self):
+        self.plays = 0
+
+    def play(self, payload, stage_id=None):
+        self.plays += 1
+        return self
+
+    def request(self, cue, timeout):
+        return FakeRequest(ACK_NOSTAGE)
+
+
+class FakeArduino:
+    def __init__(self):
+        self.sent = []
+
+    def send_data(self, data, **kwargs):
+        self.sent.append(data)
+        return FakeRequest(ACK_PRINTED)
+
+
+def test_lost_stage_is_resent_without_the_show(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.arduino = FakeArduino()
+    spool.show = FakeShow()
+    job_id = spool.stage("fortune", key="visit")
+    spool._set(job_id, staged_at=time.time())
+    spool.commit("visit")
+
+    spool._dispatch(spool._next_job())
+    assert spool.job(job_id)['state'] == STATE_QUEUED
+    spool._dispatch(spool._next_job())
+
+    assert spool.show.plays == 1
+    assert spool.arduino.sent == ["fortune"]
+    assert spool.job(job_id)['state'] == STATE_PRINTED
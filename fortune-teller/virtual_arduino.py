@@ -0,0 +1,614 @@
+"""
+Virtual Arduino for testing without hardware.
+Emulates the printer sketch (cookie_thermal_printer.ino) behind a
+pseudo-terminal, so ArduinoSerial(port=...) and the Flask app can be run
+and timed with no Uno attached.
+
+The timing model follows the sketch: the boot delays and banner, servo
+sweeps at 20 ms per degree, the 2 s + 3 s candle ritual before a print,
+and print time proportional to the bytes sent to the thermal printer at
+9600 baud. Faults can be injected: dropped bytes, stalls and USB
+disconnects.
+
+Usage:
+    python virtual_arduino.py --link /tmp/ttyFORTUNE
+    ARDUINO_PORT=/tmp/ttyFORTUNE python app.py
+"""
+import os
+import sys
+import tty
+import time
+import random
+import select
+import struct
+import argparse
+import threading
+from serial_protocol import (
+    crc16,
+    encode_frame,
+    FRAME_START,
+    FRAME_OPEN,
+    FRAME_CLOSE,
+    FRAME_PRINT,
+    FRAME_PING,
+    FRAME_BAUD,
+    FRAME_IDENT,
+    FRAME_PRINT_NOW,
+    FRAME_CANDLES,
+    FRAME_STAGE,
+    FRAME_COMMIT,
+    FRAME_CANCEL,
+    FRAME_RETRY,
+    FRAME_ACK,
+    FRAME_NAK,
+    FRAME_DONE,
+    MAX_PAYLOAD,
+    BASE_BAUD,
+    BAUD_CONFIRM_TIMEOUT,
+)
+
+
+# Sketch constants (cookie_thermal_printer.ino)
+OPEN_POS = 180
+CLOSE_POS = 0
+SERVO_STEP_DELAY = 0.020        # moveServoSmooth(): 20 ms per degree
+RITUAL_CANDLE_DELAY = 2.0       # CANDLE_COMMS held LOW
+RITUAL_SETTLE_DELAY = 3.0       # after CANDLE_COMMS goes HIGH again
+CANDLE_PULSE = 0.3              # FRAME_CANDLES: CANDLE_COMMS held LOW
+PRINTER_BOOT_DELAY = 0.5
+SERVO_ATTACH_DELAY = 0.2
+FRAME_BYTE_TIMEOUT = 0.2
+MAX_LINK_ERRORS = 8
+SUPPORTED_RATES = (9600, 19200, 38400, 57600, 115200)
+RX_BUFFER_SIZE = 64             # Arduino core serial receive buffer
+
+# Bytes printFortune() sends to the printer around the fortune text:
+# printFortuneHead() sends initializePrinter() (24) and the cookie bitmap
+# header (8) and data (384/8 * 258); printFortuneBody() adds the
+# trailing feeds (4)
+PRINTER_BAUD = 9600
+PRINTER_HEAD_BYTES = 24 + 8 + (384 // 8) * 258
+PRINTER_OVERHEAD_BYTES = PRINTER_HEAD_BYTES + 4
+STAGE_TOKEN_MAX = 12
+
+
+def print_duration(text):
+    """
+    Seconds printFortune() spends writing to the printer for a fortune.
+
+    Args:
+        text (str): Fortune text
+
+    Returns:
+        float: Bytes sent at 10 bits per byte over PRINTER_BAUD
+    """
+    return (PRINTER_OVERHEAD_BYTES + len(text.encode('utf-8'))) * 10 / PRINTER_BAUD
+
+
+def head_duration():
+    """Seconds printFortuneHead() spends writing the graphic to the printer."""
+    return PRINTER_HEAD_BYTES * 10 / PRINTER_BAUD
+
+
+class VirtualArduino:
+    """Printer sketch emulated behind a pseudo-terminal."""
+
+    def __init__(self, link=None, time_scale=1.0, wire_time=True, drop_rate=0.0,
+                 stall_rate=0.0, stall_duration=2.0, disconnect_every=0,
+                 replug_delay=1.0, seed=None):
+        """
+        Initialize the virtual Arduino.
+
+        Args:
+            link (str): Optional stable path symlinked to the current pty,
+                        kept pointing at the new pty after a replug
+            time_scale (float): Multiplier for every sketch delay (0.01
+                                runs a 5 s ritual in 50 ms)
+            wire_time (bool): Delay bytes by their transfer time at the
+                              current link rate, as a real UART would
+            drop_rate (float): Probability of losing each received byte
+            stall_rate (float): Probability of the sketch hanging before
+                                it handles a frame
+            stall_duration (float): Seconds a stall lasts
+            disconnect_every (int): Unplug after this many commands (0: never)
+            replug_delay (float): Seconds before an automatic unplug is
+                                  plugged back in
+            seed (int): Random seed for reproducible fault injection
+        """
+        self.link = link
+        self.time_scale = time_scale
+        self.wire_time = wire_time
+        self.drop_rate = drop_rate
+        self.stall_rate = stall_rate
+        self.stall_duration = stall_duration
+        self.disconnect_every = disconnect_every
+        self.replug_delay = replug_delay
+        self.random = random.Random(seed)
+
+        self.port = None
+        self.plugged_in = False
+        self.link_rate = BASE_BAUD
+        self.current_pos = 0
+
+        # Observations for tests and benchmarks
+        self.events = []
+        self.printed = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.frames_received = 0
+        self.naks_sent = 0
+        self.commands = 0
+        self.boots = 0
+
+        self._master = None
+        self._slave = None
+        self._rx = bytearray()
+        self._rx_ready = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._busy = False
+        self._stop = threading.Event()
+        self._unplugged = threading.Event()
+        self._threads = []
+        self._reset_sketch_state()
+
+    def _reset_sketch_state(self):
+        self._last_seq = -1
+        self._last_type = 0
+        self._last_status = ""
+        self._baud_pending = False
+        self._baud_deadline = 0.0
+        self._link_errors = 0
+        self._rx_state = 0
+        self._rx_last_byte = 0.0
+        self._staged_token = ""
+        self._staged_text = ""
+        self._head_printed = False
+
+    def start(self):
+        """
+        Plug the virtual Arduino in and boot the sketch.
+
+        Returns:
+            str: Port to open (the link path if one was given)
+        """
+        self._stop.clear()
+        self.plug_in()
+        return self.link or self.port
+
+    def stop(self):
+        """Unplug and remove the link path."""
+        self._stop.set()
+        self.unplug()
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def plug_in(self):
+        """Create a fresh pty (as a new USB enumeration would) and boot."""
+        if self.plugged_in:
+            return
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        self.port = os.ttyname(self._slave)
+        if self.link:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.port, self.link)
+
+        self._rx.clear()
+        self._reset_sketch_state()
+        self.link_rate = BASE_BAUD
+        self._unplugged.clear()
+        self.plugged_in = True
+        self._record("plug_in", self.port)
+
+        self._threads = [
+            threading.Thread(target=self._receive, name="VirtualArduinoRx", daemon=True),
+            threading.Thread(target=self._run, name="VirtualArduino", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def unplug(self):
+        """Pull the USB cable: the host's next read or write fails."""
+        if not self.plugged_in:
+            return
+
+        self.plugged_in = False
+        self._unplugged.set()
+        self._record("unplug", self.port)
+        with self._rx_ready:
+            self._rx_ready.notify_all()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+
+    def _record(self, event, detail=None):
+        self.events.append((time.monotonic(), event, detail))
+
+    def _delay(self, seconds):
+        """Sketch delay(); returns False if the board was unplugged meanwhile."""
+        return not self._unplugged.wait(seconds * self.time_scale)
+
+    def _wire_delay(self, byte_count):
+        if self.wire_time:
+            time.sleep(byte_count * 10 / self.link_rate * self.time_scale)
+
+    # --- Host -> sketch ---------------------------------------------------
+
+    def _receive(self):
+        """Move bytes from the pty into the sketch's receive buffer."""
+        while not self._unplugged.is_set():
+            try:
+                # Poll so unplug() is noticed even while the host is silent
+                if not select.select([self._master], [], [], 0.1)[0]:
+                    continue
+                data = os.read(self._master, 4096)
+            except (OSError, ValueError):
+                return
+            if not data:
+                return
+
+            self._wire_delay(len(data))
+            with self._rx_ready:
+                for byte in data:
+                    self.bytes_received += 1
+                    if self.drop_rate and self.random.random() < self.drop_rate:
+                        self.bytes_dropped += 1
+                        continue
+                    # While a command runs the sketch is not reading, so
+                    # anything past the core's receive buffer is lost
+                    if self._busy and len(self._rx) >= RX_BUFFER_SIZE:
+                        self.bytes_dropped += 1
+                        continue
+                    self._rx.append(byte)
+                self._rx_ready.notify_all()
+
+    def _read_byte(self, timeout):
+        with self._rx_ready:
+            if not self._rx:
+                self._rx_ready.wait(timeout)
+            if not self._rx:
+                return None
+            byte = self._rx[0]
+            del self._rx[0]
+            return byte
+
+    # --- Sketch -> host ---------------------------------------------------
+
+    def _write(self, data):
+        self._wire_delay(len(data))
+        with self._write_lock:
+            if not self.plugged_in:
+                return
+            try:
+                os.write(self._master, data)
+                self.bytes_sent += len(data)
+            except OSError:
+                pass
+
+    def _print(self, text):
+        self._write(text.encode('utf-8'))
+
+    def _println(self, text=""):
+        self._write(text.encode('utf-8') + b"\r\n")
+
+    def _send_frame(self, frame_type, seq, payload=b""):
+        self._write(encode_frame(frame_type, seq, payload))
+
+    # --- Sketch -----------------------------------------------------------
+
+    def _run(self):
+        """setup() then loop(), until unplugged."""
+        self.boots += 1
+        self._record("boot")
+        if not self._delay(PRINTER_BOOT_DELAY):
+            return
+        self._println("Arduino Fortune Printer Ready")
+        self._println("Waiting for fortune data from Raspberry Pi...")
+        if not self._delay(SERVO_ATTACH_DELAY):
+            return
+        self._println("Closing curtains...")
+        if not self._move_servo(CLOSE_POS):
+            return
+        self._println("Closed")
+
+        while not self._unplugged.is_set():
+            if self._baud_pending and time.monotonic() > self._baud_deadline:
+                self._switch_link_rate(BASE_BAUD)
+                self._baud_pending = False
+                self._println("Rate change not confirmed, back to 9600 baud")
+
+            frame = self._read_frame()
+            if frame:
+                self._baud_pending = False
+                self._link_errors = 0
+                self._handle_frame(*frame)
+
+    def _read_frame(self):
+        """
+        The sketch's readFrame() state machine, one byte at a time.
+
+        Returns:
+            tuple: (type, seq, payload) for a frame with a valid CRC, or None
+        """
+        while True:
+            byte = self._read_byte(0.05)
+            now = time.monotonic()
+            if self._rx_state and now - self._rx_last_byte > FRAME_BYTE_TIMEOUT * self.time_scale:
+                self._rx_state = 0  # rest of the frame never arrived
+            if byte is None:
+                return None
+            self._rx_last_byte = now
+
+            if self._rx_state == 0:
+                if byte == FRAME_START:
+                    self._rx_header = bytearray()
+                    self._rx_state = 1
+                else:
+                    self._note_link_error()
+            elif self._rx_state == 1:
+                self._rx_header.append(byte)
+                if len(self._rx_header) < 4:
+                    continue
+                length = self._rx_header[2] | (self._rx_header[3] << 8)
+                if length > MAX_PAYLOAD:
+                    self._nak(self._rx_header[1])
+                    self._rx_state = 0
+                    continue
+                self._rx_length = length
+                self._rx_body = bytearray()
+                self._rx_state = 2
+            elif self._rx_state == 2:
+                self._rx_body.append(byte)
+                if len(self._rx_body) < self._rx_length + 2:
+                    continue
+                self._rx_state = 0
+                payload = bytes(self._rx_body[:self._rx_length])
+                received_crc = self._rx_body[-2] | (self._rx_body[-1] << 8)
+                if crc16(bytes(self._rx_header) + payload) != received_crc:
+                    self._nak(self._rx_header[1])
+                    continue
+                self.frames_received += 1
+                return self._rx_header[0], self._rx_header[1], payload
+
+    def _nak(self, seq):
+        self.naks_sent += 1
+        self._send_frame(FRAME_NAK, seq)
+        self._note_link_error()
+
+    def _note_link_error(self):
+        self._link_errors += 1
+        if self.link_rate != BASE_BAUD and self._link_errors >= MAX_LINK_ERRORS:
+            self._switch_link_rate(BASE_BAUD)
+            self._baud_pending = False
+            self._println("Link errors, back to 9600 baud")
+
+    def _switch_link_rate(self, rate):
+        self.link_rate = rate
+        self._link_errors = 0
+        self._rx_state = 0
+
+    def _move_servo(self, target):
+        steps = abs(target - self.current_pos)
+        self.current_pos = target
+        return self._delay(steps * SERVO_STEP_DELAY)
+
+    def _handle_frame(self, raw_type, seq, payload):
+        if self.stall_rate and self.random.random() < self.stall_rate:
+            self._record("stall", seq)
+            self._busy = True
+            stalled = self._delay(self.stall_duration)
+            self._busy = False
+            if not stalled:
+                return
+
+        frame_type = raw_type & ~FRAME_RETRY
+        self._send_frame(FRAME_ACK, seq)
+
+        if frame_type == FRAME_PING:
+            self._send_frame(FRAME_DONE, seq, payload)
+            return
+
+        if frame_type == FRAME_IDENT:
+            self._send_frame(FRAME_DONE, seq, b"printer")
+            return
+
+        if frame_type == FRAME_BAUD:
+            rate = struct.unpack('<I', payload)[0] if len(payload) == 4 else 0
+            if rate not in SUPPORTED_RATES:
+                self._send_frame(FRAME_DONE, seq, b"NOBAUD")
+                return
+            self._send_frame(FRAME_DONE, seq, b"BAUD")
+            self._switch_link_rate(rate)
+            self._baud_pending = True
+            self._baud_deadline = time.monotonic() + BAUD_CONFIRM_TIMEOUT * self.time_scale
+            return
+
+        if raw_type & FRAME_RETRY and seq == self._last_seq and frame_type == self._last_type:
+            # Our ACK was lost and the host resent a command we already ran
+            self._send_frame(FRAME_DONE, seq, self._last_status.encode('utf-8'))
+            return
+
+        self.commands += 1
+        self._busy = True
+        try:
+            finished = self._run_command(frame_type, payload)
+        finally:
+            self._busy = False
+        if not finished:
+            return
+
+        self._last_seq = seq
+        self._last_type = frame_type
+        self._send_frame(FRAME_DONE, seq, self._last_status.encode('utf-8'))
+
+        if self.disconnect_every and self.commands % self.disconnect_every == 0:
+            threading.Thread(target=self._bounce, name="VirtualArduinoReplug", daemon=True).start()
+
+    def _run_command(self, frame_type, payload):
+        """Run a command frame; returns False if unplugged part way."""
+        if frame_type == FRAME_OPEN:
+            self._record("open")
+            self._println("Opening curtains...")
+            if not self._move_servo(OPEN_POS):
+                return False
+            self._last_status = "Open"
+
+        elif frame_type == FRAME_CLOSE:
+            self._record("close")
+            self._println("Closing curtains...")
+            if not self._move_servo(CLOSE_POS):
+                return False
+            self._last_status = "Closed"
+
+        elif frame_type == FRAME_PRINT:
+            text = payload.decode('utf-8', errors='replace')
+            self._print("Candle action start...")
+            self._record("candles_low")
+            if not self._delay(RITUAL_CANDLE_DELAY):
+                return False
+            self._record("candles_high")
+            if not self._delay(RITUAL_SETTLE_DELAY):
+                return False
+            if not self._print_fortune(text):
+                return False
+            self._last_status = "OK"
+
+        elif frame_type == FRAME_PRINT_NOW:
+            if not self._print_fortune(payload.decode('utf-8', errors='replace')):
+                return False
+            self._last_status = "OK"
+
+        elif frame_type == FRAME_STAGE:
+            token, newline, text = payload.decode('utf-8', errors='replace').partition("\n")
+            if not newline or len(token) > STAGE_TOKEN_MAX:
+                self._last_status = "NOSTAGE"
+            else:
+                self._staged_token = token
+                self._staged_text = text
+                self._println(f"Staged fortune {token}")
+                self._record("staged", token)
+                if not self._print_head():
+                    return False
+                self._last_status = "Staged"
+
+        elif frame_type == FRAME_COMMIT:
+            token = payload.decode('utf-8', errors='replace')
+            if not self._staged_token or token != self._staged_token:
+                self._last_status = "NOSTAGE"
+            else:
+                self._staged_token = ""
+                if not self._print_fortune(self._staged_text):
+                    return False
+                self._last_status = "OK"
+
+        elif frame_type == FRAME_CANCEL:
+            if payload.decode('utf-8', errors='replace') == self._staged_token:
+                self._staged_token = ""
+                self._staged_text = ""
+                self._record("cancelled")
+            self._last_status = "Cancelled"
+
+        elif frame_type == FRAME_CANDLES:
+            self._println("Candle trigger")
+            self._record("candles_low")
+            if not self._delay(CANDLE_PULSE):
+                return False
+            self._record("candles_high")
+            self._last_status = "Candles"
+
+        else:
+            self._print("Unknown frame type: ")
+            self._println(str(frame_type))
+            self._last_status = "Unknown"
+        return True
+
+    def _print_head(self):
+        """printFortuneHead(): the graphic, unless a staged slip has it."""
+        if self._head_printed:
+            return True
+        self._record("head_start")
+        if not self._delay(head_duration()):
+            return False
+        self._head_printed = True
+        return True
+
+    def _print_fortune(self, text):
+        """printFortune(); returns False if unplugged part way."""
+        self._print("Received fortune: ")
+        self._println(text)
+        self._record("print_start", text)
+        if not self._print_head():
+            return False
+        if not self._delay(print_duration(text) - head_duration()):
+            return False
+        self._head_printed = False
+        self.printed.append(text)
+        self._record("print_done", text)
+        self._println("Fortune printed successfully!")
+        return True
+
+    def _bounce(self):
+        """Automatic disconnect: unplug, wait, plug back in."""
+        self.unplug()
+        if not self._stop.wait(self.replug_delay):
+            self.plug_in()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the fortune printer Arduino on a pty.")
+    parser.add_argument("--link", default="/tmp/ttyFORTUNE",
+                        help="stable path symlinked to the pty (default: /tmp/ttyFORTUNE)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="multiplier for sketch delays (default: 1.0, real time)")
+    parser.add_argument("--no-wire-time", action="store_true",
+                        help="deliver bytes instantly instead of at the link rate")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="probability of losing each received byte")
+    parser.add_argument("--stall-rate", type=float, default=0.0,
+                        help="probability of a stall before handling a frame")
+    parser.add_argument("--stall-duration", type=float, default=2.0,
+                        help="seconds a stall lasts (default: 2.0)")
+    parser.add_argument("--disconnect-every", type=int, default=0,
+                        help="unplug after every N commands (default: never)")
+    parser.add_argument("--replug-delay", type=float, default=1.0,
+                        help="seconds before plugging back in (default: 1.0)")
+    parser.add_argument("--seed", type=int, help="random seed for fault injection")
+    args = parser.parse_args()
+
+    device = VirtualArduino(
+        link=args.link,
+        time_scale=args.time_scale,
+        wire_time=not args.no_wire_time,
+        drop_rate=args.drop_rate,
+        stall_rate=args.stall_rate,
+        stall_duration=args.stall_duration,
+        disconnect_every=args.disconnect_every,
+        replug_delay=args.replug_delay,
+        seed=args.seed,
+    )
+    port = device.start()
+    print(f"🤖 Virtual Arduino on {port} ({device.port})")
+    print(f"   Run the app with: ARDUINO_PORT={port} python app.py")
+    print("   Press Ctrl+C to stop")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+        print(f"\n🛑 Stopped. {device.commands} command(s), {len(device.printed)} fortune(s) printed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,37 +23,28 @@ printer_port = '/dev/ttyS0'
 #QUESTION_YOUR_DESTINY = "Destination"
 #RECEIVE_FATE = "Fate"
 
-texts = {}
+# The script is compiled once into an indexed bundle (see
+# fortune-teller/script_bundle.py); lookups by prefix no longer scan
+# every line
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'fortune-teller'))
+from script_bundle import load_bundle
+
+texts = None
 
 def prepare_game():
     tsv_file = 'Fortune cookie - Script.tsv'
 
-    # read tsv file into a list of lists
-    lines = []
-    with open(tsv_file, 'r') as file:
-        lines = file.readlines()
-        # remove the first line (header)
-        lines = lines[1:]
-
-    lines = [line.strip().split('\t') for line in lines]
-
-    # if any element in lines is len < 3, grow it to be at least len 3
-    lines = [line + [''] * (3 - len(line)) for line in lines]
-
     global texts
-    # create a map of texts, key = 0th, value = 2nd
-    texts = {line[0]:line[2] for line in lines}
-
-    #print (texts)
+    # rebuilt from the tsv file only when it has changed
+    texts = load_bundle(tsv_file)
     pass
 
 def get_texts(prefix):
     global texts
-    return [texts[key] for key in texts.keys() if key.startswith(prefix)]
+    return list(texts.texts(prefix))
 
 def get_random_text(prefix):
-    import random
-    return random.choice(get_texts(prefix)).replace('\\n', '\n')
+    return texts.random_text(prefix)
 
 def test():
     prepare_game()